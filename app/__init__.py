@@ -1,14 +1,57 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-
-# Create the Flask app
-app = Flask(__name__)
-
-# Load Config
-app.config.from_object('config')
-print('Database URI {}'.format(app.config['SQLALCHEMY_DATABASE_URI']))
-app.config['SQLALCHEMY_POOL_RECYCLE'] = 599
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
-
-from app import server, models
+from flask import Flask, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.sql.expression import SelectBase
+
+
+class RoutingSession(SignallingSession):
+    """ Session that runs the SELECTs of replica reads on the chosen replica
+
+    A request reads from a replica when app.replicas stored the bind
+    of one in g.replica_bind. Any other statement, and every statement
+    of a session with pending changes, goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        bind_key = g.get('replica_bind') if has_app_context() else None
+        if bind_key is not None and isinstance(clause, SelectBase) and \
+                not (self._flushing or self.new or self.dirty or self.deleted):
+            return db.get_engine(self.app, bind=bind_key)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """ Applies the pool size settings only to pooled databases """
+
+    def apply_driver_hacks(self, app, info, options):
+        # SQLite file databases use a NullPool that has no size to set
+        if info.drivername == 'sqlite':
+            for option in ('pool_size', 'pool_timeout', 'max_overflow'):
+                options.pop(option, None)
+        super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    # the replica binds copy the primary, so only its schema is managed
+    def create_all(self, bind=None, app=None):
+        super(PooledSQLAlchemy, self).create_all(bind, app)
+
+    def drop_all(self, bind=None, app=None):
+        super(PooledSQLAlchemy, self).drop_all(bind, app)
+
+
+# Create the Flask app
+app = Flask(__name__)
+
+# Load Config
+app.config.from_object('config')
+print('Database URI {}'.format(app.config['SQLALCHEMY_DATABASE_URI']))
+# Initialize SQLAlchemy
+db = PooledSQLAlchemy(app)
+
+# Initialize the read-through cache
+from app.cache import create_cache
+cache = create_cache(app.config)
+
+from app import server, models, jobs, idempotency, instrumentation, metrics, compression, \
+    replicas
@@ -0,0 +1,198 @@
+"""
+Cache module
+This module provides the read-through cache used by Order.get and
+Item.get. Entries live in a Redis server shared by every process or in
+an in-process LRU.
+
+A write evicts its rows from the cache it can reach, so an in-process
+LRU is only consistent when a single process serves the app. With more
+worker processes or instances, the others keep serving the old row,
+and its ETag, for up to CACHE_TTL seconds. CACHE_BACKEND=auto therefore
+picks redis when a server is bound, memory for a single process and no
+cache otherwise.
+"""
+
+import os
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Redis keys deleted per DEL command when the cache is cleared
+CLEAR_BATCH = 500
+
+
+class LRUBackend(object):
+    """ In-process least recently used cache with entries that expire """
+
+    def __init__(self, max_size=1024, ttl=60, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ Returns the value stored under key or None """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < self.clock():
+                return None
+            # put the entry back as the most recently used
+            self.entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        """ Stores a value under key, evicting the least recently used """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (self.clock() + self.ttl, value)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        """ Removes the given keys """
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry """
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend(object):
+    """ Cache kept in a Redis server so that every instance shares it
+
+    Args:
+        client: a redis.StrictRedis or any object with the same
+            get, setex, delete and scan_iter methods
+    """
+
+    def __init__(self, client, ttl=60, prefix='orders-cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """ Returns the value stored under key or None """
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        """ Stores a value under key for ttl seconds """
+        self.client.setex(self.prefix + key, self.ttl,
+                          pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def delete(self, *keys):
+        """ Removes the given keys """
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        """ Removes every entry written with this prefix
+
+        The keys are found with SCAN, which unlike KEYS does not block
+        the server while it walks a large keyspace, and are deleted
+        CLEAR_BATCH at a time.
+        """
+        batch = []
+        for key in self.client.scan_iter(match=self.prefix + '*', count=CLEAR_BATCH):
+            batch.append(key)
+            if len(batch) >= CLEAR_BATCH:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+
+class Cache(object):
+    """ Front end of a cache backend that counts hits and misses """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Returns the cached value of key or None on a miss """
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """ Caches a value under key """
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def invalidate(self, *keys):
+        """ Drops the given keys from the cache """
+        if self.backend is not None:
+            self.backend.delete(*keys)
+
+    def clear(self):
+        """ Drops every entry from the cache """
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """ Returns the hit and miss counters as a dictionary """
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+def single_process(config):
+    """ Returns whether one process serves every request, so a memory cache stays consistent """
+    # Cloud Foundry may run several instances of the app
+    return config.get('WEB_WORKERS', 1) <= 1 and 'VCAP_APPLICATION' not in os.environ
+
+def auto_backend(config):
+    """ Returns the backend CACHE_BACKEND=auto stands for """
+    if config.get('CACHE_REDIS_URL'):
+        return 'redis'
+    if single_process(config):
+        return 'memory'
+    return 'none'
+
+def create_cache(config):
+    """ Creates the Cache described by CACHE_BACKEND in the app config """
+    backend = config.get('CACHE_BACKEND', 'auto')
+    if backend == 'auto':
+        backend = auto_backend(config)
+    ttl = config.get('CACHE_TTL', 60)
+    if backend == 'memory':
+        if not single_process(config):
+            Cache.logger.warning('The memory cache is not shared, other processes serve '
+                                 'stale rows for up to %s seconds after a write', ttl)
+        return Cache(LRUBackend(config.get('CACHE_MAX_SIZE', 1024), ttl))
+    if backend == 'redis':
+        if redis is None:
+            Cache.logger.warning('redis is not installed, caching is disabled')
+            return Cache()
+        client = redis.StrictRedis.from_url(config.get('CACHE_REDIS_URL') or
+                                            'redis://localhost:6379/0')
+        return Cache(RedisBackend(client, ttl))
+    return Cache()
@@ -0,0 +1,187 @@
+"""
+Compression module
+This module compresses the responses of the service with the best
+content coding the client accepts: brotli when the brotli library is
+installed, otherwise gzip. Responses smaller than COMPRESS_MIN_SIZE are
+sent as they are, and streamed responses are compressed chunk by chunk
+as they are produced.
+
+The static assets are compressed ahead of time by compress_static into
+.br and .gz files next to the originals, which the static view then
+serves straight from disk.
+"""
+
+import os
+import zlib
+import logging
+import mimetypes
+from flask import request, send_from_directory, safe_join
+from . import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = set([
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+])
+
+# content coding: suffix of the pre-compressed static files
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def gzip_compressor(level):
+    """ Returns the compress and finish functions of a gzip stream """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compressor.compress, compressor.flush
+
+def brotli_compressor(level):
+    """ Returns the compress and finish functions of a brotli stream """
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+COMPRESSORS = {'gzip': gzip_compressor}
+if brotli is not None:
+    COMPRESSORS['br'] = brotli_compressor
+
+def compress(data, encoding, level):
+    """ Compresses a whole body with a content coding """
+    process, finish = COMPRESSORS[encoding](level)
+    return process(data) + finish()
+
+def compress_chunks(chunks, encoding, level):
+    """ Compresses a stream of chunks into one stream of a content coding """
+    process, finish = COMPRESSORS[encoding](level)
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def compression_level(encoding):
+    """ Returns the configured level of a content coding """
+    if encoding == 'br':
+        return app.config['COMPRESS_BROTLI_QUALITY']
+    return app.config['COMPRESS_LEVEL']
+
+def accepted_encoding():
+    """ Returns the preferred content coding the request accepts or None """
+    best = None
+    quality = 0
+    for encoding in ('br', 'gzip'):
+        if encoding in COMPRESSORS and request.accept_encodings[encoding] > quality:
+            best = encoding
+            quality = request.accept_encodings[encoding]
+    return best
+
+def is_compressible(response):
+    """ Returns True when a response may be compressed """
+    return (response.mimetype in COMPRESSIBLE_TYPES and
+            200 <= response.status_code < 300 and
+            response.status_code not in (204, 206) and
+            'Content-Encoding' not in response.headers)
+
+
+######################################################################
+# RESPONSE COMPRESSION
+######################################################################
+@app.after_request
+def compress_response(response):
+    """ Compresses a response with the content coding the client prefers """
+    if not app.config['COMPRESS_RESPONSES'] or not is_compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    level = compression_level(encoding)
+
+    if response.is_streamed:
+        chunks = response.iter_encoded()
+        if hasattr(response.response, 'close'):
+            response.call_on_close(response.response.close)
+        response.response = compress_chunks(chunks, encoding, level)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+
+    # the compressed body is another representation of the same data
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+######################################################################
+# STATIC ASSETS
+######################################################################
+def send_static(filename):
+    """ Sends a static file, or its pre-compressed copy when the client accepts it """
+    encoding = accepted_encoding()
+    if encoding is not None:
+        source = safe_join(app.static_folder, filename)
+        compressed = safe_join(app.static_folder, filename + SUFFIXES[encoding])
+        if source is not None and os.path.isfile(compressed) and \
+                os.path.getmtime(compressed) >= os.path.getmtime(source):
+            response = send_from_directory(app.static_folder, filename + SUFFIXES[encoding],
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    return app.send_static_file(filename)
+
+app.view_functions['static'] = send_static
+
+def compress_static(folder=None):
+    """
+    Writes a .gz and, with brotli installed, a .br copy of every static asset
+
+    Assets smaller than COMPRESS_MIN_SIZE or of a type that does not
+    compress are skipped, and so are copies newer than their asset.
+
+    Args:
+        folder (string): the directory to compress, the app's static folder by default
+
+    Returns:
+        List: the paths of the files written
+    """
+    folder = folder or app.static_folder
+    written = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] in ('.gz', '.br') or \
+                    mimetypes.guess_type(name)[0] not in COMPRESSIBLE_TYPES or \
+                    os.path.getsize(path) < app.config['COMPRESS_MIN_SIZE']:
+                continue
+            data = None
+            for encoding in sorted(COMPRESSORS):
+                target = path + SUFFIXES[encoding]
+                if os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as source:
+                        data = source.read()
+                # assets are compressed once so they get the highest level
+                with open(target, 'wb') as output:
+                    output.write(compress(data, encoding, 11 if encoding == 'br' else 9))
+                written.append(target)
+    logger.info('Compressed %d static file(s)', len(written))
+    return written
@@ -0,0 +1,151 @@
+"""
+JSON Encoder module
+This module writes the JSON of list and single row responses straight
+from result tuples. Each column is encoded by a function chosen once
+from its type and the row objects are assembled from a template, so no
+dictionary is built per row. Strings are escaped by the fastest JSON
+library installed: ujson, then simplejson, then the standard library.
+The output matches Flask's jsonify: sorted keys and dates in the HTTP
+date format.
+"""
+
+import json as std_json
+from sqlalchemy import Boolean, DateTime, Float, Integer
+from . import app
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def ujson_dumps(value):
+    """ Encodes a value with ujson """
+    return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False)
+
+def compact_dumps(module):
+    """ Returns a dumps function of a json compatible module without whitespace """
+    def dumps(value):
+        """ Encodes a value without whitespace """
+        return module.dumps(value, separators=(',', ':'))
+    return dumps
+
+BACKENDS = {
+    'json': compact_dumps(std_json),
+}
+if simplejson is not None:
+    BACKENDS['simplejson'] = compact_dumps(simplejson)
+if ujson is not None:
+    BACKENDS['ujson'] = ujson_dumps
+
+def get_dumps(name='auto'):
+    """ Returns the dumps function of a backend, auto picks the fastest installed """
+    if name == 'auto':
+        for name in ('ujson', 'simplejson', 'json'):
+            if name in BACKENDS:
+                break
+    if name not in BACKENDS:
+        raise ValueError('JSON backend {} is not installed'.format(name))
+    return BACKENDS[name]
+
+
+######################################################################
+# COLUMN ENCODERS
+######################################################################
+def encode_int(value):
+    """ Encodes an integer column """
+    return 'null' if value is None else str(int(value))
+
+def encode_float(value):
+    """ Encodes a float column with the shortest exact representation """
+    return 'null' if value is None else repr(float(value))
+
+def encode_bool(value):
+    """ Encodes a boolean column """
+    if value is None:
+        return 'null'
+    return 'true' if value else 'false'
+
+def encode_date(value):
+    """ Encodes a datetime column as an HTTP date like Flask's encoder """
+    if value is None:
+        return 'null'
+    return '"{}, {:02d} {} {:04d} {:02d}:{:02d}:{:02d} GMT"'.format(
+        WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second)
+
+def encode_json(value):
+    """ Returns a value the caller already encoded as JSON """
+    return value
+
+def column_encoder(column, dumps):
+    """ Returns the function that encodes the values of a column """
+    if isinstance(column.type, Boolean):
+        return encode_bool
+    if isinstance(column.type, Integer):
+        return encode_int
+    if isinstance(column.type, Float):
+        return encode_float
+    if isinstance(column.type, DateTime):
+        return encode_date
+    return dumps
+
+
+class RowEncoder(object):
+    """ Encodes rows holding the given columns as JSON objects
+
+    Args:
+        columns (list): the table columns in the order of the row values
+        dumps: the function that encodes the other values, strings mostly
+        nested (tuple): names of fields whose JSON the caller encodes,
+            such as the Items of an Order, their values follow the columns
+    """
+
+    def __init__(self, columns, dumps=None, nested=()):
+        dumps = dumps or get_dumps()
+        self.columns = list(columns)
+        self.names = [column.name for column in self.columns]
+        keys = self.names + list(nested)
+        encoders = [column_encoder(column, dumps) for column in self.columns] + \
+            [encode_json] * len(nested)
+        # keys are sorted like jsonify does
+        order = sorted(range(len(keys)), key=lambda index: keys[index])
+        self.fields = [(index, encoders[index]) for index in order]
+        self.template = '{' + ','.join(
+            '{}:%s'.format(dumps(keys[index])) for index in order) + '}'
+
+    def encode(self, row):
+        """ Returns a row tuple as a JSON object """
+        return self.template % tuple(encode(row[index]) for index, encode in self.fields)
+
+    def encode_batch(self, rows):
+        """ Returns the JSON object of each row tuple """
+        return [self.encode(row) for row in rows]
+
+    def encode_rows(self, rows):
+        """ Returns row tuples as a JSON array """
+        return '[' + ','.join(self.encode_batch(rows)) + ']'
+
+    def values(self, instance):
+        """ Returns the row tuple of a model instance """
+        return tuple(getattr(instance, name) for name in self.names)
+
+ENCODERS = {}
+
+def row_encoder(model, nested=()):
+    """ Returns the RowEncoder of a model's columns using the configured backend """
+    encoder = ENCODERS.get((model, nested))
+    if encoder is None:
+        encoder = RowEncoder(model.__table__.columns, get_dumps(app.config['JSON_ENCODER']),
+                             nested)
+        ENCODERS[(model, nested)] = encoder
+    return encoder
@@ -0,0 +1,85 @@
+"""
+Order Export module
+This module writes Orders joined with their Items, the rows of
+Order.export_rows, as NDJSON or CSV. GET /orders/export streams the
+output and export Jobs write it in the background.
+
+An NDJSON line is the document GET /orders?expand=items returns for
+the Order, encoded by the same RowEncoders as the other responses.
+"""
+
+import csv
+from datetime import datetime
+from StringIO import StringIO
+from itertools import chain
+from .encoder import row_encoder
+from .models import Order, Item
+
+# the Order columns come first in an export row
+ORDER_COLUMNS = len(Order.__table__.columns)
+
+
+def export_ndjson(rows, batch_size):
+    """ Yields an Order with its Items per line, batch_size lines per chunk """
+    order_encoder = row_encoder(Order, ('items',))
+    item_encoder = row_encoder(Item)
+    lines = []
+    order = None
+    items = []
+    for row in chain(rows, [None]):
+        if order is not None and (row is None or row[0] != order[0]):
+            lines.append(order_encoder.encode(order + ('[' + ','.join(items) + ']',)) + '\n')
+            if row is None or len(lines) >= batch_size:
+                yield ''.join(lines)
+                lines = []
+        if row is None:
+            break
+        if order is None or row[0] != order[0]:
+            order = tuple(row[:ORDER_COLUMNS])
+            items = []
+        if row[ORDER_COLUMNS] is not None:
+            items.append(item_encoder.encode(row[ORDER_COLUMNS:]))
+    if lines:
+        yield ''.join(lines)
+
+def csv_value(value):
+    """ Returns a value as the csv module writes it """
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def export_csv(rows, batch_size):
+    """ Yields a CSV row per Item, or per Order without Items, in chunks """
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow([name for _, name in CSV_COLUMNS])
+    count = 0
+    for row in rows:
+        writer.writerow([csv_value(row[index]) for index, _ in CSV_COLUMNS])
+        count += 1
+        if count % batch_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+def csv_columns():
+    """ Returns (row index, header) of the CSV columns, the Item order_id left out """
+    columns = []
+    for offset, model, prefix in ((0, Order, 'order_'), (ORDER_COLUMNS, Item, 'item_')):
+        for index, column in enumerate(model.__table__.columns, offset):
+            if model is Item and column.name == 'order_id':
+                continue
+            name = prefix + column.name if column.name in ('id', 'version') else column.name
+            columns.append((index, name))
+    return columns
+
+CSV_COLUMNS = csv_columns()
+
+# format: (writer, mimetype)
+EXPORT_FORMATS = {
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+    'csv': (export_csv, 'text/csv'),
+}
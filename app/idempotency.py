@@ -0,0 +1,195 @@
+"""
+Idempotency Keys module
+This module lets clients retry a POST safely. A request that carries
+an Idempotency-Key header claims the key by inserting it into the
+idempotency_keys table before the view runs, and its successful
+response is stored with the key. A repeat of the request is answered
+from the table without running the view again.
+
+The primary key makes sure that only one request can claim a key, so
+requests that arrive while the first one is still running wait for its
+response, for at most IDEMPOTENCY_WAIT_SECONDS. A stored response is
+kept for IDEMPOTENCY_TTL seconds. A failed request releases its key so
+it can be retried, and the key of a request that never finished, such
+as one whose worker was killed, expires after IDEMPOTENCY_LOCK_SECONDS
+and is taken over by the next request.
+"""
+
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, make_response, abort
+from sqlalchemy.exc import IntegrityError
+from . import app, db
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+PURGE_SECONDS = 60
+REPLAYED_HEADERS = ('Location', 'ETag')
+
+
+class IdempotencyKey(db.Model):
+    """ Model for an Idempotency Key and the response to its request """
+    logger = logging.getLogger(__name__)
+
+    __tablename__ = "idempotency_keys"
+    key = db.Column(db.String(MAX_KEY_LENGTH), primary_key=True)
+    fingerprint = db.Column(db.String(40), nullable=False)
+    status_code = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    headers = db.Column(db.Text)
+    mimetype = db.Column(db.String(80))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    last_purge = 0.0
+
+    def __repr__(self):
+        return '<IdempotencyKey %r>' % (self.key)
+
+    @staticmethod
+    def claim(key, fingerprint):
+        """
+        Saves a new pending key, or takes over the key when it expired
+
+        The pending key expires after IDEMPOTENCY_LOCK_SECONDS. Taking
+        over is a conditional UPDATE, so only one request gets the key.
+
+        Returns:
+            boolean: False when another request holds the key
+        """
+        now = datetime.utcnow()
+        IdempotencyKey.purge_expired(now)
+        expires_at = now + timedelta(seconds=app.config['IDEMPOTENCY_LOCK_SECONDS'])
+        # a Core INSERT, as the expired row may be in the session already
+        insert = IdempotencyKey.__table__.insert().values(key=key, fingerprint=fingerprint,
+                                                          expires_at=expires_at)
+        try:
+            db.session.execute(insert)
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+        taken = IdempotencyKey.query \
+            .filter(IdempotencyKey.key == key, IdempotencyKey.expires_at <= now) \
+            .update({IdempotencyKey.fingerprint: fingerprint,
+                     IdempotencyKey.status_code: None,
+                     IdempotencyKey.body: None,
+                     IdempotencyKey.headers: None,
+                     IdempotencyKey.mimetype: None,
+                     IdempotencyKey.created_at: now,
+                     IdempotencyKey.expires_at: expires_at},
+                    synchronize_session=False)
+        db.session.commit()
+        if taken:
+            IdempotencyKey.logger.info('Took over expired idempotency key %s', key)
+        return bool(taken)
+
+    @staticmethod
+    def find(key):
+        """ Returns the key as it is now in the database or None when it expired """
+        # a new transaction sees the changes of the request holding the key
+        db.session.rollback()
+        row = IdempotencyKey.query.get(key)
+        if row is not None and row.expires_at <= datetime.utcnow():
+            return None
+        return row
+
+    @staticmethod
+    def complete(key, response):
+        """ Stores the response of the request that holds the key """
+        headers = '\n'.join('{}: {}'.format(name, response.headers[name])
+                            for name in REPLAYED_HEADERS if name in response.headers)
+        expires_at = datetime.utcnow() + timedelta(seconds=app.config['IDEMPOTENCY_TTL'])
+        IdempotencyKey.query.filter(IdempotencyKey.key == key) \
+            .update({IdempotencyKey.status_code: response.status_code,
+                     IdempotencyKey.body: response.get_data(),
+                     IdempotencyKey.headers: headers,
+                     IdempotencyKey.mimetype: response.mimetype,
+                     IdempotencyKey.expires_at: expires_at},
+                    synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def release(key):
+        """ Deletes a key so that its request can run again """
+        db.session.rollback()
+        IdempotencyKey.query.filter(IdempotencyKey.key == key).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def purge_expired(now):
+        """ Deletes the expired keys, at most once every PURGE_SECONDS per process """
+        if time.time() - IdempotencyKey.last_purge < PURGE_SECONDS:
+            return
+        IdempotencyKey.last_purge = time.time()
+        count = IdempotencyKey.query.filter(IdempotencyKey.expires_at <= now) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        if count:
+            IdempotencyKey.logger.info('Purged %d expired idempotency keys', count)
+
+    def replay(self):
+        """ Returns the stored response of the key """
+        response = make_response(self.body, self.status_code)
+        response.mimetype = self.mimetype
+        for line in self.headers.splitlines():
+            name, value = line.split(': ', 1)
+            response.headers[name] = value
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+
+def request_fingerprint():
+    """ Returns a hash of the request a key may only be used for """
+    return hashlib.sha1(request.method + request.path + request.get_data()).hexdigest()
+
+def wait_for(key, fingerprint):
+    """ Returns the key once its response is stored, None when it was released """
+    deadline = time.time() + app.config['IDEMPOTENCY_WAIT_SECONDS']
+    while True:
+        row = IdempotencyKey.find(key)
+        if row is None:
+            return None
+        if row.fingerprint != fingerprint:
+            abort(422, 'The Idempotency-Key was used for another request')
+        if row.status_code is not None:
+            return row
+        if time.time() >= deadline:
+            abort(409, 'A request with this Idempotency-Key is still in progress')
+        time.sleep(POLL_SECONDS)
+
+
+def idempotent(view):
+    """ Decorates a view so that requests repeating an Idempotency-Key replay its response """
+    @wraps(view)
+    def run_once(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(400, 'Idempotency-Key must be at most {} characters'.format(MAX_KEY_LENGTH))
+        fingerprint = request_fingerprint()
+        while not IdempotencyKey.claim(key, fingerprint):
+            row = wait_for(key, fingerprint)
+            if row is not None:
+                logger.info('Replaying the response of idempotency key %s', key)
+                return row.replay()
+            # the request holding the key failed or its lock expired, claim it again
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            IdempotencyKey.release(key)
+            raise
+        if 200 <= response.status_code < 300:
+            IdempotencyKey.complete(key, response)
+        else:
+            IdempotencyKey.release(key)
+        return response
+    return run_once
@@ -0,0 +1,253 @@
+"""
+Bulk Import module
+This module streams orders with nested items from NDJSON or CSV files
+into the database. Rows are validated with Order.deserialize and
+Item.deserialize and written in batches, optionally spread over a
+pool of worker processes. Rows that fail are reported and skipped.
+
+NDJSON files hold one order per line in the same format as the body
+of POST /orders. CSV files hold one item per row with the columns
+order_ref, customer_id, date, status, product_id, name, quantity and
+price; consecutive rows with the same order_ref make up one order and
+a row with empty item columns is an order without items.
+
+Like the seeder, the importer reserves the order ids after the largest
+existing id, a consecutive range per batch, so each batch is written
+with one executemany of its orders and multi-row INSERTs of its items
+without reading generated ids back. A batch whose ids were taken in
+the meantime fails and is saved order by order with generated ids.
+"""
+
+import csv
+import json
+import time
+import logging
+import multiprocessing
+from collections import deque
+from sqlalchemy.exc import SQLAlchemyError
+from . import db
+from .models import Order, Item, DataValidationError
+from .seeder import next_id
+
+logger = logging.getLogger(__name__)
+
+# Item rows per INSERT statement, kept below the SQLite bind parameter limit
+INSERT_ROWS = 150
+# Rejected rows kept in the summary, the rest are only logged
+MAX_ERRORS = 100
+
+
+######################################################################
+# READERS
+######################################################################
+def read_ndjson(stream):
+    """ Yields (line, order, error) for every non blank line of an NDJSON stream """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text), None
+        except ValueError as error:
+            yield line, None, 'Invalid JSON: {}'.format(error)
+
+def read_csv(stream):
+    """ Yields (line, order, error) grouping the CSV rows of each order_ref """
+    reader = csv.DictReader(stream)
+    current_ref = None
+    order = None
+    first_line = None
+    for row in reader:
+        line = reader.line_num
+        if first_line is None or row.get('order_ref') != current_ref:
+            if order is not None:
+                yield first_line, order, None
+            current_ref = row.get('order_ref')
+            first_line = line
+            order = {
+                'customer_id': row.get('customer_id'),
+                'date': row.get('date'),
+                'status': row.get('status'),
+                'items': [],
+            }
+        if order is None or (not row.get('name') and not row.get('product_id')):
+            continue
+        try:
+            order['items'].append({
+                'product_id': int(row['product_id']),
+                'name': row['name'],
+                'quantity': int(row['quantity']),
+                'price': float(row['price']),
+            })
+        except (KeyError, TypeError, ValueError):
+            yield first_line, None, 'Invalid item on line {}'.format(line)
+            # skip the remaining rows of the rejected order
+            order = None
+    if order is not None:
+        yield first_line, order, None
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+def batches(records, batch_size):
+    """ Groups an iterable into lists of batch_size records """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+######################################################################
+# WRITERS
+######################################################################
+def build(data):
+    """ Returns the Order and Items described by an imported record """
+    order = Order().deserialize(data)
+    items = [Item().deserialize(item, None) for item in data.get('items') or []]
+    order.set_totals(items)
+    return order, items
+
+def import_batch(records, first_id):
+    """
+    Validates and saves a batch of orders in one transaction
+
+    Args:
+        records (list): (line, order, error) tuples from a reader
+        first_id (integer): the first of the len(records) ids reserved for the batch
+
+    Returns:
+        tuple: (orders saved, items saved, list of (line, error))
+    """
+    valid = []
+    errors = []
+    for line, data, error in records:
+        if error:
+            errors.append((line, error))
+            continue
+        try:
+            build(data)
+        except (DataValidationError, ValueError, AttributeError) as error:
+            errors.append((line, str(error) or 'Invalid order'))
+            continue
+        valid.append((line, data))
+
+    orders, items = save_batch(valid, errors, first_id)
+    if orders < len(valid) and len(valid) > 1:
+        # find the rows the database refused by saving them one by one
+        orders = items = 0
+        for entry in valid:
+            saved_orders, saved_items = save_batch([entry], errors)
+            orders += saved_orders
+            items += saved_items
+    return orders, items, errors
+
+def save_batch(records, errors, first_id=None):
+    """
+    Saves (line, order) records in one transaction, returns what was saved
+
+    With first_id the orders get consecutive ids from it and are inserted
+    with one executemany. Without it each order is flushed on its own to
+    read back its generated id.
+    """
+    if not records:
+        return 0, 0
+    try:
+        built = [build(data) for _, data in records]
+        if first_id is None:
+            db.session.add_all([order for order, _ in built])
+            db.session.flush()
+        else:
+            for order_id, (order, _) in enumerate(built, first_id):
+                order.id = order_id
+            db.session.execute(Order.__table__.insert(), [order.as_row() for order, _ in built])
+        rows = []
+        for order, items in built:
+            for item in items:
+                item.order_id = order.id
+                rows.append(item.as_row())
+        for start in range(0, len(rows), INSERT_ROWS):
+            db.session.execute(Item.__table__.insert().values(rows[start:start + INSERT_ROWS]))
+        db.session.commit()
+        return len(records), len(rows)
+    except SQLAlchemyError as error:
+        db.session.rollback()
+        if len(records) == 1:
+            errors.append((records[0][0], str(getattr(error, 'orig', error))))
+        return 0, 0
+    finally:
+        db.session.expunge_all()
+
+def init_worker():
+    """ Makes a worker process open its own database connections """
+    db.engine.dispose()
+
+def import_stream(stream, file_format='ndjson', batch_size=1000, workers=1):
+    """
+    Imports every order of a stream
+
+    Args:
+        stream (file): the NDJSON or CSV data
+        file_format (string): 'ndjson' or 'csv'
+        batch_size (integer): the number of orders saved per transaction
+        workers (integer): the number of processes saving batches
+
+    Returns:
+        dict: the number of orders, items and rejected rows, the first
+            MAX_ERRORS errors, the elapsed seconds and rows per second
+    """
+    summary = {'orders': 0, 'items': 0, 'rejected': 0, 'errors': []}
+    start = time.time()
+
+    def add(result):
+        orders, items, errors = result
+        summary['orders'] += orders
+        summary['items'] += items
+        summary['rejected'] += len(errors)
+        for line, error in errors:
+            logger.warning('Rejected line %s: %s', line, error)
+        summary['errors'].extend(errors[:MAX_ERRORS - len(summary['errors'])])
+        elapsed = time.time() - start
+        logger.info('Imported %s orders and %s items (%.0f rows/sec)',
+                    summary['orders'], summary['items'],
+                    (summary['orders'] + summary['items']) / elapsed if elapsed else 0)
+
+    records = READERS[file_format](stream)
+    first_id = next_id(Order)
+    db.session.rollback()
+    if workers > 1:
+        db.engine.dispose()
+        pool = multiprocessing.Pool(workers, initializer=init_worker)
+        try:
+            # keep a bounded number of batches in flight so memory stays flat
+            pending = deque()
+            for batch in batches(records, batch_size):
+                pending.append(pool.apply_async(import_batch, (batch, first_id)))
+                first_id += len(batch)
+                if len(pending) >= workers * 2:
+                    add(pending.popleft().get())
+            while pending:
+                add(pending.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for batch in batches(records, batch_size):
+            add(import_batch(batch, first_id))
+            first_id += len(batch)
+
+    summary['seconds'] = time.time() - start
+    rows = summary['orders'] + summary['items']
+    summary['rows_per_second'] = rows / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+def import_file(path, file_format=None, batch_size=1000, workers=1):
+    """ Imports every order of an NDJSON or CSV file, guessing the format from its name """
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    with open(path, 'rb' if file_format == 'csv' else 'r') as stream:
+        return import_stream(stream, file_format, batch_size, workers)
@@ -0,0 +1,116 @@
+"""
+Instrumentation module
+This module times every statement run through SQLAlchemy and keeps
+per request counters of the statements and the database time. The
+counters feed the metrics, the X-DB-Query-Count and X-DB-Time-Ms
+response headers, the slow query log and the N+1 query detector.
+See the DB_STATS_HEADERS, SLOW_QUERY_MS and QUERY_REPEAT_LIMIT
+settings in config.py.
+"""
+
+import re
+import time
+import logging
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import app
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(__name__ + '.slow_queries')
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """ Returns a statement with its whitespace collapsed
+
+    Parameters are bound separately, so two executions with the same
+    shape only differ by their parameters.
+    """
+    return WHITESPACE.sub(' ', statement).strip()
+
+def request_name():
+    """ Returns the method and route of the current request """
+    if not has_request_context():
+        return 'no request'
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return '{} {}'.format(request.method, rule)
+
+def repeat_limit():
+    """
+    Returns how many times a request may run a statement, 0 for no limit
+
+    Tests always check for N+1 queries, with TESTING_QUERY_REPEAT_LIMIT
+    when QUERY_REPEAT_LIMIT turns the check off.
+    """
+    if app.config['QUERY_REPEAT_LIMIT'] or not app.testing:
+        return app.config['QUERY_REPEAT_LIMIT']
+    return app.config['TESTING_QUERY_REPEAT_LIMIT']
+
+def repeated_statements(shapes, limit):
+    """ Returns (count, shape) of the statements run more than limit times """
+    return [(count, shape) for shape, count in shapes.most_common() if count > limit]
+
+
+######################################################################
+# REQUEST HOOKS
+######################################################################
+@app.before_request
+def start_request():
+    """ Resets the database counters of a request """
+    g.db_queries = 0
+    g.db_time = 0.0
+    g.db_shapes = Counter() if repeat_limit() else None
+
+@app.after_request
+def finish_request(response):
+    """ Adds the database headers and checks for repeated statements """
+    if 'db_queries' not in g:
+        return response
+    if app.config['DB_STATS_HEADERS']:
+        response.headers['X-DB-Query-Count'] = str(g.db_queries)
+        response.headers['X-DB-Time-Ms'] = '{:.2f}'.format(g.db_time * 1000)
+    limit = repeat_limit()
+    if limit and g.db_shapes:
+        repeated = repeated_statements(g.db_shapes, limit)
+        if repeated:
+            message = 'Possible N+1 queries in {}: {}'.format(
+                request_name(), '; '.join('{} x {}'.format(count, shape)
+                                          for count, shape in repeated))
+            if app.testing:
+                raise AssertionError(message)
+            logger.warning(message)
+    return response
+
+
+######################################################################
+# DATABASE HOOKS
+######################################################################
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    """ Remembers when a statement started """
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    """ Adds a statement to the counters of the current request """
+    elapsed = time.time() - conn.info['query_start_time'].pop()
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        slow_query_logger.warning('Slow query (%.1f ms) in %s: %s',
+                                  elapsed * 1000, request_name(), statement_shape(statement))
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+        if g.db_shapes is not None:
+            g.db_shapes[statement_shape(statement)] += 1
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query(context):
+    """ Drops the start time of a statement that failed """
+    if context.connection is None:
+        return
+    start_times = context.connection.info.get('query_start_time')
+    if start_times:
+        start_times.pop()
@@ -0,0 +1,443 @@
+"""
+Background Jobs module
+This module runs long bulk operations outside of the HTTP request in
+a bounded pool of threads. Every job is a row of the jobs table, so
+any instance can report its progress or cancel it, while the instance
+that accepted it does the work in batches and records its progress
+after each one.
+
+Kinds of job and their params:
+    - purge: delete the Orders selected by ids and/or a filter
+    - status: move the selected Orders to the status in params
+    - rebuild_totals: recompute item_count and order_total of the
+      selected Orders, or of every Order with {"all": true}
+    - export: write the selected Orders, or every Order, with their
+      Items in the format in params (ndjson or csv) to the job_files
+      table, from which any instance serves GET /jobs/<id>/file
+
+The params are checked when the Job is created. A filter must only
+hold names of Order.FILTERS with values, so a misspelled or blank
+filter is rejected instead of selecting every Order.
+
+A Job records a heartbeat with its progress. When a worker starts,
+recover_jobs fails the running Jobs whose heartbeat is older than
+JOB_STALE_SECONDS, since the worker running them stopped, and submits
+the pending Jobs again, which may have been queued in such a worker.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from concurrent.futures import ThreadPoolExecutor
+from . import app, db, cache
+from .models import Order, DataValidationError, check_filters, filter_query, keyset_batches
+from .export import EXPORT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job when its cancellation was requested """
+    pass
+
+
+class Job(db.Model):
+    """ Model for a background Job """
+    logger = logging.getLogger(__name__)
+
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=PENDING, index=True)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    total = db.Column(db.Integer)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Job %r>' % (self.id)
+
+    def serialize(self):
+        """
+        Serializes a Job into a dictionary with its progress and throughput
+
+        Returns:
+            dict
+        """
+        rows_per_second = None
+        if self.started_at is not None:
+            elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+            rows_per_second = self.processed / elapsed if elapsed > 0 else 0.0
+        return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "params": json.loads(self.params),
+                "total": self.total,
+                "processed": self.processed,
+                "progress": float(self.processed) / self.total if self.total else None,
+                "rows_per_second": rows_per_second,
+                "result": json.loads(self.result) if self.result else None,
+                "error": self.error,
+                "cancel_requested": self.cancel_requested,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                }
+
+    @staticmethod
+    def create(kind, params):
+        """
+        Saves a new pending Job
+
+        Raises:
+            DataValidationError: when the kind or params are not valid
+        """
+        if kind not in HANDLERS:
+            raise DataValidationError('kind must be one of {}'.format(
+                ', '.join(sorted(HANDLERS))))
+        if not isinstance(params, dict):
+            raise DataValidationError('params must be an object')
+        SELECTIONS[kind](params)
+        job = Job(kind=kind, params=json.dumps(params))
+        db.session.add(job)
+        db.session.commit()
+        Job.logger.info('Created job %s (%s)', job.id, kind)
+        return job
+
+    @staticmethod
+    def get(job_id):
+        """ Finds a Job by its id """
+        return Job.query.get(job_id)
+
+    def cancel(self):
+        """
+        Cancels a pending Job or asks a running Job to stop after its batch
+
+        Returns:
+            boolean: False when the Job had already finished
+        """
+        if self.status in FINISHED:
+            return False
+        Job.query.filter(Job.id == self.id, Job.status == PENDING) \
+            .update({Job.status: CANCELLED, Job.finished_at: datetime.utcnow()},
+                    synchronize_session=False)
+        Job.query.filter(Job.id == self.id).update({Job.cancel_requested: True},
+                                                  synchronize_session=False)
+        db.session.commit()
+        return True
+
+
+class JobFile(db.Model):
+    """ Model for a chunk of the file written by a Job, stored in order of part """
+    __tablename__ = "job_files"
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), primary_key=True)
+    part = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # MEDIUMBLOB on MySQL, a chunk holds JOB_BATCH_SIZE Orders
+    data = db.Column(db.LargeBinary(2 ** 24 - 1), nullable=False)
+
+    @staticmethod
+    def write(job_id, part, data):
+        """ Adds a chunk to the current transaction """
+        db.session.execute(JobFile.__table__.insert().values(job_id=job_id, part=part,
+                                                             data=data))
+
+    @staticmethod
+    def read(job_id):
+        """ Yields the chunks of the file of a Job, one row fetched at a time """
+        rows = db.session.query(JobFile.data).filter(JobFile.job_id == job_id) \
+            .order_by(JobFile.part).yield_per(1)
+        for data, in rows:
+            yield data
+
+    @staticmethod
+    def remove(job_ids):
+        """ Deletes the chunks of the files of Jobs, the caller commits """
+        JobFile.query.filter(JobFile.job_id.in_(job_ids)).delete(synchronize_session=False)
+
+
+class Progress(object):
+    """ Records the progress of a running Job and stops it when cancelled """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.processed = 0
+
+    def start(self, total):
+        """ Records the number of rows the Job will process """
+        Job.query.filter(Job.id == self.job_id).update({Job.total: total,
+                                                       Job.heartbeat_at: datetime.utcnow()},
+                                                      synchronize_session=False)
+        db.session.commit()
+
+    def advance(self, count):
+        """ Adds count processed rows, raises JobCancelled when asked to stop """
+        self.processed += count
+        Job.query.filter(Job.id == self.job_id).update({Job.processed: self.processed,
+                                                       Job.heartbeat_at: datetime.utcnow()},
+                                                      synchronize_session=False)
+        db.session.commit()
+        cancel_requested = db.session.query(Job.cancel_requested) \
+            .filter(Job.id == self.job_id).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+######################################################################
+# JOB HANDLERS
+######################################################################
+def select_orders(params, everything=False):
+    """
+    Returns a query of the ids of the Orders selected by the ids and filter params
+
+    Args:
+        params (dict): the params of a Job
+        everything (boolean): whether {"all": true} may select every Order
+
+    Raises:
+        DataValidationError: when the ids or filter are not valid, or select nothing
+    """
+    order_ids = params.get('ids') or []
+    args = params.get('filter') or {}
+    if not isinstance(order_ids, list) or not isinstance(args, dict):
+        raise DataValidationError('ids must be a list and filter an object')
+    check_filters(Order, args)
+    if not order_ids and not args and not (everything and params.get('all') is True):
+        raise DataValidationError('ids or a filter of the orders are required')
+    query = filter_query(db.session.query(Order.id), Order, args)
+    if order_ids:
+        try:
+            query = query.filter(Order.id.in_([int(order_id) for order_id in order_ids]))
+        except (TypeError, ValueError):
+            raise DataValidationError('ids must be a list of integers')
+    return query
+
+def select_status_change(params):
+    """ Returns a query of the ids of the selected Orders that may move to the new status """
+    target = params.get('status')
+    if target not in Order.STATUS_TRANSITIONS:
+        raise DataValidationError('status must be one of {}'.format(
+            ', '.join(sorted(Order.STATUS_TRANSITIONS))))
+    return select_orders(params).filter(Order.status.in_(Order.STATUS_TRANSITIONS[target]))
+
+def select_rebuild(params):
+    """ Returns a query of the ids of the selected Orders, or of every Order """
+    return select_orders(params, everything=True)
+
+def select_export(params):
+    """ Returns a query of the ids of the Orders to export, every Order without ids or a filter """
+    if params.get('format', 'ndjson') not in EXPORT_FORMATS:
+        raise DataValidationError('format must be one of {}'.format(
+            ', '.join(sorted(EXPORT_FORMATS))))
+    if not params.get('ids') and not params.get('filter'):
+        return db.session.query(Order.id)
+    return select_orders(params)
+
+def id_batches(query):
+    """ Yields the ids of a query in lists of JOB_BATCH_SIZE """
+    for rows in keyset_batches(query, Order, app.config['JOB_BATCH_SIZE']):
+        yield [row.id for row in rows]
+
+def purge_orders(params, progress):
+    """ Deletes the selected Orders and their Items batch by batch """
+    query = select_orders(params)
+    progress.start(query.count())
+    deleted = 0
+    for order_ids in id_batches(query):
+        deleted += Order.remove_by_ids(order_ids, len(order_ids))
+        progress.advance(len(order_ids))
+    return {'deleted': deleted}
+
+def change_status(params, progress):
+    """ Moves the selected Orders to a new status batch by batch """
+    query = select_status_change(params)
+    target = params['status']
+    progress.start(query.count())
+    updated = 0
+    for order_ids in id_batches(query):
+        updated += Order.transition_status(target, order_ids, batch_size=len(order_ids))
+        progress.advance(len(order_ids))
+    return {'updated': updated}
+
+def rebuild_totals(params, progress):
+    """ Recomputes the summary columns of the selected Orders batch by batch """
+    query = select_rebuild(params)
+    progress.start(query.count())
+    try:
+        for order_ids in id_batches(query):
+            Order.refresh_totals(order_ids)
+            db.session.commit()
+            progress.advance(len(order_ids))
+    finally:
+        cache.clear()
+    return {'updated': progress.processed}
+
+def export_batches(query, progress):
+    """ Yields the export rows of the Orders of a query, one keyset batch at a time """
+    for order_ids in id_batches(query):
+        rows = Order.export_rows({}, len(order_ids)).filter(Order.id.in_(order_ids)).all()
+        for row in rows:
+            yield row
+        progress.advance(len(order_ids))
+
+def export_orders(params, progress):
+    """
+    Writes the selected Orders with their Items to the job_files table batch by batch
+
+    The rows of each batch are read before its progress is committed,
+    so no cursor stays open, and they are written by the same writers
+    as GET /orders/export. Every chunk is a row committed with the
+    progress, and the chunks of a Job that does not succeed are deleted.
+    """
+    query = select_export(params)
+    writer = EXPORT_FORMATS[params.get('format', 'ndjson')][0]
+    progress.start(query.count())
+    parts = size = 0
+    try:
+        for chunk in writer(export_batches(query, progress), app.config['JOB_BATCH_SIZE']):
+            if chunk:
+                JobFile.write(progress.job_id, parts, chunk)
+                parts += 1
+                size += len(chunk)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        JobFile.remove([progress.job_id])
+        db.session.commit()
+        raise
+    return {'exported': progress.processed, 'parts': parts, 'bytes': size}
+
+HANDLERS = {
+    'purge': purge_orders,
+    'status': change_status,
+    'rebuild_totals': rebuild_totals,
+    'export': export_orders,
+}
+
+# Checks the params of each kind of Job and returns the query of the
+# ids of the Orders it selects
+SELECTIONS = {
+    'purge': select_orders,
+    'status': select_status_change,
+    'rebuild_totals': select_rebuild,
+    'export': select_export,
+}
+
+
+######################################################################
+# RUNNER
+######################################################################
+def finish(job_id, status, values=None):
+    """ Records the end of a running Job, unless recover_jobs failed it already """
+    values = dict(values or {})
+    values[Job.status] = status
+    values[Job.finished_at] = datetime.utcnow()
+    Job.query.filter(Job.id == job_id, Job.status == RUNNING) \
+        .update(values, synchronize_session=False)
+    db.session.commit()
+
+def run_job(job_id):
+    """ Runs a pending Job, recording its outcome in the jobs table """
+    now = datetime.utcnow()
+    claimed = Job.query.filter(Job.id == job_id, Job.status == PENDING) \
+        .update({Job.status: RUNNING, Job.started_at: now, Job.heartbeat_at: now},
+                synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return
+    job = Job.query.get(job_id)
+    logger.info('Running job %s (%s)', job_id, job.kind)
+    try:
+        result = HANDLERS[job.kind](json.loads(job.params), Progress(job_id))
+    except JobCancelled:
+        db.session.rollback()
+        finish(job_id, CANCELLED)
+        logger.info('Cancelled job %s', job_id)
+    except Exception as error:
+        db.session.rollback()
+        logger.exception('Job %s failed', job_id)
+        finish(job_id, FAILED, {Job.error: str(error) or type(error).__name__})
+    else:
+        finish(job_id, SUCCEEDED, {Job.result: json.dumps(result)})
+        logger.info('Finished job %s', job_id)
+
+
+class JobRunner(object):
+    """ Bounded pool of threads that run Jobs, started on first use
+
+    The pool is created lazily so that every pre-forked worker process
+    gets its own threads. With no workers Jobs run in the caller.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, job_id):
+        """ Schedules a Job, returns its Future or None when it already ran """
+        if self.workers < 1:
+            run_job(job_id)
+            return None
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor.submit(self.run, job_id)
+
+    @staticmethod
+    def run(job_id):
+        """ Runs a Job in a pool thread with its own app context and session """
+        with app.app_context():
+            try:
+                run_job(job_id)
+            except Exception:
+                logger.exception('Could not run job %s', job_id)
+            finally:
+                db.session.remove()
+
+runner = JobRunner(app.config['JOB_WORKERS'])
+
+def recover_jobs():
+    """
+    Fails the running Jobs that lost their worker and resubmits the pending Jobs
+
+    Called when a worker starts. A pending Job is claimed atomically, so
+    one submitted by several workers still runs once. The partial files
+    of the failed Jobs are deleted.
+
+    Returns:
+        tuple: the number of Jobs failed and of Jobs submitted
+    """
+    stale = datetime.utcnow() - timedelta(seconds=app.config['JOB_STALE_SECONDS'])
+    stopped = [job_id for job_id, in db.session.query(Job.id).filter(
+        Job.status == RUNNING, func.coalesce(Job.heartbeat_at, Job.started_at) < stale)]
+    failed = 0
+    if stopped:
+        failed = Job.query.filter(Job.id.in_(stopped), Job.status == RUNNING) \
+            .update({Job.status: FAILED, Job.finished_at: datetime.utcnow(),
+                     Job.error: 'interrupted: the worker running the job stopped'},
+                    synchronize_session=False)
+        JobFile.remove(stopped)
+    db.session.commit()
+    pending = [job_id for job_id, in db.session.query(Job.id)
+               .filter(Job.status == PENDING).order_by(Job.id)]
+    db.session.commit()
+    logger.info('Recovered jobs: %s failed, %s pending submitted', failed, len(pending))
+    for job_id in pending:
+        runner.submit(job_id)
+    return failed, len(pending)
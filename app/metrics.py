@@ -0,0 +1,119 @@
+"""
+Metrics module
+This module collects the Prometheus metrics served on /metrics: the
+latency of every request by route and status code, the number of
+queries and the database time of each request, the time spent
+encoding JSON and the state of the connection pool. The database
+counters of each request come from the instrumentation module.
+
+Under gunicorn every worker writes its metrics to files in the
+directory named by the prometheus_multiproc_dir environment variable
+and /metrics adds up the files of all the workers. Without it the
+metrics of the current process are served.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from prometheus_client import CollectorRegistry, Gauge, Histogram, REGISTRY, \
+    CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+from . import app, db
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+REQUEST_LATENCY = Histogram(
+    'orders_http_request_duration_seconds', 'Time spent serving a request',
+    ['method', 'route', 'status'])
+REQUEST_QUERIES = Histogram(
+    'orders_http_request_db_queries', 'Database statements executed per request',
+    ['method', 'route'], buckets=QUERY_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    'orders_http_request_db_seconds', 'Time spent in the database per request',
+    ['method', 'route'])
+REQUEST_SERIALIZATION_TIME = Histogram(
+    'orders_http_request_serialization_seconds', 'Time spent encoding JSON per request',
+    ['method', 'route'])
+POOL_CHECKED_OUT = Gauge(
+    'orders_db_pool_checked_out', 'Connections checked out of the pool',
+    multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge(
+    'orders_db_pool_overflow', 'Connections opened beyond the pool size',
+    multiprocess_mode='livesum')
+
+
+def route():
+    """ Returns the URL rule of the current request, which keeps the label set small """
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+def observe_pool(pool):
+    """ Sets the pool gauges from a connection pool """
+    # pools without a size, like the NullPool used by SQLite, have nothing to report
+    if hasattr(pool, 'checkedout'):
+        POOL_CHECKED_OUT.set(pool.checkedout())
+        POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+def render():
+    """ Returns the metrics in the Prometheus text format and its content type """
+    observe_pool(db.engine.pool)
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+######################################################################
+# REQUEST HOOKS
+######################################################################
+@app.before_request
+def start_request():
+    """ Starts the timers of a request """
+    g.request_start = time.time()
+    g.serialization_time = 0.0
+    observe_pool(db.engine.pool)
+
+@app.after_request
+def record_request(response):
+    """ Records the metrics of a request
+
+    The body of a streamed response is produced after this runs, so only
+    the work done before the first chunk is counted.
+    """
+    if 'request_start' not in g or 'db_queries' not in g:
+        return response
+    method = request.method
+    name = route()
+    REQUEST_LATENCY.labels(method, name, response.status_code).observe(
+        time.time() - g.request_start)
+    REQUEST_QUERIES.labels(method, name).observe(g.db_queries)
+    REQUEST_DB_TIME.labels(method, name).observe(g.db_time)
+    REQUEST_SERIALIZATION_TIME.labels(method, name).observe(g.serialization_time)
+    return response
+
+
+######################################################################
+# SERIALIZATION
+######################################################################
+@contextmanager
+def serialization_timer():
+    """ Adds the time spent in the block to the serialization time of the request """
+    start = time.time()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'serialization_time' in g:
+            g.serialization_time += time.time() - start
+
+class TimedJSONEncoder(app.json_encoder):
+    """ JSON encoder that adds its encoding time to the current request """
+
+    def encode(self, o):
+        with serialization_timer():
+            return super(TimedJSONEncoder, self).encode(o)
+
+app.json_encoder = TimedJSONEncoder
@@ -3,14 +3,287 @@ Order and Item Model
 """
 
 import logging
-from datetime import datetime
-from . import db
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, func, distinct, select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from . import db, cache
+from .replicas import reading_replica
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
     def __init__(self, statement):
+        super(DataValidationError, self).__init__(statement)
         print statement
 
+class StaleVersionError(Exception):
+    """ Used when a row was changed after the version a write expects """
+    pass
+
+def parse_date(value):
+    """ Parses a date given as YYYY-MM-DDTHH:MM or YYYY-MM-DD """
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M")
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%d")
+
+def parse_date_until(value):
+    """ Parses the inclusive end of a date range into the first moment after it
+
+    A date covers that whole day and a time that whole minute, so the
+    range ends before midnight of the next day or before the next minute.
+    """
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M") + timedelta(minutes=1)
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%d") + timedelta(days=1)
+
+def filter_values(args, name, separator):
+    """ Returns the values of a filter in args, split by its separator """
+    if hasattr(args, 'getlist'):
+        values = args.getlist(name)
+    elif name not in args:
+        values = []
+    elif isinstance(args[name], list):
+        values = args[name]
+    else:
+        values = [args[name]]
+    if separator:
+        values = [value for raw in values
+                  for value in (raw.split(separator) if isinstance(raw, basestring) else [raw])]
+    return values
+
+def check_filters(model, args, filters=None):
+    """
+    Checks the filters that select the rows a write changes
+
+    filter_query ignores unknown names and blank values, which is right
+    for a list but would widen a bulk write to every row, so a write
+    rejects them instead.
+
+    Args:
+        model (db.Model): the model that declares the FILTERS
+        args (dict): the filter values
+        filters (dict): filters to use instead of the model FILTERS
+
+    Raises:
+        DataValidationError: when a name is not a filter or a value is blank
+    """
+    if filters is None:
+        filters = model.FILTERS
+    if not isinstance(args, dict):
+        raise DataValidationError('filter must be an object')
+    unknown = sorted(name for name in args if name not in filters)
+    if unknown:
+        raise DataValidationError('Unknown filter: {}; filters are {}'.format(
+            ', '.join(unknown), ', '.join(sorted(filters))))
+    for name in args:
+        values = filter_values(args, name, filters[name][3])
+        if not values or any(value is None or value == '' for value in values):
+            raise DataValidationError('Invalid value for {}: a filter cannot be blank'.format(name))
+
+def filter_query(query, model, args, filters=None):
+    """
+    Combines every supported filter in args into one WHERE clause
+
+    The filters a model supports are declared in its FILTERS dictionary
+    which maps a parameter name to (column, operator, converter,
+    separator), where the operator is eq, min, max or before for an
+    exclusive upper bound. A parameter given more than once, or holding a list
+    split by its separator, becomes an IN clause.
+
+    Args:
+        query (Query): the query to filter
+        model (db.Model): the model that declares the FILTERS
+        args (dict): the filter values, usually request.args
+        filters (dict): filters to use instead of the model FILTERS
+
+    Returns:
+        Query: the filtered query
+
+    Raises:
+        DataValidationError: when a filter value cannot be converted
+    """
+    if filters is None:
+        filters = model.FILTERS
+    for name, (column_name, operator, convert, separator) in filters.items():
+        values = [value for value in filter_values(args, name, separator) if value != '']
+        if not values:
+            continue
+        try:
+            values = [convert(value) for value in values]
+        except (TypeError, ValueError):
+            raise DataValidationError('Invalid value for {}: {}'.format(name, values))
+
+        column = getattr(model, column_name)
+        if operator == 'min':
+            query = query.filter(column >= values[0])
+        elif operator == 'max':
+            query = query.filter(column <= values[0])
+        elif operator == 'before':
+            query = query.filter(column < values[0])
+        elif len(values) == 1:
+            query = query.filter(column == values[0])
+        else:
+            query = query.filter(column.in_(values))
+    return query
+
+def items_total(items):
+    """
+    Returns the sum of quantity * price of Items
+
+    Raises:
+        DataValidationError: when a quantity or price is not a number
+    """
+    try:
+        return sum(item.quantity * float(item.price) for item in items)
+    except (TypeError, ValueError):
+        raise DataValidationError('Invalid item: quantity and price must be numbers')
+
+def cache_key(model, row_id):
+    """ Returns the cache key of a row """
+    return '{}:{}'.format(model.__tablename__, row_id)
+
+def row_etag(row):
+    """
+    Returns the entity tag of a row, which is its version
+
+    Every write increments the version, so a conditional request for
+    an unchanged row costs no JSON encoding and a conditional write
+    can check the tag in its WHERE clause.
+    """
+    return str(row.version)
+
+def update_row(model, row_id, values, versions=None, **filters):
+    """
+    Updates a row with one conditional UPDATE that increments its version
+
+    The statement runs in the current transaction, the caller commits it.
+
+    Args:
+        model (db.Model): the model of the row
+        row_id: primary key of the row
+        values (dict): the new column values
+        versions (list): the versions the row may have, None for any
+        filters: more column values the row must have
+
+    Returns:
+        boolean: False when there is no such row
+
+    Raises:
+        StaleVersionError: when the row has another version
+    """
+    query = model.query.filter(model.id == row_id).filter_by(**filters)
+    expected = query if versions is None else query.filter(model.version.in_(versions))
+    values = dict(values, version=model.version + 1)
+    if expected.update(values, synchronize_session=False):
+        return True
+    return check_stale(query, model, row_id, versions)
+
+def delete_row(model, row_id, versions=None, **filters):
+    """
+    Deletes a row with one conditional DELETE
+
+    Takes the same arguments, returns and raises like update_row.
+    """
+    query = model.query.filter(model.id == row_id).filter_by(**filters)
+    expected = query if versions is None else query.filter(model.version.in_(versions))
+    if expected.delete(synchronize_session=False):
+        return True
+    return check_stale(query, model, row_id, versions)
+
+def check_stale(query, model, row_id, versions):
+    """ Raises StaleVersionError when a conditional write missed a row that exists """
+    if versions is not None and query.count():
+        raise StaleVersionError('{} {} was changed by another request'.format(
+            model.__name__, row_id))
+    return False
+
+def cached_get(model, row_id):
+    """
+    Gets a row by id reading through the cache
+
+    A cached row is attached to the session without a query so it can
+    be updated or deleted like any other row.
+
+    Args:
+        model (db.Model): the model of the row
+        row_id: primary key of the row
+
+    Returns:
+        db.Model: the row with the given id or None
+    """
+    key = cache_key(model, row_id)
+    # never overwrite a row this session already holds with cached values
+    if db.session.identity_map.get(identity_key(model, row_id)) is None:
+        values = cache.get(key)
+        if values is not None:
+            row = model(**values)
+            make_transient_to_detached(row)
+            return db.session.merge(row, load=False)
+    row = model.query.get(row_id)
+    # a lagging replica must not put old values back in the cache
+    if row is not None and not reading_replica():
+        cache.set(key, dict((column.name, getattr(row, column.name))
+                            for column in model.__table__.columns))
+    return row
+
+def keyset_page(query, model, after_id=None, limit=None):
+    """
+    Returns one page of a query using keyset pagination on the primary key
+
+    Args:
+        query (Query): the query to page through
+        model (db.Model): the model whose id orders the pages
+        after_id (integer): only rows with a greater id are returned
+        limit (integer): the maximum number of rows in the page
+
+    Returns:
+        List: the rows of the page in id order
+    """
+    if after_id is not None:
+        query = query.filter(model.id > after_id)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def keyset_batches(query, model, batch_size):
+    """
+    Yields a query as lists of batch_size rows, one keyset query per list
+
+    Unlike stream_rows no cursor is held open between batches, so other
+    queries can run on the same connection while the rows are consumed.
+
+    Args:
+        query (Query): the query to iterate over
+        model (db.Model): the model whose id orders the rows
+        batch_size (integer): the number of rows loaded per batch
+    """
+    after_id = None
+    while True:
+        rows = keyset_page(query, model, after_id, batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1].id
+
+def stream_rows(query, model, batch_size):
+    """
+    Iterates over a query in id order fetching batch_size rows at a time
+
+    Args:
+        query (Query): the query to iterate over
+        model (db.Model): the model whose id orders the rows
+        batch_size (integer): the number of rows loaded per batch
+
+    Returns:
+        Query: an iterable that yields the rows in batches
+    """
+    return query.order_by(model.id).yield_per(batch_size)
+
 class Item(db.Model):
     """ Model for an Item """
     logger = logging.getLogger(__name__)
@@ -18,26 +291,51 @@ class Item(db.Model):
 
     __tablename__ = "items"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
-    product_id = db.Column(db.Integer, nullable=False)
-    name = db.Column(db.String(80), nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False, index=True)
+    name = db.Column(db.String(80), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False, index=True)
+    price = db.Column(db.Float, nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # query parameter: (column, operator, converter, list separator)
+    FILTERS = {
+        'order_id': ('order_id', 'eq', int, ','),
+        'product_id': ('product_id', 'eq', int, ','),
+        'name': ('name', 'eq', unicode, None),
+        'quantity': ('quantity', 'eq', int, ','),
+        'price': ('price', 'eq', float, ','),
+        'price_min': ('price', 'min', float, None),
+        'price_max': ('price', 'max', float, None),
+    }
 
     def __repr__(self):
         return '<Item %r>' % (self.name)
 
     def save(self):
-        """ Saves an Item to the database """
+        """ Saves an Item to the database and updates the totals of its Order """
         if not self.id:
             db.session.add(self)
+        elif inspect(self).persistent:
+            self.version = Item.version + 1
+        # an Item moved to another Order changes the totals of both
+        order_ids = set([self.order_id]) | set(inspect(self).attrs.order_id.history.deleted)
+        order_ids.discard(None)
+        db.session.flush()
+        Order.refresh_totals(order_ids)
         db.session.commit()
+        cache.invalidate(cache_key(Item, self.id),
+                         *[cache_key(Order, order_id) for order_id in order_ids])
 
     def delete(self):
-        """ Deletes an Item from the database """
+        """ Deletes an Item from the database and updates the totals of its Order """
+        order_id = self.order_id
         if self.id:
             db.session.delete(self)
+            db.session.flush()
+            Order.refresh_totals([order_id])
         db.session.commit()
+        cache.invalidate(cache_key(Item, self.id), cache_key(Order, order_id))
 
     def serialize(self):
         """
@@ -48,6 +346,22 @@ class Item(db.Model):
         """
         return {
                 "id": self.id,
+                "order_id": self.order_id,
+                "product_id": self.product_id,
+                "name": self.name,
+                "quantity": self.quantity,
+                "price": self.price,
+                "version": self.version,
+                }
+
+    def as_row(self):
+        """
+        Returns the column values of an unsaved Item for a bulk INSERT
+
+        Returns:
+            dict
+        """
+        return {
                 "order_id": self.order_id,
                 "product_id": self.product_id,
                 "name": self.name,
@@ -105,7 +419,7 @@ class Item(db.Model):
             Item: item with associated id
         """
         Item.logger.info('Processing lookup for id %s ...', item_id)
-        return Item.query.get(item_id)
+        return cached_get(Item, item_id)
 
     @staticmethod
     def get_or_404(item_id):
@@ -113,6 +427,63 @@ class Item(db.Model):
         Item.logger.info('Processing lookup or 404 for id %s ...', item_id)
         return Item.query.get_or_404(item_id)
 
+    @staticmethod
+    def update_by_id(order_id, item_id, data, versions=None):
+        """
+        Replaces an Item of an Order with one conditional UPDATE
+
+        Args:
+            order_id (integer): the Order the Item must belong to
+            item_id (integer): primary key of the Item
+            data (dict): the new Item data
+            versions (list): the versions the Item may have, None for any
+
+        Returns:
+            boolean: False when the Order has no such Item
+
+        Raises:
+            DataValidationError: when bad or missing data
+            StaleVersionError: when the Item has another version
+        """
+        Item.logger.info('Processing update of id %s ...', item_id)
+        item = Item().deserialize(data, order_id)
+        items_total([item])
+        values = dict((name, getattr(item, name))
+                      for name in ('product_id', 'name', 'quantity', 'price'))
+        try:
+            updated = update_row(Item, item_id, values, versions, order_id=order_id)
+            if updated:
+                Order.refresh_totals([order_id])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(cache_key(Item, item_id), cache_key(Order, order_id))
+        return updated
+
+    @staticmethod
+    def delete_by_id(order_id, item_id, versions=None):
+        """
+        Deletes an Item of an Order with one conditional DELETE
+
+        Returns:
+            boolean: False when the Order has no such Item
+
+        Raises:
+            StaleVersionError: when the Item has another version
+        """
+        Item.logger.info('Processing delete of id %s ...', item_id)
+        try:
+            deleted = delete_row(Item, item_id, versions, order_id=order_id)
+            if deleted:
+                Order.refresh_totals([order_id])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(cache_key(Item, item_id), cache_key(Order, order_id))
+        return deleted
+
     @staticmethod
     def find_by_product_id(product_id):
         """ Returns all Items with the given product_id
@@ -123,6 +494,16 @@ class Item(db.Model):
         Item.logger.info('Processing product_id query for %s ...', product_id)
         return Item.query.filter(Item.product_id == product_id)
 
+    @staticmethod
+    def find_by_filters(args):
+        """ Returns all Items that match every filter in args
+
+        Args:
+            args (dict): values keyed by the names in Item.FILTERS
+        """
+        Item.logger.info('Processing filter query for %s ...', args)
+        return filter_query(Item.query, Item, args)
+
     @staticmethod
     def find_by_order_id(order_id):
         """ Returns all Items with the given order_id
@@ -170,10 +551,55 @@ class Order(db.Model):
     app = None
 
     __tablename__ = "orders"
+    # customer_id and status lookups use the leading column of these indexes
+    __table_args__ = (
+        db.Index('ix_orders_customer_id_date', 'customer_id', 'date'),
+        db.Index('ix_orders_status_date', 'status', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     customer_id = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
+    date = db.Column(db.DateTime, nullable=False, index=True)
     status = db.Column(db.String(80), nullable=False)
+    # summary of the items, kept up to date by every write to them
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    order_total = db.Column(db.Float, nullable=False, default=0, server_default='0',
+                            index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # items are removed with one DELETE statement so the ORM must leave them alone
+    items = db.relationship('Item', backref='order', order_by='Item.id', passive_deletes='all')
+
+    # query parameter: (column, operator, converter, list separator)
+    FILTERS = {
+        'customer_id': ('customer_id', 'eq', int, ','),
+        'status': ('status', 'eq', unicode, ','),
+        'date': ('date', 'eq', parse_date, None),
+        'date_from': ('date', 'min', parse_date, None),
+        'date_to': ('date', 'max', parse_date, None),
+        'min_total': ('order_total', 'min', float, None),
+        'max_total': ('order_total', 'max', float, None),
+    }
+
+    # the Order filters with the from and to names used by the reports,
+    # to includes the whole day or minute it names
+    REPORT_FILTERS = dict(FILTERS, **{
+        'from': ('date', 'min', parse_date, None),
+        'to': ('date', 'before', parse_date_until, None),
+    })
+
+    # status a bulk transition moves to: the statuses it may move from
+    STATUS_TRANSITIONS = {
+        'shipped': ('processing',),
+        'cancelled': ('processing',),
+        'returned': ('shipped',),
+    }
+
+    # revenue report groups: (result key, grouped column)
+    REVENUE_GROUPS = {
+        'customer': ('customer_id', customer_id),
+        'product': ('product_id', Item.product_id),
+        'day': ('day', func.date(date)),
+        'status': ('status', status),
+    }
 
     def __repr__(self):
         return '<Order>'
@@ -182,22 +608,167 @@ class Order(db.Model):
         """ Saves an Order to the database """
         if not self.id:
             db.session.add(self)
+        elif inspect(self).persistent:
+            self.version = Order.version + 1
         db.session.commit()
+        cache.invalidate(cache_key(Order, self.id))
 
     def delete(self):
         """ Deletes an Order and its items from the Database """
 
+        keys = []
         if self.id:
-            items = Item.find_by_order_id(self.id)
-            for item in items:
-                item.delete()
+            items = Item.query.filter(Item.order_id == self.id)
+            keys = [cache_key(Item, item_id) for (item_id,) in items.values(Item.id)]
+            keys.append(cache_key(Order, self.id))
+            items.delete(synchronize_session=False)
             db.session.delete(self)
         db.session.commit()
+        cache.invalidate(*keys)
 
-    def serialize(self):
+    def save_with_items(self, items):
+        """
+        Saves a new Order and all of its Items in a single transaction
+
+        The Order is flushed to obtain its id and the Items are written
+        with one multi-row INSERT before a single commit, so a failure
+        part way through never leaves a partial order behind.
+
+        Args:
+            items (list): unsaved Items that belong to this Order
+
+        Returns:
+            List: the saved Items of this Order
+        """
+        self.set_totals(items)
+        try:
+            db.session.add(self)
+            db.session.flush()
+            rows = []
+            for item in items:
+                item.order_id = self.id
+                rows.append(item.as_row())
+            if rows:
+                db.session.execute(Item.__table__.insert().values(rows))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return Item.find_by_order_id(self.id).order_by(Item.id).all()
+
+    def set_totals(self, items):
+        """
+        Sets item_count and order_total of a new Order from its Items
+
+        Raises:
+            DataValidationError: when a quantity or price is not a number
+        """
+        self.order_total = items_total(items)
+        self.item_count = len(items)
+
+    def patch_items(self, operations):
+        """
+        Adds, updates and removes many Items of this Order at once
+
+        Every operation is validated first, then removals run as one
+        DELETE, updates as one executemany UPDATE and additions as one
+        multi-row INSERT before a single commit.
+
+        Args:
+            operations (list): dictionaries with an op of add, update or
+                remove, the id of the Item to update or remove and the
+                Item data to add or update
+
+        Returns:
+            List: the Items of this Order after the changes
+
+        Raises:
+            DataValidationError: when an operation is invalid, changes an
+                Item twice or names an Item that does not belong to this Order
+        """
+        additions = []
+        updates = []
+        removals = []
+        changed = []
+        try:
+            for operation in operations:
+                if operation['op'] == 'add':
+                    changed.append(Item().deserialize(operation, self.id))
+                    additions.append(changed[-1].as_row())
+                elif operation['op'] == 'update':
+                    changed.append(Item().deserialize(operation, self.id))
+                    row = changed[-1].as_row()
+                    row['id'] = int(operation['id'])
+                    updates.append(row)
+                elif operation['op'] == 'remove':
+                    removals.append(int(operation['id']))
+                else:
+                    raise DataValidationError('Invalid operation: unknown op ' \
+                                              '{}'.format(operation['op']))
+        except KeyError as error:
+            raise DataValidationError('Invalid operation: missing ' + error.args[0])
+        except (TypeError, ValueError) as error:
+            raise DataValidationError('Invalid operation: body of request contained ' \
+                                      'bad or no data')
+
+        items_total(changed)
+        item_ids = set(row['id'] for row in updates) | set(removals)
+        if len(item_ids) < len(updates) + len(removals):
+            raise DataValidationError('Invalid operation: an item can only be updated or '
+                                      'removed once per request')
+        if item_ids:
+            items = Item.query.filter(Item.order_id == self.id, Item.id.in_(item_ids))
+            missing = item_ids - set(item_id for (item_id,) in items.values(Item.id))
+            if missing:
+                raise DataValidationError('Order {} has no items with ids {}'.format(
+                    self.id, ', '.join(str(item_id) for item_id in sorted(missing))))
+
+        try:
+            if removals:
+                Item.query.filter(Item.order_id == self.id, Item.id.in_(removals)) \
+                    .delete(synchronize_session=False)
+            if updates:
+                db.session.bulk_update_mappings(Item, updates)
+                Item.query.filter(Item.id.in_([row['id'] for row in updates])) \
+                    .update({Item.version: Item.version + 1}, synchronize_session=False)
+            if additions:
+                db.session.execute(Item.__table__.insert().values(additions))
+            Order.refresh_totals([self.id])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(cache_key(Order, self.id),
+                         *[cache_key(Item, item_id) for item_id in item_ids])
+        return Item.find_by_order_id(self.id).order_by(Item.id).all()
+
+    def serialize(self, expand_items=False):
         """
         Serializes an Order into a dictionary
 
+        Args:
+            expand_items (boolean): include the Items of the Order
+
+        Returns:
+            dict
+        """
+        data = {
+                "id": self.id,
+                "customer_id": self.customer_id,
+                "date": self.date,
+                "status":self.status,
+                "item_count": self.item_count,
+                "order_total": self.order_total,
+                "version": self.version
+                }
+        if expand_items:
+            data['items'] = [item.serialize() for item in self.items]
+        return data
+
+    def as_row(self):
+        """
+        Returns the column values of an unsaved Order with its id for a bulk INSERT
+
         Returns:
             dict
         """
@@ -205,7 +776,9 @@ class Order(db.Model):
                 "id": self.id,
                 "customer_id": self.customer_id,
                 "date": self.date,
-                "status":self.status
+                "status": self.status,
+                "item_count": self.item_count,
+                "order_total": self.order_total,
                 }
 
     def deserialize(self, data):
@@ -233,11 +806,168 @@ class Order(db.Model):
                                       'bad or no data')
         return self
 
+    def updated_values(self):
+        """
+        Returns the column values deserialize sets, for update_by_id
+
+        Returns:
+            dict
+        """
+        return {'customer_id': self.customer_id, 'date': self.date, 'status': self.status}
+
     @staticmethod
     def init_db():
         """ Initializes the database session """
         Order.logger.info('Initializing database')
         db.create_all()  # make our sqlalchemy tables
+        cache.clear()
+
+    @staticmethod
+    def migrate_db():
+        """
+        Brings an existing database up to date with the models
+
+        Missing tables are created and missing columns and indexes are
+        added to the tables that already exist. Nothing is dropped.
+
+        Returns:
+            List: the DDL changes that were applied
+        """
+        Order.logger.info('Migrating database')
+        db.create_all()
+        changes = []
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            columns = set(column['name'] for column in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(dialect=db.engine.dialect))
+                if column.server_default is not None:
+                    ddl += " DEFAULT '{}'".format(column.server_default.arg)
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                db.engine.execute(ddl)
+                changes.append(ddl)
+            indexes = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(db.engine)
+                    changes.append('CREATE INDEX {} ON {}'.format(index.name, table.name))
+        for change in changes:
+            Order.logger.info('Applied: %s', change)
+        return changes
+
+    @staticmethod
+    def refresh_totals(order_ids):
+        """
+        Recomputes item_count and order_total of Orders from their Items
+
+        One UPDATE with correlated subqueries runs in the current
+        transaction, the caller commits it.
+
+        Args:
+            order_ids (list): the ids of the Orders to update
+        """
+        order_ids = list(order_ids)
+        if not order_ids:
+            return
+        orders = Order.__table__
+        items = Item.__table__
+        count = select([func.count(items.c.id)]) \
+            .where(items.c.order_id == orders.c.id).as_scalar()
+        total = select([func.coalesce(func.sum(items.c.quantity * items.c.price), 0)]) \
+            .where(items.c.order_id == orders.c.id).as_scalar()
+        db.session.execute(orders.update().where(orders.c.id.in_(order_ids))
+                           .values(item_count=count, order_total=total,
+                                   version=orders.c.version + 1))
+
+    @staticmethod
+    def rebuild_totals(batch_size=1000):
+        """
+        Recomputes item_count and order_total of every Order
+
+        Each batch of Orders is updated in its own transaction so the
+        rows are never locked for long.
+
+        Args:
+            batch_size (integer): the number of Orders updated per transaction
+
+        Returns:
+            integer: the number of Orders updated
+        """
+        Order.logger.info('Rebuilding order totals')
+        count = 0
+        query = db.session.query(Order.id)
+        for rows in keyset_batches(query, Order, batch_size):
+            Order.refresh_totals([row.id for row in rows])
+            db.session.commit()
+            count += len(rows)
+        cache.clear()
+        return count
+
+    @staticmethod
+    def transition_status(target, order_ids=None, args=None, batch_size=1000):
+        """
+        Moves many Orders to a new status with set-based UPDATE statements
+
+        Only Orders whose current status may move to the target, as
+        declared in STATUS_TRANSITIONS, are changed; the check is part of
+        the WHERE clause. Orders are selected by id, by filters or both.
+        One UPDATE runs per batch of ids, all in a single transaction.
+
+        Args:
+            target (string): the new status
+            order_ids (list): the ids of the Orders to change
+            args (dict): values keyed by the names in Order.FILTERS
+            batch_size (integer): the number of ids updated per statement
+
+        Returns:
+            integer: the number of Orders changed
+
+        Raises:
+            DataValidationError: when the target, the ids or a filter is not
+                valid, or a filter is unknown or blank
+        """
+        if target not in Order.STATUS_TRANSITIONS:
+            raise DataValidationError('status must be one of {}'.format(
+                ', '.join(sorted(Order.STATUS_TRANSITIONS))))
+        check_filters(Order, args or {})
+        if not order_ids and not args:
+            raise DataValidationError('ids or a filter of the orders to change are required')
+        Order.logger.info('Processing status change to %s ...', target)
+        query = Order.query.filter(Order.status.in_(Order.STATUS_TRANSITIONS[target]))
+        query = filter_query(query, Order, args or {})
+        if order_ids:
+            try:
+                order_ids = [int(order_id) for order_id in order_ids]
+            except (TypeError, ValueError):
+                raise DataValidationError('ids must be a list of integers')
+            batches = [order_ids[start:start + batch_size]
+                       for start in range(0, len(order_ids), batch_size)]
+        else:
+            batches = [None]
+
+        updated = 0
+        try:
+            for batch in batches:
+                batch_query = query
+                if batch is not None:
+                    batch_query = query.filter(Order.id.in_(batch))
+                updated += batch_query.update({Order.status: target,
+                                               Order.version: Order.version + 1},
+                                              synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if order_ids:
+            cache.invalidate(*[cache_key(Order, order_id) for order_id in order_ids])
+        else:
+            # the changed rows are not known, so no cached Order can be trusted
+            cache.clear()
+        return updated
 
     @staticmethod
     def remove_all():
@@ -246,6 +976,41 @@ class Order(db.Model):
         db.session.commit()
         Order.query.delete()
         db.session.commit()
+        cache.clear()
+
+    @staticmethod
+    def remove_by_ids(order_ids, batch_size=1000):
+        """
+        Deletes many Orders and their Items with set-based statements
+
+        Each batch of ids is removed with one DELETE on items and one on
+        orders inside a single transaction.
+
+        Args:
+            order_ids (list): the ids of the Orders to delete
+            batch_size (integer): the number of ids deleted per transaction
+
+        Returns:
+            integer: the number of Orders deleted
+        """
+        order_ids = list(order_ids)
+        Order.logger.info('Processing delete of %s orders ...', len(order_ids))
+        deleted = 0
+        for start in range(0, len(order_ids), batch_size):
+            batch = order_ids[start:start + batch_size]
+            items = Item.query.filter(Item.order_id.in_(batch))
+            keys = [cache_key(Item, item_id) for (item_id,) in items.values(Item.id)]
+            keys.extend(cache_key(Order, order_id) for order_id in batch)
+            try:
+                items.delete(synchronize_session=False)
+                deleted += Order.query.filter(Order.id.in_(batch)) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            cache.invalidate(*keys)
+        return deleted
 
     @staticmethod
     def all():
@@ -270,7 +1035,7 @@ class Order(db.Model):
             Order: order with associated id
         """
         Order.logger.info('Processing lookup for id %s ...', order_id)
-        return Order.query.get(order_id)
+        return cached_get(Order, order_id)
 
     @staticmethod
     def get_or_404(order_id):
@@ -278,6 +1043,32 @@ class Order(db.Model):
         Order.logger.info('Processing lookup or 404 for id %s ...', order_id)
         return Order.query.get_or_404(order_id)
 
+    @staticmethod
+    def update_by_id(order_id, values, versions=None):
+        """
+        Changes the columns of an Order with one conditional UPDATE
+
+        Args:
+            order_id (integer): primary key of the Order
+            values (dict): the new column values
+            versions (list): the versions the Order may have, None for any
+
+        Returns:
+            boolean: False when there is no such Order
+
+        Raises:
+            StaleVersionError: when the Order has another version
+        """
+        Order.logger.info('Processing update of id %s ...', order_id)
+        try:
+            updated = update_row(Order, order_id, values, versions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(cache_key(Order, order_id))
+        return updated
+
     @staticmethod
     def find_by_customer_id(customer_id):
         """ Returns all Orders placed by the given customer
@@ -288,6 +1079,142 @@ class Order(db.Model):
         Order.logger.info('Processing customer_id query for %s ...', customer_id)
         return Order.query.filter(Order.customer_id == customer_id)
 
+    @staticmethod
+    def load_items(orders):
+        """
+        Loads the Items of many Orders with a single IN query
+
+        Args:
+            orders (list): the Orders whose items collection is populated
+
+        Returns:
+            List: the same Orders
+        """
+        orders = list(orders)
+        items_by_order = dict((order.id, []) for order in orders)
+        if items_by_order:
+            Order.logger.info('Processing items query for %s orders ...', len(orders))
+            query = Item.query.filter(Item.order_id.in_(items_by_order.keys()))
+            for item in query.order_by(Item.id):
+                items_by_order[item.order_id].append(item)
+        for order in orders:
+            set_committed_value(order, 'items', items_by_order[order.id])
+        return orders
+
+    @staticmethod
+    def serialize_with_items(orders):
+        """
+        Serializes Orders together with their Items
+
+        Returns:
+            List: a dictionary per Order with an items list
+        """
+        return [order.serialize(expand_items=True) for order in Order.load_items(orders)]
+
+    @staticmethod
+    def find_by_filters(args):
+        """ Returns all Orders that match every filter in args
+
+        Args:
+            args (dict): values keyed by the names in Order.FILTERS
+        """
+        Order.logger.info('Processing filter query for %s ...', args)
+        return filter_query(Order.query, Order, args)
+
+    @staticmethod
+    def find_totals(args):
+        """ Returns the item count, quantity and total of the Orders that match args
+
+        The totals are computed by one GROUP BY query over the Orders
+        joined to their Items, an Order without Items has a total of 0.
+
+        Args:
+            args (dict): values keyed by the names in Order.FILTERS
+
+        Returns:
+            Query: rows of (id, item_count, quantity, total)
+        """
+        Order.logger.info('Processing totals query for %s ...', args)
+        query = db.session.query(
+            Order.id,
+            func.count(Item.id).label('item_count'),
+            func.coalesce(func.sum(Item.quantity), 0).label('quantity'),
+            func.coalesce(func.sum(Item.quantity * Item.price), 0).label('total')) \
+            .select_from(Order).outerjoin(Item, Item.order_id == Order.id)
+        return filter_query(query, Order, args).group_by(Order.id)
+
+    @staticmethod
+    def get_total(order_id):
+        """ Returns the totals row of an Order or None when it does not exist """
+        return Order.find_totals({}).filter(Order.id == order_id).first()
+
+    @staticmethod
+    def serialize_totals(rows):
+        """ Serializes rows returned by find_totals """
+        return [{"order_id": row.id,
+                 "item_count": row.item_count,
+                 "quantity": int(row.quantity),
+                 "total": round(float(row.total), 2)} for row in rows]
+
+    @staticmethod
+    def revenue(group_by, args):
+        """ Returns the revenue of the Orders that match args by customer, product, day or status
+
+        Args:
+            group_by (string): one of the names in Order.REVENUE_GROUPS
+            args (dict): values keyed by the names in Order.REPORT_FILTERS
+
+        Returns:
+            List: a dictionary per group with the number of orders, the
+                number of items, the quantity sold and the revenue
+
+        Raises:
+            DataValidationError: when group_by or a filter is not valid
+        """
+        Order.logger.info('Processing revenue report by %s for %s ...', group_by, args)
+        if group_by not in Order.REVENUE_GROUPS:
+            raise DataValidationError('group_by must be one of {}'.format(
+                ', '.join(sorted(Order.REVENUE_GROUPS))))
+        name, column = Order.REVENUE_GROUPS[group_by]
+        key = column.label('key')
+        query = db.session.query(
+            key,
+            func.count(distinct(Order.id)),
+            func.count(Item.id),
+            func.sum(Item.quantity),
+            func.sum(Item.quantity * Item.price)) \
+            .select_from(Order).join(Item, Item.order_id == Order.id)
+        query = filter_query(query, Order, args, Order.REPORT_FILTERS)
+        rows = query.group_by(key).order_by(key).all()
+        return [{name: value.isoformat() if hasattr(value, 'isoformat') else value,
+                 "orders": orders,
+                 "items": items,
+                 "quantity": int(quantity),
+                 "revenue": round(float(revenue), 2)}
+                for value, orders, items, quantity, revenue in rows]
+
+    @staticmethod
+    def export_rows(args, batch_size):
+        """ Returns the Orders that match args joined with their Items
+
+        Every row is a tuple of every Order column followed by every
+        Item column, which are None for an Order without Items, in the
+        order of the tables, as the RowEncoders expect. The rows of
+        an Order are consecutive and the whole result is read in one
+        pass through a server side cursor, batch_size rows at a time.
+
+        Args:
+            args (dict): values keyed by the names in Order.FILTERS
+            batch_size (integer): the number of rows fetched at a time
+        """
+        Order.logger.info('Processing export query for %s ...', args)
+        query = filter_query(Order.query, Order, args)
+        return query.outerjoin(Item, Item.order_id == Order.id) \
+                    .with_entities(*(list(Order.__table__.columns) +
+                                     list(Item.__table__.columns))) \
+                    .order_by(Order.id, Item.id) \
+                    .yield_per(batch_size)
+
     @staticmethod
     def find_by_date(date):
         """ Returns all Orders with the given date
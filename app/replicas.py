@@ -0,0 +1,134 @@
+"""
+Read Replicas module
+This module sends the queries of the read endpoints to the read
+replicas of the database. Each replica is a bind named replica0,
+replica1... in SQLALCHEMY_BINDS. A view decorated with replica_reads
+picks a replica for the request and the RoutingSession runs its
+SELECTs there, while every write goes to the primary.
+
+A replica that is more than REPLICA_MAX_LAG seconds behind, or cannot
+be reached, is skipped, and when none is left the request reads from
+the primary. After a write the client gets a cookie that keeps its
+reads on the primary for READ_YOUR_WRITES_SECONDS, so it always sees
+its own changes.
+"""
+
+import time
+import logging
+import threading
+from functools import wraps
+from flask import g, request, has_app_context
+from sqlalchemy.exc import SQLAlchemyError
+from . import app, db
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = 'read_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_binds():
+    """ Returns the names of the configured replica binds """
+    return sorted(name for name in app.config.get('SQLALCHEMY_BINDS') or {}
+                  if name.startswith('replica'))
+
+def measure_lag(engine):
+    """
+    Returns how many seconds a replica is behind the primary
+
+    Only MySQL replicas report their lag, a database that is not
+    replicating is treated as up to date.
+
+    Returns:
+        float: the lag in seconds or None when the replica cannot be used
+    """
+    try:
+        if engine.dialect.name != 'mysql':
+            return 0.0
+        row = engine.execute('SHOW SLAVE STATUS').first()
+    except SQLAlchemyError as error:
+        logger.warning('Replica %s is unavailable: %s', engine.url, error)
+        return None
+    if row is None:
+        return 0.0
+    lag = row['Seconds_Behind_Master']
+    # replication is stopped when the lag is unknown
+    return float(lag) if lag is not None else None
+
+
+class ReplicaSet(object):
+    """ Picks the replica of a request, rotating among those that are in sync
+
+    The lag of each replica is measured at most once every
+    REPLICA_LAG_CHECK_SECONDS and shared by the threads of the process.
+    """
+
+    def __init__(self):
+        self.lags = {}
+        self.turn = 0
+        self.lock = threading.Lock()
+
+    def lag(self, bind):
+        """ Returns the last measured lag of a replica, measuring it when too old """
+        now = time.time()
+        with self.lock:
+            checked_at, lag = self.lags.get(bind, (None, None))
+            if checked_at is not None and now - checked_at < app.config['REPLICA_LAG_CHECK_SECONDS']:
+                return lag
+            # other threads keep using the old value while this one measures
+            self.lags[bind] = (now, lag)
+        lag = measure_lag(db.get_engine(app, bind=bind))
+        with self.lock:
+            self.lags[bind] = (now, lag)
+        return lag
+
+    def choose(self):
+        """ Returns the bind of a replica that is in sync or None for the primary """
+        binds = replica_binds()
+        if not binds:
+            return None
+        with self.lock:
+            self.turn = (self.turn + 1) % len(binds)
+            start = self.turn
+        for bind in binds[start:] + binds[:start]:
+            lag = self.lag(bind)
+            if lag is not None and lag <= app.config['REPLICA_MAX_LAG']:
+                return bind
+        logger.warning('No replica is in sync, reading from the primary')
+        return None
+
+    def clear(self):
+        """ Forgets the measured lags """
+        with self.lock:
+            self.lags.clear()
+
+replica_set = ReplicaSet()
+
+
+######################################################################
+# REQUEST ROUTING
+######################################################################
+@app.before_request
+def read_from_primary():
+    """ Starts every request on the primary """
+    g.replica_bind = None
+
+def replica_reads(view):
+    """ Decorates a read-only view so that its queries may run on a replica """
+    @wraps(view)
+    def read_from_replica(*args, **kwargs):
+        if request.method in SAFE_METHODS and PRIMARY_COOKIE not in request.cookies:
+            g.replica_bind = replica_set.choose()
+        return view(*args, **kwargs)
+    return read_from_replica
+
+def reading_replica():
+    """ Returns True when the current request reads from a replica """
+    return has_app_context() and g.get('replica_bind') is not None
+
+@app.after_request
+def read_your_writes(response):
+    """ Keeps the reads of a client that wrote on the primary for a while """
+    if replica_binds() and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(PRIMARY_COOKIE, '1', max_age=app.config['READ_YOUR_WRITES_SECONDS'])
+    return response
@@ -0,0 +1,191 @@
+"""
+Synthetic Data module
+This module fills the database with generated orders and items for
+load tests and benchmarks. Customers, items per order and products
+follow power laws, so a few customers place most of the orders as they
+do in production, and statuses follow a configurable mix.
+
+Rows are generated a column at a time for BATCH_ORDERS orders and
+handed to the database driver with one executemany INSERT per table,
+without building model instances or parameter dictionaries. Every
+value comes from a random generator started with the seed, so the same
+seed and settings always produce the same rows.
+"""
+
+import time
+import bisect
+import operator
+import random
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from . import db
+from .models import Order, Item
+
+logger = logging.getLogger(__name__)
+
+# Orders generated and inserted per transaction, part of the dataset
+# definition since the values are drawn batch by batch
+BATCH_ORDERS = 5000
+DEFAULT_STATUSES = (('processing', 0.2), ('shipped', 0.6), ('cancelled', 0.1), ('returned', 0.1))
+
+
+class Distribution(object):
+    """ Draws values with the probabilities given by their weights """
+
+    def __init__(self, values, weights):
+        if not values or len(values) != len(weights) or min(weights) < 0 or not sum(weights):
+            raise ValueError('a distribution needs values with positive weights')
+        self.values = values
+        self.cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self, rand, count):
+        """ Returns a list of count values drawn with rand """
+        values, cumulative, total = self.values, self.cumulative, self.total
+        # rounding may put a draw on the last boundary
+        last = len(values) - 1
+        return [values[min(bisect.bisect_right(cumulative, rand.random() * total), last)]
+                for _ in xrange(count)]
+
+def power_law(low, high, exponent):
+    """
+    Returns a Distribution of the integers from low to high
+
+    The probability of the nth integer is proportional to 1 / n ** exponent,
+    so low is the most frequent value and an exponent of 0 is uniform.
+    """
+    if low > high:
+        raise ValueError('the range {}-{} is empty'.format(low, high))
+    return Distribution(xrange(low, high + 1),
+                        [1.0 / rank ** exponent for rank in xrange(1, high - low + 2)])
+
+
+def next_id(model):
+    """ Returns the id after the largest id of a table """
+    return (db.session.execute(select([func.max(model.__table__.c.id)])).scalar() or 0) + 1
+
+def generate_batch(rand, first_id, count, settings):
+    """ Returns the columns of the orders and of the items of a batch of count orders """
+    date_from = settings['date_from']
+    seconds = int((settings['date_to'] - date_from).total_seconds()) + 1
+    item_counts = settings['items'].sample(rand, count)
+    orders = {
+        'id': range(first_id, first_id + count),
+        'customer_id': settings['customers'].sample(rand, count),
+        'date': [date_from + timedelta(seconds=int(rand.random() * seconds))
+                 for _ in xrange(count)],
+        'status': settings['statuses'].sample(rand, count),
+        'item_count': item_counts,
+        'version': [1] * count,
+    }
+
+    total_items = sum(item_counts)
+    product_ids = settings['products'].sample(rand, total_items)
+    prices = [settings['prices'][product_id] for product_id in product_ids]
+    quantities = [int(rand.random() * 5) + 1 for _ in xrange(total_items)]
+    order_ids = []
+    totals = []
+    start = 0
+    for order_id, item_count in zip(orders['id'], item_counts):
+        end = start + item_count
+        order_ids.extend([order_id] * item_count)
+        totals.append(sum(map(operator.mul, quantities[start:end], prices[start:end])))
+        start = end
+    orders['order_total'] = totals
+    items = {
+        'order_id': order_ids,
+        'product_id': product_ids,
+        'name': [settings['names'][product_id] for product_id in product_ids],
+        'quantity': quantities,
+        'price': prices,
+        'version': [1] * total_items,
+    }
+    return orders, items
+
+def insert_columns(table, columns):
+    """
+    Inserts the rows held by lists of column values with one executemany
+
+    SQLAlchemy builds and processes a dictionary of parameters for each
+    row of an executemany, which takes longer than the INSERT itself, so
+    the statement is compiled once and the columns, converted by the bind
+    processors of their types, are handed to the driver as tuples.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect
+    compiled = table.insert().compile(dialect=dialect, column_keys=list(columns))
+    values = {}
+    for name, column_values in columns.items():
+        process = table.c[name].type.dialect_impl(dialect).bind_processor(dialect)
+        values[name] = column_values if process is None else map(process, column_values)
+    if compiled.positional:
+        rows = zip(*[values[name] for name in compiled.positiontup])
+    else:
+        names = list(values)
+        rows = [dict(zip(names, row)) for row in zip(*[values[name] for name in names])]
+    if rows:
+        connection.connection.cursor().executemany(str(compiled), rows)
+    return len(rows)
+
+def seed_orders(orders, seed=0, customers=None, customer_skew=1.1, items=(1, 50),
+                items_skew=0.0, products=1000, product_skew=0.8, statuses=DEFAULT_STATUSES,
+                date_from=datetime(2018, 1, 1), date_to=datetime(2019, 1, 1)):
+    """
+    Inserts generated orders and their items after the existing ones
+
+    Args:
+        orders (integer): the number of orders to generate
+        seed (integer): starts the random generator
+        customers (integer): the number of customers (default: orders / 10)
+        customer_skew (float): the power law exponent of the orders per customer
+        items (tuple): the least and most items of an order
+        items_skew (float): the power law exponent of the items per order,
+            0 for a uniform count
+        products (integer): the number of products
+        product_skew (float): the power law exponent of the product popularity
+        statuses (list): (status, weight) of the order statuses
+        date_from (datetime): the earliest order date
+        date_to (datetime): the latest order date
+
+    Returns:
+        dict: the number of orders and items, the elapsed seconds and rows per second
+
+    Raises:
+        ValueError: when a setting describes an empty distribution
+    """
+    if date_to < date_from:
+        raise ValueError('the dates {} to {} are out of order'.format(date_from, date_to))
+    rand = random.Random(seed)
+    settings = {
+        'customers': power_law(1, customers or max(orders // 10, 1), customer_skew),
+        'items': power_law(items[0], items[1], items_skew),
+        'products': power_law(1, products, product_skew),
+        'statuses': Distribution([status for status, _ in statuses],
+                                 [weight for _, weight in statuses]),
+        'date_from': date_from,
+        'date_to': date_to,
+    }
+    settings['prices'] = [None] + [round(rand.uniform(0.5, 100), 2) for _ in xrange(products)]
+    settings['names'] = [None] + ['product %d' % product_id
+                                  for product_id in xrange(1, products + 1)]
+
+    summary = {'orders': 0, 'items': 0}
+    start = time.time()
+    first_id = next_id(Order)
+    for offset in xrange(0, orders, BATCH_ORDERS):
+        order_columns, item_columns = generate_batch(rand, first_id + offset,
+                                                     min(BATCH_ORDERS, orders - offset), settings)
+        summary['orders'] += insert_columns(Order.__table__, order_columns)
+        summary['items'] += insert_columns(Item.__table__, item_columns)
+        db.session.commit()
+        logger.info('Seeded %s orders and %s items', summary['orders'], summary['items'])
+
+    summary['seconds'] = time.time() - start
+    rows = summary['orders'] + summary['items']
+    summary['rows_per_second'] = rows / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
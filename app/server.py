@@ -1,10 +1,19 @@
 import sys
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from itertools import chain
+from flask import Flask, Response, jsonify, json, request, url_for, make_response, abort, \
+    stream_with_context
 from flask_api import status    # HTTP Status Codes
 from flasgger import Swagger
-from app.models import Order, Item, DataValidationError
-from app import app
+from app.models import Order, Item, DataValidationError, StaleVersionError, keyset_page, \
+    keyset_batches, stream_rows, row_etag
+from app.jobs import Job, JobFile, runner
+from app.encoder import row_encoder
+from app.export import EXPORT_FORMATS
+from app.compression import send_static
+from app.replicas import replica_reads
+from app.idempotency import idempotent
+from app import app, cache, metrics
 from werkzeug.exceptions import NotFound
 
 
@@ -41,6 +50,11 @@ def request_validation_error(error):
     """ Handles Value Errors from bad data """
     return bad_request(error)
 
+@app.errorhandler(StaleVersionError)
+def stale_version_error(error):
+    """ Handles writes to rows that changed since they were read """
+    return conflict(error)
+
 @app.errorhandler(400)
 def bad_request(error):
     """ Handles bad reuests with 400_BAD_REQUEST """
@@ -62,6 +76,27 @@ def method_not_supported(error):
     app.logger.info(message)
     return jsonify(status=405, error='Method not Allowed', message=message), 405
 
+@app.errorhandler(409)
+def conflict(error):
+    """ Handles requests that conflict with the resource state with 409_CONFLICT """
+    message = error.message or str(error)
+    app.logger.info(message)
+    return jsonify(status=409, error='Conflict', message=message), 409
+
+@app.errorhandler(412)
+def precondition_failed(error):
+    """ Handles stale conditional requests with 412_PRECONDITION_FAILED """
+    message = error.message or str(error)
+    app.logger.info(message)
+    return jsonify(status=412, error='Precondition Failed', message=message), 412
+
+@app.errorhandler(422)
+def unprocessable_entity(error):
+    """ Handles requests that cannot be applied with 422_UNPROCESSABLE_ENTITY """
+    message = error.message or str(error)
+    app.logger.info(message)
+    return jsonify(status=422, error='Unprocessable Entity', message=message), 422
+
 @app.errorhandler(415)
 def mediatype_not_supported(error):
     """ Handles unsuppoted media requests with 415_UNSUPPORTED_MEDIA_TYPE """
@@ -83,13 +118,14 @@ def internal_server_error(error):
 @app.route('/')
 def index():
     """ Root URL response """
-    return app.send_static_file('index.html')
+    return send_static('index.html')
 
 
 ######################################################################
 # CREATE A NEW ORDER
 ######################################################################
 @app.route('/orders', methods=['POST'])
+@idempotent
 def create_order():
     """
     Creates an Order object based on the JSON posted
@@ -102,6 +138,12 @@ def create_order():
     produces:
       - application/json
     parameters:
+      - name: Idempotency-Key
+        in: header
+        description: a unique key of the request, a retry with the same key and body
+          gets the response of the first request without creating another Order
+        required: false
+        type: string
       - in: body
         name: body
         required: true
@@ -144,6 +186,10 @@ def create_order():
           $ref: '#/definitions/Order'
       400:
         description: Bad Request (the posted data was not valid)
+      409:
+        description: A request with the same Idempotency-Key is still running
+      422:
+        description: The Idempotency-Key was used for a different request
     """
 
     check_content_type('application/json')
@@ -151,26 +197,20 @@ def create_order():
     json_post = request.get_json()
 
     order.deserialize(json_post)
-    order.save()
-    message = order.serialize()
 
     """
-    Want to get the items from POST and create items associated
-    with order
+    Validate every item before anything is written so that the order
+    and its items are saved together in one transaction
     """
-    current_order_id = message['id']
-    items = json_post['items']
-    items_response = []
-    for item_dict in items:
+    items = []
+    for item_dict in json_post.get('items', []):
         item = Item()
-        item.deserialize(item_dict, current_order_id)
-        item.save()
-        items_response.append(item.serialize())
-    """
-    The individual responses during the loop were added to a list
-    so that the responses can be added to the POST response
-    """
-    message['items'] = items_response
+        item.deserialize(item_dict, None)
+        items.append(item)
+    saved_items = order.save_with_items(items)
+
+    message = order.serialize()
+    message['items'] = [item.serialize() for item in saved_items]
 
     location_url = url_for('get_orders', order_id=order.id, _external=True)
     return make_response(jsonify(message), status.HTTP_201_CREATED,
@@ -183,6 +223,7 @@ def create_order():
 # RETRIEVE A ORDER
 ######################################################################
 @app.route('/orders/<int:order_id>', methods=['GET'])
+@replica_reads
 def get_orders(order_id):
     """
     Retrieve a single Order
@@ -198,24 +239,34 @@ def get_orders(order_id):
         description: ID of order to retrieve
         type: integer
         required: true
+      - name: expand
+        in: query
+        description: set to items to include the Items of the Order
+        required: false
+        type: string
     responses:
       200:
         description: Order details returned
         schema:
           $ref: '#/definitions/Order'
+      304:
+        description: Order not modified since the ETag in If-None-Match
       404:
         description: Order not found
     """
     order = Order.get(order_id)
     if not order:
         raise NotFound("Order with id '{}' was not found.".format(order_id))
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    if expand_items():
+        return json_response(Order.serialize_with_items([order])[0])
+    return row_response(order)
 
 
 ######################################################################
 # RETRIEVE AN ITEM
 ######################################################################
 @app.route('/items/<int:item_id>', methods=['GET'])
+@replica_reads
 def get_item(item_id):
     """
     Retrieve a single Item
@@ -237,25 +288,30 @@ def get_item(item_id):
         description: Item details returned
         schema:
           $ref: '#/definitions/Item'
+      304:
+        description: Item not modified since the ETag in If-None-Match
       404:
         description: Item not found
     """
     item = Item.get(item_id)
     if not item:
         raise NotFound("Item with id '{}' was not found.".format(item_id))
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    return row_response(item)
 
 
 ######################################################################
 # LIST ALL ITEMS
 ######################################################################
 @app.route('/items', methods=['GET'])
+@replica_reads
 def list_items():
     """ Returns all of the Items
     ---
     tags:
       - Items
-    description: The Items endpoint allows you to query Items
+    description: The Items endpoint allows you to query Items. All of the
+      filters given are combined, and a comma separated list of ids,
+      quantities or prices (or a repeated name) matches any of them
     parameters:
       - name: order_id
         in: query
@@ -277,11 +333,36 @@ def list_items():
         description: the price of the Item you are looking for
         required: false
         type: number
+      - name: price_min
+        in: query
+        description: the lowest price of the Items you are looking for
+        required: false
+        type: number
+      - name: price_max
+        in: query
+        description: the highest price of the Items you are looking for
+        required: false
+        type: number
       - name: name
         in: query
         description: the name of the Item you are looking for
         required: false
         type: string
+      - name: after_id
+        in: query
+        description: only return Items with an id greater than this one
+        required: false
+        type: integer
+      - name: limit
+        in: query
+        description: the maximum number of Items to return, a Link header points to the next page
+        required: false
+        type: integer
+      - name: stream
+        in: query
+        description: set to true to stream every matching Item as a JSON array
+        required: false
+        type: boolean
     definitions:
       Item:
         type: object
@@ -304,6 +385,9 @@ def list_items():
           price:
             type: number
             description: the price of the item
+          version:
+            type: integer
+            description: incremented by every change, the ETag of the item
     responses:
       200:
         description: An array of Items
@@ -313,41 +397,23 @@ def list_items():
             schema:
               $ref: '#/definitions/Item'
     """
-    items = []
-
-    order_id = request.args.get('order_id')
-    product_id = request.args.get('product_id')
-    quantity = request.args.get('quantity')
-    price = request.args.get('price')
-    name = request.args.get('name')
-
-    if order_id:
-        items = Item.find_by_order_id(order_id)
-    elif product_id:
-        items = Item.find_by_product_id(product_id)
-    elif quantity:
-        items = Item.find_by_quantity(quantity)
-    elif price:
-        items = Item.find_by_price(price)
-    elif name:
-        items = Item.find_by_name(name)
-    else:
-        items = Item.all()
-
-    results = [item.serialize() for item in items]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    items = Item.find_by_filters(request.args)
+    return list_response(items, Item)
 
 
 ######################################################################
 # LIST ALL ORDERS
 ######################################################################
 @app.route('/orders', methods=['GET'])
+@replica_reads
 def list_orders():
     """ Returns all of the Orders
     ---
     tags:
       - Orders
-    description: The Orders endpoint allows you to query Orders
+    description: The Orders endpoint allows you to query Orders. All of the
+      filters given are combined, and a comma separated list of customer
+      ids or statuses matches any of them
     parameters:
       - name: customer_id
         in: query
@@ -364,6 +430,46 @@ def list_orders():
         description: the Order date
         required: false
         type: string
+      - name: date_from
+        in: query
+        description: the earliest Order date
+        required: false
+        type: string
+      - name: date_to
+        in: query
+        description: the latest Order date
+        required: false
+        type: string
+      - name: min_total
+        in: query
+        description: the smallest Order total
+        required: false
+        type: number
+      - name: max_total
+        in: query
+        description: the largest Order total
+        required: false
+        type: number
+      - name: expand
+        in: query
+        description: set to items to include the Items of each Order
+        required: false
+        type: string
+      - name: after_id
+        in: query
+        description: only return Orders with an id greater than this one
+        required: false
+        type: integer
+      - name: limit
+        in: query
+        description: the maximum number of Orders to return, a Link header points to the next page
+        required: false
+        type: integer
+      - name: stream
+        in: query
+        description: set to true to stream every matching Order as a JSON array
+        required: false
+        type: boolean
     definitions:
       Order:
         type: object
@@ -380,6 +486,15 @@ def list_orders():
           date:
             type: string
             description: the date of the order
+          item_count:
+            type: integer
+            description: the number of items in the order
+          order_total:
+            type: number
+            description: the sum of quantity times price of the items
+          version:
+            type: integer
+            description: incremented by every change, the ETag of the order
     responses:
       200:
         description: An array of Orders
@@ -389,22 +504,214 @@ def list_orders():
             schema:
               $ref: '#/definitions/Order'
     """
-    orders = []
-    customer_id = request.args.get('customer_id')
-    order_status = request.args.get('status')
-    date = request.args.get('date')
-
-    if customer_id:
-        orders = Order.find_by_customer_id(customer_id)
-    elif order_status:
-        orders = Order.find_by_status(order_status)
-    elif date:
-        orders = Order.find_by_date(date)
-    else:
-        orders = Order.all()
+    orders = Order.find_by_filters(request.args)
+    if expand_items():
+        return list_response(orders, Order, Order.serialize_with_items)
+    return list_response(orders, Order)
+
+
+######################################################################
+# EXPORT ORDERS WITH THEIR ITEMS
+######################################################################
+@app.route('/orders/export', methods=['GET'])
+def export_orders():
+    """ Streams the Orders with their Items as NDJSON or CSV
+    ---
+    tags:
+      - Orders
+    produces:
+      - application/x-ndjson
+      - text/csv
+    description: Streams every matching Order with its Items in one pass.
+      NDJSON holds one Order per line as GET /orders?expand=items returns
+      it, CSV one row per Item. The body is compressed when the client accepts it. Takes
+      the same filters as the Orders list
+    parameters:
+      - name: format
+        in: query
+        description: ndjson (default) or csv
+        required: false
+        type: string
+      - name: customer_id
+        in: query
+        description: the customer_id of the Orders to export
+        required: false
+        type: integer
+      - name: status
+        in: query
+        description: the status of the Orders to export
+        required: false
+        type: string
+      - name: date
+        in: query
+        description: the Order date
+        required: false
+        type: string
+      - name: date_from
+        in: query
+        description: the earliest Order date
+        required: false
+        type: string
+      - name: date_to
+        in: query
+        description: the latest Order date
+        required: false
+        type: string
+    responses:
+      200:
+        description: The Orders with their Items
+      400:
+        description: Bad filter or format
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        abort(400, 'format must be one of {}'.format(', '.join(sorted(EXPORT_FORMATS))))
+    writer, mimetype = EXPORT_FORMATS[export_format]
+    batch_size = app.config['STREAM_BATCH_SIZE']
+    rows = Order.export_rows(request.args, batch_size)
+
+    headers = {'Content-Disposition': 'attachment; filename=orders.{}'.format(export_format)}
+    return Response(stream_with_context(writer(rows, batch_size)), mimetype=mimetype,
+                    headers=headers)
+
+
+######################################################################
+# ORDER TOTALS
+######################################################################
+@app.route('/orders/<int:order_id>/total', methods=['GET'])
+@replica_reads
+def get_order_total(order_id):
+    """ Returns the item count, quantity and total price of an Order
+    ---
+    tags:
+      - Reports
+    produces:
+      - application/json
+    parameters:
+      - name: order_id
+        in: path
+        description: ID of the Order
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The totals of the Order
+        schema:
+          $ref: '#/definitions/OrderTotal'
+      404:
+        description: Order not found
+    """
+    total = Order.get_total(order_id)
+    if not total:
+        raise NotFound("Order with id '{}' was not found.".format(order_id))
+    return json_response(Order.serialize_totals([total])[0])
+
+@app.route('/orders/totals', methods=['GET'])
+@replica_reads
+def list_order_totals():
+    """ Returns the item count, quantity and total price of every Order
+    ---
+    tags:
+      - Reports
+    produces:
+      - application/json
+    description: Takes the same filters, paging and streaming parameters as
+      the Orders list
+    parameters:
+      - name: customer_id
+        in: query
+        description: the customer_id of the Orders
+        required: false
+        type: integer
+      - name: status
+        in: query
+        description: the status of the Orders
+        required: false
+        type: string
+      - name: date_from
+        in: query
+        description: the earliest Order date
+        required: false
+        type: string
+      - name: date_to
+        in: query
+        description: the latest Order date
+        required: false
+        type: string
+      - name: after_id
+        in: query
+        description: only return Orders with an id greater than this one
+        required: false
+        type: integer
+      - name: limit
+        in: query
+        description: the maximum number of Orders to return
+        required: false
+        type: integer
+    definitions:
+      OrderTotal:
+        type: object
+        properties:
+          order_id:
+            type: integer
+          item_count:
+            type: integer
+          quantity:
+            type: integer
+          total:
+            type: number
+    responses:
+      200:
+        description: An array of Order totals
+        schema:
+          type: array
+          items:
+            schema:
+              $ref: '#/definitions/OrderTotal'
+    """
+    return list_response(Order.find_totals(request.args), Order, Order.serialize_totals)
 
-    results = [order.serialize() for order in orders]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+
+######################################################################
+# REVENUE REPORT
+######################################################################
+@app.route('/reports/revenue', methods=['GET'])
+@replica_reads
+def revenue_report():
+    """ Returns the revenue grouped by customer, product, day or status
+    ---
+    tags:
+      - Reports
+    produces:
+      - application/json
+    parameters:
+      - name: group_by
+        in: query
+        description: customer, product, day or status
+        required: true
+        type: string
+      - name: from
+        in: query
+        description: the earliest Order date
+        required: false
+        type: string
+      - name: to
+        in: query
+        description: the latest Order date, a date includes that whole day
+        required: false
+        type: string
+      - name: status
+        in: query
+        description: only count Orders with these statuses
+        required: false
+        type: string
+    responses:
+      200:
+        description: The number of orders, items, quantity and revenue per group
+      400:
+        description: Bad group_by or filter
+    """
+    return json_response(Order.revenue(request.args.get('group_by'), request.args))
 
 
 ######################################################################
@@ -437,7 +744,101 @@ def list_items_from_an_order(order_id):
     items = Item.find_by_order_id(order_id)
 
     results = [item.serialize() for item in items]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    return json_response(results)
+
+
+######################################################################
+# DELETE MANY ORDERS
+######################################################################
+@app.route('/orders', methods=['DELETE'])
+def delete_orders():
+    """
+    Delete many Orders
+
+    This endpoint will delete every Order whose id is listed in the ids
+    query parameter together with the items associated with them
+    ---
+    tags:
+      - Orders
+    description: Deletes Orders and their Items from the database
+    produces:
+      - application/json
+    parameters:
+      - name: ids
+        in: query
+        description: comma separated ids of the orders to delete
+        type: string
+        required: true
+    responses:
+      200:
+        description: The number of Orders deleted
+      400:
+        description: Bad Request (no ids or an id that is not an integer)
+    """
+    order_ids = get_int_list_arg('ids')
+    if not order_ids:
+        abort(400, 'ids of the orders to delete are required')
+    deleted = Order.remove_by_ids(order_ids, app.config['BULK_DELETE_BATCH_SIZE'])
+    return make_response(jsonify(deleted=deleted), status.HTTP_200_OK)
+
+
+######################################################################
+# CHANGE THE STATUS OF MANY ORDERS
+######################################################################
+@app.route('/orders/status', methods=['PUT'])
+def update_orders_status():
+    """
+    Change the status of many Orders
+
+    This endpoint moves every Order selected by ids and/or a filter to a
+    new status with set-based updates
+    ---
+    tags:
+      - Orders
+    description: Orders can be shipped or cancelled while processing and
+      returned once shipped, Orders in any other status are left unchanged
+    consumes:
+      - application/json
+    produces:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: status_change
+          required:
+            - status
+          properties:
+            status:
+              type: string
+              description: the new status, shipped, cancelled or returned
+            ids:
+              type: array
+              items:
+                type: integer
+              description: the ids of the Orders to change
+            filter:
+              type: object
+              description: Order list filters such as customer_id, status,
+                date_from and date_to
+    responses:
+      200:
+        description: The number of Orders changed
+      400:
+        description: Bad Request (unknown status, no ids or filter, or an unknown, blank or bad filter)
+    """
+    check_content_type('application/json')
+    body = request.get_json()
+    if not isinstance(body, dict):
+        abort(400, 'body must be an object with a status')
+    order_ids = body.get('ids') or []
+    args = body.get('filter') or {}
+    if not isinstance(order_ids, list) or not isinstance(args, dict):
+        abort(400, 'ids must be a list and filter an object')
+    updated = Order.transition_status(body.get('status'), order_ids, args,
+                                      app.config['BULK_STATUS_BATCH_SIZE'])
+    return make_response(jsonify(updated=updated), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -497,20 +898,20 @@ def delete_item(order_id, item_id):
     responses:
       204:
         description: Item deleted from order
+      404:
+        description: The order has no such item
+      409:
+        description: The version in the body is out of date
+      412:
+        description: If-Match does not match the current ETag
     """
-    item = Item.get(item_id)
-
-    if item is None:
+    versions, stale_status = expected_versions(request.get_json(silent=True))
+    try:
+        deleted = Item.delete_by_id(order_id, item_id, versions)
+    except StaleVersionError as error:
+        abort(stale_status, str(error))
+    if not deleted:
         raise NotFound("Order id '{}' has no item with id '{}'.".format(order_id, item_id))
-
-    check_order_id = item.order_id
-
-    if order_id != check_order_id:
-        raise NotFound("Order id '{}' does not have item with id '{}'.".format(order_id, item_id))
-
-    if item:
-        item.delete()
-
     return make_response('', status.HTTP_204_NO_CONTENT)
 
 
@@ -554,6 +955,9 @@ def update_orders(order_id):
             date:
                 type: string
                 description: the date of the order
+            version:
+                type: integer
+                description: the version the order must still have
     responses:
       200:
         description: Order updated
@@ -561,15 +965,22 @@ def update_orders(order_id):
           $ref: '#/definitions/Order'
       400:
         description: Bad Request (the posted data was not valid)
+      409:
+        description: The version in the body is out of date
+      412:
+        description: If-Match does not match the current ETag
     """
     check_content_type('application/json')
-    order = Order.get(order_id)
-    if not order:
+    data = request.get_json()
+    versions, stale_status = expected_versions(data)
+    values = Order().deserialize(data).updated_values()
+    try:
+        updated = Order.update_by_id(order_id, values, versions)
+    except StaleVersionError as error:
+        abort(stale_status, str(error))
+    if not updated:
         raise NotFound("Order with id '{}' was not found.".format(order_id))
-    order.deserialize(request.get_json())
-    order.id = order_id
-    order.save()
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    return row_response(Order.get(order_id))
 
 
 ######################################################################
@@ -620,6 +1031,9 @@ def update_items(order_id, item_id):
           price:
             type: number
             description: the price of the item
+          version:
+            type: integer
+            description: the version the item must still have
     responses:
       200:
         description: Item updated
@@ -627,15 +1041,97 @@ def update_items(order_id, item_id):
           $ref: '#/definitions/Item'
       400:
         description: Bad Request (the posted data was not valid)
+      404:
+        description: The order has no such item
+      409:
+        description: The version in the body is out of date
+      412:
+        description: If-Match does not match the current ETag
     """
     check_content_type('application/json')
-    item = Item.get(item_id)
-    if not item:
-        raise NotFound("Item with id '{}' was not found.".format(item_id))
-    item.deserialize(request.get_json(), order_id)
-    item.id = item_id
-    item.save()
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    data = request.get_json()
+    versions, stale_status = expected_versions(data)
+    try:
+        updated = Item.update_by_id(order_id, item_id, data, versions)
+    except StaleVersionError as error:
+        abort(stale_status, str(error))
+    if not updated:
+        raise NotFound("Order id '{}' has no item with id '{}'.".format(order_id, item_id))
+    return row_response(Item.get(item_id))
+
+
+######################################################################
+# ADD, UPDATE AND REMOVE MANY ITEMS OF AN ORDER
+######################################################################
+@app.route('/orders/<int:order_id>/items', methods=['PATCH'])
+def patch_items(order_id):
+    """
+    Change many Items of an Order
+
+    This endpoint will apply a list of add, update and remove operations
+    to the Items of an Order in a single transaction
+    ---
+    tags:
+      - Items
+    consumes:
+      - application/json
+    produces:
+      - application/json
+    parameters:
+      - name: order_id
+        in: path
+        description: ID of the order whose items are changed
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: array
+          items:
+            required:
+              - op
+            properties:
+              op:
+                type: string
+                description: add, update or remove
+              id:
+                type: integer
+                description: the id of the item to update or remove
+              name:
+                type: string
+                description: the item name
+              product_id:
+                type: integer
+                description: the product_id of the item
+              quantity:
+                type: integer
+                description: the quantity of the item
+              price:
+                type: number
+                description: the price of the item
+    responses:
+      200:
+        description: The Items of the Order after the changes
+        schema:
+          type: array
+          items:
+            schema:
+              $ref: '#/definitions/Item'
+      400:
+        description: Bad Request (an operation was not valid)
+      404:
+        description: Order not found
+    """
+    check_content_type('application/json')
+    order = Order.get(order_id)
+    if not order:
+        raise NotFound("Order with id '{}' was not found.".format(order_id))
+    operations = request.get_json()
+    if not isinstance(operations, list):
+        raise DataValidationError('Invalid operations: body of request must be a list')
+    items = order.patch_items(operations)
+    return make_response(jsonify([item.serialize() for item in items]), status.HTTP_200_OK)
 
 
 ######################################################################
@@ -658,15 +1154,237 @@ def cancel_orders(order_id):
         type: integer
         required: true
     responses:
-      204:
+      200:
         description: Order cancelled
+      404:
+        description: Order not found
+      409:
+        description: The version in the body is out of date
+      412:
+        description: If-Match does not match the current ETag
     """
-    order = Order.get(order_id)
-    if not order:
-        abort(HTTP_404_NOT_FOUND, "Order with id '{}' was not found.".format(order_id))
-    order.status = 'cancelled'
-    order.save()
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    versions, stale_status = expected_versions(request.get_json(silent=True))
+    try:
+        updated = Order.update_by_id(order_id, {'status': 'cancelled'}, versions)
+    except StaleVersionError as error:
+        abort(stale_status, str(error))
+    if not updated:
+        raise NotFound("Order with id '{}' was not found.".format(order_id))
+    return row_response(Order.get(order_id))
+
+######################################################################
+# BACKGROUND JOBS
+######################################################################
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Starts a background Job
+    ---
+    tags:
+      - Jobs
+    description: Runs a long bulk operation outside of the request. The
+      Job is polled with GET /jobs/{job_id}
+    consumes:
+      - application/json
+    produces:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: job
+          required:
+            - kind
+          properties:
+            kind:
+              type: string
+              description: purge, status, rebuild_totals or export
+            params:
+              type: object
+              description: ids and/or filter of the Orders, the new status
+                of a status Job and the format (ndjson or csv) of an export
+                Job. A rebuild_totals Job of every Order needs {"all": true}
+    responses:
+      202:
+        description: Job accepted
+        schema:
+          $ref: '#/definitions/Job'
+      400:
+        description: Bad Request (unknown kind, bad params, or an unknown or blank filter)
+    """
+    check_content_type('application/json')
+    body = request.get_json()
+    if not isinstance(body, dict):
+        abort(400, 'body must be an object with a kind')
+    job = Job.create(body.get('kind'), body.get('params', {}))
+    runner.submit(job.id)
+    location_url = url_for('get_job', job_id=job.id, _external=True)
+    return make_response(jsonify(job.serialize()), status.HTTP_202_ACCEPTED,
+                         {'Location': location_url})
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Retrieve a background Job with its progress
+    ---
+    tags:
+      - Jobs
+    produces:
+      - application/json
+    parameters:
+      - name: job_id
+        in: path
+        description: ID of the Job
+        type: integer
+        required: true
+    definitions:
+      Job:
+        type: object
+        properties:
+          id:
+            type: integer
+          kind:
+            type: string
+          status:
+            type: string
+            description: pending, running, succeeded, failed or cancelled
+          total:
+            type: integer
+            description: the number of rows the Job processes
+          processed:
+            type: integer
+            description: the number of rows processed so far
+          progress:
+            type: number
+            description: processed divided by total
+          rows_per_second:
+            type: number
+          result:
+            type: object
+          error:
+            type: string
+    responses:
+      200:
+        description: The Job
+        schema:
+          $ref: '#/definitions/Job'
+      404:
+        description: Job not found
+    """
+    job = Job.get(job_id)
+    if not job:
+        raise NotFound("Job with id '{}' was not found.".format(job_id))
+    return make_response(jsonify(job.serialize()), status.HTTP_200_OK)
+
+@app.route('/jobs/<int:job_id>/file', methods=['GET'])
+def get_job_file(job_id):
+    """
+    Download the file written by an export Job
+    ---
+    tags:
+      - Jobs
+    description: The file is stored in the database, so any instance
+      serves it
+    produces:
+      - application/x-ndjson
+      - text/csv
+    parameters:
+      - name: job_id
+        in: path
+        description: ID of the export Job
+        type: integer
+        required: true
+    responses:
+      200:
+        description: The exported Orders
+      404:
+        description: Job or file not found
+      409:
+        description: The Job has not succeeded
+    """
+    job = Job.get(job_id)
+    if not job or job.kind != 'export':
+        raise NotFound("Export job with id '{}' was not found.".format(job_id))
+    if job.status != 'succeeded':
+        abort(409, "Job with id '{}' has not succeeded.".format(job_id))
+    export_format = json.loads(job.params).get('format', 'ndjson')
+    headers = {'Content-Disposition': 'attachment; filename=orders-{}.{}'.format(
+        job_id, export_format)}
+    return Response(stream_with_context(JobFile.read(job_id)),
+                    mimetype=EXPORT_FORMATS[export_format][1], headers=headers)
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['PUT'])
+def cancel_job(job_id):
+    """
+    Cancel a background Job
+    ---
+    tags:
+      - Jobs
+    description: A pending Job is cancelled at once, a running Job stops
+      after the batch it is working on
+    produces:
+      - application/json
+    parameters:
+      - name: job_id
+        in: path
+        description: ID of the Job
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Cancellation requested
+        schema:
+          $ref: '#/definitions/Job'
+      404:
+        description: Job not found
+      409:
+        description: The Job has already finished
+    """
+    job = Job.get(job_id)
+    if not job:
+        raise NotFound("Job with id '{}' was not found.".format(job_id))
+    if not job.cancel():
+        abort(409, "Job with id '{}' has already finished.".format(job_id))
+    return make_response(jsonify(job.serialize()), status.HTTP_200_OK)
+
+
+######################################################################
+# CACHE STATISTICS
+######################################################################
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Returns the hit and miss counters of the Order and Item cache
+    ---
+    tags:
+      - Cache
+    produces:
+      - application/json
+    responses:
+      200:
+        description: The cache backend and its counters
+    """
+    return make_response(jsonify(cache.stats()), status.HTTP_200_OK)
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Returns the service metrics in the Prometheus text format
+    ---
+    tags:
+      - Metrics
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Request latency, query and connection pool metrics
+    """
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 
 ######################################################################
 # DELETE ALL ORDER DATA (for testing only)
@@ -702,6 +1420,170 @@ def data_reset():
     """ Removes all Orders from the database """
     Order.remove_all()
 
+def serialize_rows(rows):
+    """ Serializes each row on its own """
+    return [row.serialize() for row in rows]
+
+def dump_rows(serializer):
+    """ Returns a function that encodes a list of rows with a serializer and jsonify's encoder """
+    def encode_rows(rows):
+        """ Returns the JSON of each serialized row """
+        return [json.dumps(data) for data in serializer(rows)]
+    return encode_rows
+
+def list_response(query, model, serializer=serialize_rows):
+    """
+    Builds the response of a list endpoint
+
+    The rows are returned as a keyset paginated page when after_id or
+    limit are given, streamed in batches when stream=true, and as one
+    list otherwise. serializer turns a list of rows into dictionaries
+    and may load related rows for the whole list at once. With the
+    default serializer only the columns are selected and each result
+    tuple is encoded by the model's RowEncoder without a dictionary.
+    """
+    if serializer is serialize_rows:
+        encoder = row_encoder(model)
+        query = query.with_entities(*encoder.columns)
+        encode_rows = encoder.encode_batch
+    else:
+        encoder = None
+        encode_rows = dump_rows(serializer)
+
+    if request.args.get('stream') == 'true':
+        batch_size = app.config['STREAM_BATCH_SIZE']
+        if encoder is not None:
+            rows = stream_rows(query, model, batch_size)
+        else:
+            # an open streaming cursor would block the serializer's queries
+            rows = chain.from_iterable(keyset_batches(query, model, batch_size))
+        return Response(stream_with_context(stream_json_array(rows, encode_rows, batch_size)),
+                        mimetype='application/json')
+
+    after_id = get_int_arg('after_id')
+    limit = get_int_arg('limit')
+    if after_id is None and limit is None:
+        rows = query.all()
+        if encoder is None:
+            return json_response(serializer(rows))
+        with metrics.serialization_timer():
+            body = encoder.encode_rows(rows)
+        return encoded_response(body)
+
+    if limit is None:
+        limit = app.config['PAGE_LIMIT_MAX']
+    if limit < 1:
+        abort(400, 'limit must be a positive integer')
+    limit = min(limit, app.config['PAGE_LIMIT_MAX'])
+    rows = keyset_page(query, model, after_id, limit)
+    headers = {}
+    if len(rows) == limit:
+        args = request.args.to_dict(flat=False)
+        args.update(after_id=rows[-1].id, limit=limit)
+        next_url = url_for(request.endpoint, _external=True, **args)
+        headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    if encoder is None:
+        return json_response(serializer(rows), headers)
+    with metrics.serialization_timer():
+        body = encoder.encode_rows(rows)
+    return encoded_response(body, headers)
+
+def stream_json_array(rows, encode_rows, batch_size):
+    """ Yields a JSON array encoding batch_size rows at a time """
+    yield '['
+    separator = ''
+    batch = []
+    for row in chain(rows, [None]):
+        if row is not None:
+            batch.append(row)
+            if len(batch) < batch_size:
+                continue
+        for data in encode_rows(batch):
+            yield separator + data
+            separator = ','
+        batch = []
+    yield ']'
+
+def row_response(row):
+    """
+    Returns a single row as JSON with its ETag
+
+    A GET whose If-None-Match holds the current ETag is answered with
+    304 Not Modified before the row is serialized.
+    """
+    etag = row_etag(row)
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+        response = make_response('', status.HTTP_304_NOT_MODIFIED)
+    else:
+        encoder = row_encoder(type(row))
+        with metrics.serialization_timer():
+            body = encoder.encode(encoder.values(row))
+        response = Response(body, status.HTTP_200_OK, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+def json_response(data, headers=None):
+    """ Returns data encoded by jsonify with an ETag hashed from the body """
+    return encoded_response(jsonify(data), headers)
+
+def encoded_response(body, headers=None):
+    """
+    Returns an encoded JSON body with an ETag hashed from the body
+
+    A GET whose If-None-Match holds the same ETag is answered with
+    304 Not Modified and no body.
+    """
+    if not isinstance(body, Response):
+        body = Response(body, mimetype='application/json')
+    response = make_response(body, status.HTTP_200_OK, headers or {})
+    response.add_etag()
+    return response.make_conditional(request)
+
+def expected_versions(data=None):
+    """
+    Returns the versions a conditional write expects and its status when stale
+
+    The versions are the ETags in If-Match, whose write fails with 412,
+    or else the version in the body, whose write fails with 409. None
+    means the write does not depend on the version.
+    """
+    if request.if_match and not request.if_match.star_tag:
+        # compressed responses carry the weak form of the same tag
+        versions = [int(tag) for tag in request.if_match.as_set(include_weak=True)
+                    if tag.isdigit()]
+        if not versions:
+            abort(412, 'The resource has been modified since it was read')
+        return versions, status.HTTP_412_PRECONDITION_FAILED
+    if isinstance(data, dict) and data.get('version') is not None:
+        try:
+            return [int(data['version'])], status.HTTP_409_CONFLICT
+        except (TypeError, ValueError):
+            raise DataValidationError('Invalid version: must be an integer')
+    return None, status.HTTP_409_CONFLICT
+
+def expand_items():
+    """ Returns True when the request asks for Orders with their Items """
+    return 'items' in request.args.get('expand', '').split(',')
+
+def get_int_arg(name):
+    """ Returns an integer query parameter or None when it is missing """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, '{} must be an integer'.format(name))
+
+def get_int_list_arg(name):
+    """ Returns a comma separated or repeated query parameter as integers """
+    values = [value for raw in request.args.getlist(name)
+              for value in raw.split(',') if value]
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        abort(400, '{} must be a list of integers'.format(name))
+
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if request.headers['Content-Type'] == content_type:
@@ -1,7 +1,8 @@
 """
 VCAP Services module
 This module initializes the database connection String
-from VCAP_SERVICES in Bluemix if Found
+from VCAP_SERVICES in Bluemix if Found, and the connection
+Strings of its read replicas
 """
 
 import os
@@ -45,4 +46,51 @@ def get_database_uri():
 
     logging.info("Connecting to database on host %s port %s", hostname, port)
     connect_string = 'mysql+pymysql://{}:{}@{}:{}/{}'
-    return connect_string.format(username, password, hostname, port, name)
\ No newline at end of file
+    return connect_string.format(username, password, hostname, port, name)
+
+def get_redis_url():
+    """
+    Returns the connection String of a Redis server shared by every instance
+    This method will work in the following conditions:
+      1) With CACHE_REDIS_URL holding the connection String
+      2) In Bluemix with a rediscloud or compose-for-redis service bound
+    Otherwise there is no shared Redis server and None is returned.
+    """
+    if os.getenv('CACHE_REDIS_URL'):
+        return os.environ['CACHE_REDIS_URL']
+    if 'VCAP_SERVICES' in os.environ:
+        services = json.loads(os.environ['VCAP_SERVICES'])
+        for name in ('rediscloud', 'compose-for-redis'):
+            if not services.get(name):
+                continue
+            creds = services[name][0]['credentials']
+            logging.info("Using %s for the cache", name)
+            if 'uri' in creds:
+                return creds['uri']
+            return 'redis://:{}@{}:{}/0'.format(creds['password'], creds['hostname'],
+                                                creds['port'])
+    return None
+
+def get_replica_uris():
+    """
+    Returns the connection Strings of the read replicas
+    This method will work in the following conditions:
+      1) With DATABASE_REPLICA_URIS holding comma separated connection Strings
+      2) In Bluemix with more cleardb services bound whose names contain 'replica'
+    Otherwise there are no replicas and every query goes to the primary.
+    """
+    if os.getenv('DATABASE_REPLICA_URIS'):
+        return [uri.strip() for uri in os.environ['DATABASE_REPLICA_URIS'].split(',')
+                if uri.strip()]
+    uris = []
+    if 'VCAP_SERVICES' in os.environ:
+        services = json.loads(os.environ['VCAP_SERVICES'])
+        for service in services.get('cleardb', [])[1:]:
+            if 'replica' not in service.get('name', ''):
+                continue
+            creds = service['credentials']
+            logging.info("Using replica %s on host %s", service['name'], creds['hostname'])
+            uris.append('mysql+pymysql://{}:{}@{}:{}/{}'.format(
+                creds['username'], creds['password'], creds['hostname'],
+                creds['port'], creds['name']))
+    return uris
@@ -0,0 +1,91 @@
+"""
+Order Creation Benchmark
+Compares the old per-item save loop with the single transaction
+bulk insert used by POST /orders as the number of items grows.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_create_order
+
+Enviroment Variables:
+---------------------
+    - DATABASE_URI: the database to benchmark against
+    - BENCH_ROUNDS: number of orders created per item count (default 20)
+"""
+
+import os
+import json
+import time
+from sqlalchemy import event
+from app import app, db
+from app.models import Order, Item
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+ROUNDS = int(os.getenv('BENCH_ROUNDS', '20'))
+ITEM_COUNTS = [1, 10, 50, 100]
+
+COUNTERS = {'commits': 0, 'statements': 0}
+
+
+def count_commit(conn):
+    """ Counts every COMMIT sent to the database """
+    COUNTERS['commits'] += 1
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    """ Counts every statement sent to the database """
+    COUNTERS['statements'] += 1
+
+def make_order(item_count):
+    """ Builds the JSON body of an order with item_count items """
+    return {
+        'customer_id': 1,
+        'date': '2018-04-23T11:11',
+        'status': 'processing',
+        'items': [{'product_id': i, 'name': 'item %d' % i,
+                   'quantity': 1, 'price': 1.50} for i in range(item_count)]
+    }
+
+def create_one_by_one(data):
+    """ The old create_order path: one commit per row """
+    order = Order().deserialize(data)
+    order.save()
+    for item_dict in data['items']:
+        Item().deserialize(item_dict, order.id).save()
+
+def create_with_bulk_insert(client, data):
+    """ The current create_order path through the REST API """
+    resp = client.post('/orders', data=json.dumps(data),
+                       content_type='application/json')
+    assert resp.status_code == 201
+
+def measure(label, item_count, func):
+    """ Runs func ROUNDS times and prints commits, statements and latency """
+    COUNTERS['commits'] = COUNTERS['statements'] = 0
+    start = time.time()
+    for _ in range(ROUNDS):
+        func()
+    elapsed = (time.time() - start) / ROUNDS
+    print('{:<12} {:>6} {:>10.1f} {:>12.1f} {:>12.2f}'.format(
+        label, item_count, COUNTERS['commits'] / float(ROUNDS),
+        COUNTERS['statements'] / float(ROUNDS), elapsed * 1000))
+
+
+######################################################################
+# MAIN
+######################################################################
+if __name__ == '__main__':
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    db.drop_all()
+    db.create_all()
+    event.listen(db.engine, 'commit', count_commit)
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    client = app.test_client()
+
+    print('{:<12} {:>6} {:>10} {:>12} {:>12}'.format(
+        'path', 'items', 'commits', 'statements', 'ms/order'))
+    for count in ITEM_COUNTS:
+        data = make_order(count)
+        measure('per-item', count, lambda: create_one_by_one(data))
+        measure('bulk', count, lambda: create_with_bulk_insert(client, data))
+
+    db.session.remove()
+    db.drop_all()
@@ -0,0 +1,407 @@
+"""
+HTTP Benchmark
+Seeds the database with each of the configured numbers of orders,
+generated by app.seeder with a fixed seed, and sends every route of
+app/server.py a series of requests, first through the Flask test
+client and then through a real WSGI server listening on a local port.
+For each route it records the p50/p95/p99 latency, the throughput, the
+statements run per request and the peak memory of the process, and
+writes them to a JSON file.
+
+The file of an earlier run can be given as a baseline, the measures
+that got worse than it by more than BENCH_TOLERANCE are listed and the
+benchmark exits with status 1, so it can gate a change.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_http
+  cp bench_http.json baseline.json
+  DATABASE_URI=sqlite:////tmp/bench.db BENCH_BASELINE=baseline.json python -m benchmarks.bench_http
+
+Enviroment Variables:
+---------------------
+    - DATABASE_URI: the database to benchmark against
+    - BENCH_ORDERS: comma separated numbers of orders to seed (default 10000)
+    - BENCH_ITEMS: the range of items per order (default 1-50)
+    - BENCH_REQUESTS: number of requests sent to each route (default 100)
+    - BENCH_MODES: client, wsgi or both comma separated (default client,wsgi)
+    - BENCH_OUTPUT: the JSON file the results are written to (default bench_http.json)
+    - BENCH_BASELINE: the JSON file of an earlier run to compare with
+    - BENCH_TOLERANCE: the fraction a measure may get worse by (default 0.25)
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import httplib
+import logging
+import platform
+import resource
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server
+from app import app, db, cache
+from app.jobs import Job, runner
+from app.models import Item
+from app.seeder import seed_orders
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+VOLUMES = [int(count) for count in os.getenv('BENCH_ORDERS', '10000').split(',')]
+ITEMS = [int(count) for count in os.getenv('BENCH_ITEMS', '1-50').split('-')]
+REQUESTS = int(os.getenv('BENCH_REQUESTS', '100'))
+MODES = os.getenv('BENCH_MODES', 'client,wsgi').split(',')
+OUTPUT = os.getenv('BENCH_OUTPUT', 'bench_http.json')
+BASELINE = os.getenv('BENCH_BASELINE')
+TOLERANCE = float(os.getenv('BENCH_TOLERANCE', '0.25'))
+
+# latency changes smaller than this are noise
+NOISE_MS = 1.0
+# DELETE /orders/reset would empty the seeded database
+SKIPPED_ROUTES = ['DELETE /orders/reset']
+
+# statements run by each thread, the serving thread's count is per request
+QUERY_COUNTS = Counter()
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """ Counts every statement sent to the database by the thread running it """
+    QUERY_COUNTS[threading.current_thread().ident] += 1
+
+class Targets(object):
+    """ Hands out the ids that the requests act on
+
+    Reads pick from the first half of the orders and every write takes
+    an order of the second half that no other request has changed.
+    """
+
+    def __init__(self, orders):
+        self.rand = random.Random(1)
+        self.orders = orders
+        self.next_write = orders
+        self.export_job_id = None
+
+    def read(self):
+        """ Returns the id of an order to read """
+        return self.rand.randint(1, self.orders // 2 or 1)
+
+    def write(self):
+        """ Returns the id of an order no request has written yet """
+        if self.next_write <= self.orders // 2:
+            raise RuntimeError('BENCH_REQUESTS is too large for {} orders'.format(self.orders))
+        self.next_write -= 1
+        return self.next_write + 1
+
+    def customer(self):
+        """ Returns the id of a customer """
+        return self.rand.randint(1, self.orders // 10 or 1)
+
+    def item(self, order_id):
+        """ Returns the id of the first item of an order """
+        items = Item.__table__
+        return db.engine.execute(select([func.min(items.c.id)])
+                                 .where(items.c.order_id == order_id)).scalar()
+
+    def job(self):
+        """ Returns the id of the last job """
+        return db.engine.execute(select([func.max(Job.__table__.c.id)])).scalar()
+
+    def export_job(self):
+        """ Returns the id of an export job of a customer, submitted on first use """
+        if self.export_job_id is None:
+            self.export_job_id = Job.create('export', {'filter': {'customer_id': 1}}).id
+            db.session.remove()
+            runner.submit(self.export_job_id)
+        return self.export_job_id
+
+
+def new_item(rand):
+    """ Returns the JSON body of an item """
+    product_id = rand.randint(1, 1000)
+    return {'product_id': product_id, 'name': 'product %d' % product_id,
+            'quantity': rand.randint(1, 5), 'price': product_id / 10.0}
+
+def new_order(targets):
+    """ Returns the JSON body of an order with a few items """
+    return {'customer_id': targets.customer(), 'date': '2018-04-23T11:11',
+            'status': 'processing',
+            'items': [new_item(targets.rand) for _ in range(targets.rand.randint(1, 5))]}
+
+def item_path(order_id, targets):
+    """ Returns the path of the first item of an order """
+    return '/orders/{}/items/{}'.format(order_id, targets.item(order_id))
+
+# (method, rule, name, request builder, expected status codes)
+# a builder returns the path and the JSON body of the next request
+ROUTES = [
+    ('GET', '/', 'GET /', lambda t: ('/', None), (200,)),
+    ('GET', '/orders/<int:order_id>', 'GET /orders/{id}',
+     lambda t: ('/orders/{}'.format(t.read()), None), (200,)),
+    ('GET', '/orders/<int:order_id>/items', 'GET /orders/{id}/items',
+     lambda t: ('/orders/{}/items'.format(t.read()), None), (200,)),
+    ('GET', '/orders/<int:order_id>/total', 'GET /orders/{id}/total',
+     lambda t: ('/orders/{}/total'.format(t.read()), None), (200,)),
+    ('GET', '/items/<int:item_id>', 'GET /items/{id}',
+     lambda t: ('/items/{}'.format(t.item(t.read())), None), (200,)),
+    ('GET', '/items', 'GET /items?order_id',
+     lambda t: ('/items?order_id={}'.format(t.read()), None), (200,)),
+    ('GET', '/orders', 'GET /orders?customer_id',
+     lambda t: ('/orders?customer_id={}&limit=20'.format(t.customer()), None), (200,)),
+    ('GET', '/orders', 'GET /orders?status&limit=100',
+     lambda t: ('/orders?status=shipped&limit=100', None), (200,)),
+    ('GET', '/orders', 'GET /orders?customer_id&stream',
+     lambda t: ('/orders?customer_id={}&stream=true'.format(t.customer()), None), (200,)),
+    ('GET', '/orders/export', 'GET /orders/export?customer_id',
+     lambda t: ('/orders/export?customer_id={}'.format(t.customer()), None), (200,)),
+    ('GET', '/orders/totals', 'GET /orders/totals?limit=100',
+     lambda t: ('/orders/totals?limit=100', None), (200,)),
+    ('GET', '/reports/revenue', 'GET /reports/revenue?group_by=status',
+     lambda t: ('/reports/revenue?group_by=status', None), (200,)),
+    ('POST', '/orders', 'POST /orders',
+     lambda t: ('/orders', new_order(t)), (201,)),
+    ('PUT', '/orders/<int:order_id>', 'PUT /orders/{id}',
+     lambda t: ('/orders/{}'.format(t.write()),
+                {'customer_id': t.customer(), 'date': '2018-04-23T11:11',
+                 'status': 'processing'}), (200,)),
+    ('PUT', '/orders/<int:order_id>/items/<int:item_id>', 'PUT /orders/{id}/items/{id}',
+     lambda t: (item_path(t.write(), t), new_item(t.rand)), (200,)),
+    ('PATCH', '/orders/<int:order_id>/items', 'PATCH /orders/{id}/items',
+     lambda t: ('/orders/{}/items'.format(t.write()),
+                [dict(new_item(t.rand), op='add') for _ in range(5)]), (200,)),
+    ('PUT', '/orders/<int:order_id>/cancel', 'PUT /orders/{id}/cancel',
+     lambda t: ('/orders/{}/cancel'.format(t.write()), None), (200,)),
+    ('PUT', '/orders/status', 'PUT /orders/status',
+     lambda t: ('/orders/status', {'status': 'shipped', 'ids': [t.write()]}), (200,)),
+    ('DELETE', '/orders/<int:order_id>/items/<int:item_id>', 'DELETE /orders/{id}/items/{id}',
+     lambda t: (item_path(t.write(), t), None), (204,)),
+    ('DELETE', '/orders/<int:order_id>', 'DELETE /orders/{id}',
+     lambda t: ('/orders/{}'.format(t.write()), None), (204,)),
+    ('DELETE', '/orders', 'DELETE /orders?ids',
+     lambda t: ('/orders?ids={},{}'.format(t.write(), t.write()), None), (200,)),
+    ('POST', '/jobs', 'POST /jobs',
+     lambda t: ('/jobs', {'kind': 'status',
+                          'params': {'status': 'shipped', 'ids': [t.write()]}}), (202,)),
+    ('GET', '/jobs/<int:job_id>', 'GET /jobs/{id}',
+     lambda t: ('/jobs/{}'.format(t.job()), None), (200,)),
+    # 409 until the export job has run
+    ('GET', '/jobs/<int:job_id>/file', 'GET /jobs/{id}/file',
+     lambda t: ('/jobs/{}/file'.format(t.export_job()), None), (200, 404, 409)),
+    ('PUT', '/jobs/<int:job_id>/cancel', 'PUT /jobs/{id}/cancel',
+     lambda t: ('/jobs/{}/cancel'.format(t.job()), None), (200, 409)),
+    ('GET', '/cache/stats', 'GET /cache/stats', lambda t: ('/cache/stats', None), (200,)),
+    ('GET', '/metrics', 'GET /metrics', lambda t: ('/metrics', None), (200,)),
+]
+
+
+def uncovered_routes():
+    """ Returns the routes of app/server.py that no entry of ROUTES requests """
+    covered = set('{} {}'.format(method, rule) for method, rule, _, _, _ in ROUTES)
+    routes = set()
+    for rule in app.url_map.iter_rules():
+        if app.view_functions[rule.endpoint].__module__ != 'app.server':
+            continue
+        for method in rule.methods - set(['HEAD', 'OPTIONS']):
+            routes.add('{} {}'.format(method, rule.rule))
+    return sorted(routes - covered - set(SKIPPED_ROUTES))
+
+
+######################################################################
+# CLIENTS
+######################################################################
+def test_client_sender():
+    """ Returns a function sending requests through the Flask test client """
+    client = app.test_client()
+
+    def send(method, path, body):
+        resp = client.open(path, method=method,
+                           data=json.dumps(body) if body is not None else None,
+                           content_type='application/json')
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+    return send
+
+def http_sender(port):
+    """ Returns a function sending requests to a WSGI server over HTTP """
+    def send(method, path, body):
+        conn = httplib.HTTPConnection('127.0.0.1', port)
+        conn.request(method, path, json.dumps(body) if body is not None else None,
+                     {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        return resp.status
+    return send
+
+
+######################################################################
+# MEASURES
+######################################################################
+def percentile(latencies, fraction):
+    """ Returns the nearest rank percentile of sorted latencies """
+    return latencies[max(int(math.ceil(fraction * len(latencies))) - 1, 0)]
+
+def reset_peak_rss():
+    """ Starts measuring the peak memory again, which Linux allows """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except IOError:
+        pass
+
+def peak_rss_mb():
+    """ Returns the largest resident memory since the last reset in MB """
+    try:
+        with open('/proc/self/status') as proc_status:
+            for line in proc_status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    # the peak of the whole run
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def measure(send, route, targets, serving_thread):
+    """ Sends REQUESTS requests to a route, after one to warm it up """
+    method, _, name, build, expected = route
+    latencies = []
+    queries = 0
+    errors = 0
+    reset_peak_rss()
+    for count in range(REQUESTS + 1):
+        path, body = build(targets)
+        before = QUERY_COUNTS[serving_thread]
+        start = time.time()
+        status_code = send(method, path, body)
+        elapsed = time.time() - start
+        if count == 0:
+            continue
+        latencies.append(elapsed * 1000)
+        queries += QUERY_COUNTS[serving_thread] - before
+        if status_code not in expected:
+            errors += 1
+    latencies.sort()
+    return {'route': name, 'requests': REQUESTS, 'errors': errors,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'throughput_rps': REQUESTS / (sum(latencies) / 1000),
+            'queries_per_request': queries / float(REQUESTS),
+            'peak_rss_mb': peak_rss_mb()}
+
+def run_mode(mode, orders, targets):
+    """ Measures every route in a mode, client or wsgi """
+    if mode == 'client':
+        send = test_client_sender()
+        results = [measure(send, route, targets, threading.current_thread().ident)
+                   for route in ROUTES]
+    elif mode == 'wsgi':
+        server = make_server('127.0.0.1', 0, app)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            send = http_sender(server.server_port)
+            results = [measure(send, route, targets, thread.ident) for route in ROUTES]
+        finally:
+            server.shutdown()
+            server.server_close()
+    else:
+        raise ValueError('BENCH_MODES must be client and/or wsgi, not {}'.format(mode))
+    for result in results:
+        result.update(orders=orders, mode=mode)
+    return results
+
+
+######################################################################
+# BASELINE
+######################################################################
+def result_key(result):
+    """ Returns what identifies a measure across runs """
+    return (result['orders'], result['mode'], result['route'])
+
+def compare(results, baseline, tolerance):
+    """ Returns a line for every measure worse than its baseline by more than tolerance """
+    previous = dict((result_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        base = previous.get(result_key(result))
+        if base is None:
+            continue
+        worse = []
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[field] > base[field] * (1 + tolerance) and \
+                    result[field] - base[field] > NOISE_MS:
+                worse.append(field)
+        # requests are sent one at a time, so the throughput is 1 / mean latency
+        if result['throughput_rps'] * (1 + tolerance) < base['throughput_rps'] and \
+                1000 / result['throughput_rps'] - 1000 / base['throughput_rps'] > NOISE_MS:
+            worse.append('throughput_rps')
+        # the statements of a request do not depend on the machine
+        if result['queries_per_request'] > base['queries_per_request'] + 0.5:
+            worse.append('queries_per_request')
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            worse.append('peak_rss_mb')
+        if result['errors'] > base['errors']:
+            worse.append('errors')
+        regressions.extend('{:>8} {:>6} {:<40} {} {:.2f} -> {:.2f}'.format(
+            result['orders'], result['mode'], result['route'], field,
+            base[field], result[field]) for field in worse)
+    return regressions
+
+def print_results(results):
+    """ Prints the measures as a table """
+    print('{:>8} {:>6} {:<40} {:>8} {:>8} {:>8} {:>9} {:>8} {:>8} {:>6}'.format(
+        'orders', 'mode', 'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/sec',
+        'queries', 'rss MB', 'errors'))
+    for result in results:
+        print('{orders:>8} {mode:>6} {route:<40} {p50_ms:>8.2f} {p95_ms:>8.2f} {p99_ms:>8.2f} '
+              '{throughput_rps:>9.1f} {queries_per_request:>8.1f} {peak_rss_mb:>8.1f} '
+              '{errors:>6}'.format(**result))
+
+
+######################################################################
+# MAIN
+######################################################################
+if __name__ == '__main__':
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    event.listen(Engine, 'before_cursor_execute', count_query)
+    for route_name in uncovered_routes():
+        print('Warning: {} is not benchmarked'.format(route_name))
+
+    all_results = []
+    for volume in VOLUMES:
+        db.drop_all()
+        db.create_all()
+        print('Seeding {} orders with {}-{} items each'.format(volume, *ITEMS))
+        seeded = seed_orders(volume, items=ITEMS)
+        print('Seeded {} items in {:.1f} seconds'.format(seeded['items'], seeded['seconds']))
+        cache.clear()
+        volume_targets = Targets(volume)
+        for run in MODES:
+            all_results.extend(run_mode(run, volume, volume_targets))
+    db.drop_all()
+
+    print_results(all_results)
+    with open(OUTPUT, 'w') as output:
+        json.dump({'created_at': datetime.utcnow().isoformat(),
+                   'database': db.engine.dialect.name,
+                   'python': platform.python_version(),
+                   'items': ITEMS,
+                   'results': all_results}, output, indent=2, sort_keys=True)
+    print('Results written to {}'.format(OUTPUT))
+
+    if BASELINE:
+        with open(BASELINE) as baseline_file:
+            found = compare(all_results, json.load(baseline_file), TOLERANCE)
+        if found:
+            print('\nRegressions against {}:'.format(BASELINE))
+            for line in found:
+                print(line)
+            sys.exit(1)
+        print('No regressions against {}'.format(BASELINE))
@@ -0,0 +1,114 @@
+"""
+Index Benchmark
+Shows the query plan and latency of the filters exposed by the list
+endpoints with and without the indexes declared on the models.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_indexes
+
+Enviroment Variables:
+---------------------
+    - DATABASE_URI: the database to benchmark against
+    - BENCH_ORDERS: number of orders to seed (default 20000)
+    - BENCH_ROUNDS: number of times each query runs (default 20)
+"""
+
+import os
+import time
+import random
+from datetime import datetime, timedelta
+from app import app, db
+from app.models import Order, Item
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+ORDERS = int(os.getenv('BENCH_ORDERS', '20000'))
+ROUNDS = int(os.getenv('BENCH_ROUNDS', '20'))
+ITEMS_PER_ORDER = 3
+STATUSES = ['processing', 'shipped', 'cancelled', 'delivered']
+
+QUERIES = [
+    ('customer_id', "SELECT * FROM orders WHERE customer_id = 42"),
+    ('customer_id, date', "SELECT * FROM orders WHERE customer_id = 42 "
+                          "AND date >= '2018-03-01'"),
+    ('status, date', "SELECT * FROM orders WHERE status = 'shipped' "
+                     "AND date >= '2018-03-30'"),
+    ('date', "SELECT * FROM orders WHERE date = '2018-02-01 00:00:00.000000'"),
+    ('order_id', "SELECT * FROM items WHERE order_id = 1234"),
+    ('product_id', "SELECT * FROM items WHERE product_id = 77"),
+    ('name', "SELECT * FROM items WHERE name = 'product 77'"),
+    ('price', "SELECT * FROM items WHERE price = 7.5"),
+]
+
+
+def seed():
+    """ Bulk inserts ORDERS orders with ITEMS_PER_ORDER items each """
+    rand = random.Random(0)
+    start = datetime(2018, 1, 1)
+    orders = [{'id': i, 'customer_id': rand.randint(1, ORDERS // 10 or 1),
+               'date': start + timedelta(minutes=rand.randint(0, 60 * 24 * 90)),
+               'status': rand.choice(STATUSES)} for i in range(1, ORDERS + 1)]
+    db.engine.execute(Order.__table__.insert(), orders)
+    items = []
+    for order_id in range(1, ORDERS + 1):
+        for _ in range(ITEMS_PER_ORDER):
+            product_id = rand.randint(1, 1000)
+            items.append({'order_id': order_id, 'product_id': product_id,
+                          'name': 'product %d' % product_id,
+                          'quantity': rand.randint(1, 5),
+                          'price': product_id / 10.0})
+    db.engine.execute(Item.__table__.insert(), items)
+
+def set_indexes(enabled):
+    """ Creates or drops every index declared on the models """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            # MySQL will not drop an index that backs a foreign key
+            if db.engine.dialect.name == 'mysql' and \
+                    any(column.foreign_keys for column in index.columns):
+                continue
+            if enabled:
+                index.create(db.engine)
+            else:
+                index.drop(db.engine)
+
+def explain(sql):
+    """ Returns the query plan of a statement as one line """
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.engine.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+        return '; '.join(str(row[-1]) for row in rows)
+    rows = db.engine.execute('EXPLAIN ' + sql).fetchall()
+    return '; '.join('{} type={} key={} rows={}'.format(
+        row['table'], row['type'], row['key'], row['rows']) for row in rows)
+
+def measure(sql):
+    """ Returns the average latency of a statement in milliseconds """
+    start = time.time()
+    for _ in range(ROUNDS):
+        db.engine.execute(sql).fetchall()
+    return (time.time() - start) / ROUNDS * 1000
+
+
+######################################################################
+# MAIN
+######################################################################
+if __name__ == '__main__':
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    db.drop_all()
+    db.create_all()
+    print('Seeding {} orders and {} items'.format(ORDERS, ORDERS * ITEMS_PER_ORDER))
+    seed()
+
+    results = {}
+    for enabled in (False, True):
+        set_indexes(enabled)
+        for label, sql in QUERIES:
+            results[(label, enabled)] = (explain(sql), measure(sql))
+
+    for label, sql in QUERIES:
+        plan, before = results[(label, False)]
+        indexed_plan, after = results[(label, True)]
+        print('\n{}: {}'.format(label, sql))
+        print('  without indexes {:>9.2f} ms  {}'.format(before, plan))
+        print('  with indexes    {:>9.2f} ms  {}'.format(after, indexed_plan))
+
+    db.drop_all()
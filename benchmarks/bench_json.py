@@ -0,0 +1,96 @@
+"""
+JSON Serialization Benchmark
+Compares the old list serialization, a dictionary per model instance
+encoded by a pretty-printing jsonify, with the RowEncoder that encodes
+the result tuples of the columns directly, for every installed JSON
+backend. Loading and encoding are timed separately.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.bench_json
+
+Enviroment Variables:
+---------------------
+    - DATABASE_URI: the database to benchmark against
+    - BENCH_ROWS: number of Items serialized (default 10000)
+    - BENCH_ROUNDS: number of times each path runs (default 5)
+"""
+
+import os
+import time
+from datetime import datetime
+from flask import jsonify
+from app import app, db, encoder
+from app.encoder import RowEncoder, get_dumps
+from app.models import Order, Item
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+ROWS = int(os.getenv('BENCH_ROWS', '10000'))
+ROUNDS = int(os.getenv('BENCH_ROUNDS', '5'))
+
+
+def load_items():
+    """ Saves ROWS Items on one Order with a bulk insert """
+    order = Order(customer_id=1, date=datetime.now(), status='processing')
+    order.save()
+    db.session.execute(Item.__table__.insert(), [
+        {'order_id': order.id, 'product_id': i, 'name': u'item \xe9 %d' % i,
+         'quantity': i % 7 + 1, 'price': i * 0.37} for i in range(ROWS)])
+    db.session.commit()
+
+def dict_path(pretty):
+    """ Returns the old path: instances, serialize() and jsonify """
+    def run():
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = pretty
+        rows = Item.query.order_by(Item.id).all()
+        start = time.time()
+        body = jsonify([row.serialize() for row in rows]).data
+        return start, body
+    return run
+
+def tuple_path(name):
+    """ Returns the new path: column tuples encoded by a RowEncoder """
+    row_encoder = RowEncoder(Item.__table__.columns, get_dumps(name))
+    def run():
+        rows = db.session.query(*row_encoder.columns).order_by(Item.id).all()
+        start = time.time()
+        body = row_encoder.encode_rows(rows)
+        return start, body
+    return run
+
+def measure(label, func):
+    """ Runs func ROUNDS times and prints its load and encode times and size """
+    load = encode = 0.0
+    size = 0
+    for _ in range(ROUNDS):
+        db.session.expunge_all()
+        begin = time.time()
+        start, body = func()
+        end = time.time()
+        load += start - begin
+        encode += end - start
+        size = len(body)
+    print('{:<20} {:>10.1f} {:>10.1f} {:>10.1f} {:>10}'.format(
+        label, load * 1000 / ROUNDS, encode * 1000 / ROUNDS,
+        (load + encode) * 1000 / ROUNDS, size))
+
+
+######################################################################
+# MAIN
+######################################################################
+if __name__ == '__main__':
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    db.drop_all()
+    db.create_all()
+    load_items()
+
+    print('{} rows, {} rounds'.format(ROWS, ROUNDS))
+    print('{:<20} {:>10} {:>10} {:>10} {:>10}'.format(
+        'path', 'load ms', 'encode ms', 'total ms', 'bytes'))
+    with app.test_request_context():
+        measure('dict pretty', dict_path(True))
+        measure('dict compact', dict_path(False))
+        for name in sorted(encoder.BACKENDS):
+            measure('tuple ' + name, tuple_path(name))
+
+    db.session.remove()
+    db.drop_all()
@@ -0,0 +1,106 @@
+"""
+Load Test
+Starts the production server with an increasing number of workers and
+reports the requests per second it serves to concurrent clients.
+
+Run it with:
+  DATABASE_URI=sqlite:////tmp/bench.db python -m benchmarks.load_test
+
+Enviroment Variables:
+---------------------
+    - DATABASE_URI: the database the server uses
+    - LOAD_WORKERS: comma separated worker counts to try (default 1,2,4)
+    - LOAD_CLIENTS: number of concurrent clients (default 16)
+    - LOAD_SECONDS: how long each run lasts (default 10)
+"""
+
+import os
+import sys
+import time
+import random
+import urllib2
+import threading
+import subprocess
+from datetime import datetime
+from app import app, db
+from app.models import Order, Item
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+WORKERS = [int(count) for count in os.getenv('LOAD_WORKERS', '1,2,4').split(',')]
+CLIENTS = int(os.getenv('LOAD_CLIENTS', '16'))
+SECONDS = int(os.getenv('LOAD_SECONDS', '10'))
+PORT = 5099
+ORDERS = 200
+
+
+def seed():
+    """ Creates ORDERS orders with a few items each """
+    db.drop_all()
+    db.create_all()
+    for order_id in range(ORDERS):
+        order = Order(customer_id=order_id % 20, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=i, name='item %d' % i, quantity=1, price=1.5)
+                               for i in range(3)])
+
+def start_server(workers):
+    """ Starts gunicorn and waits until it answers """
+    env = dict(os.environ, WEB_WORKERS=str(workers), PORT=str(PORT),
+               DATABASE_URI=DATABASE_URI)
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+         '-c', 'gunicorn_config.py',
+         '--access-logfile', '/dev/null', '--log-level', 'warning', 'wsgi:app'],
+        env=env, stdout=open(os.devnull, 'w'))
+    for _ in range(100):
+        try:
+            urllib2.urlopen('http://127.0.0.1:{}/orders/1'.format(PORT)).read()
+            return process
+        except Exception:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+def client(deadline, counts, errors):
+    """ Sends requests until the deadline """
+    rand = random.Random()
+    while time.time() < deadline:
+        if rand.random() < 0.7:
+            url = '/orders/{}'.format(rand.randint(1, ORDERS))
+        else:
+            url = '/orders?customer_id={}&limit=20'.format(rand.randint(0, 19))
+        try:
+            urllib2.urlopen('http://127.0.0.1:{}{}'.format(PORT, url)).read()
+            counts.append(1)
+        except Exception:
+            errors.append(1)
+
+def run(workers):
+    """ Returns the requests per second and errors served by workers processes """
+    process = start_server(workers)
+    try:
+        counts = []
+        errors = []
+        deadline = time.time() + SECONDS
+        threads = [threading.Thread(target=client, args=(deadline, counts, errors))
+                   for _ in range(CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(counts) / float(SECONDS), len(errors)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+######################################################################
+# MAIN
+######################################################################
+if __name__ == '__main__':
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    seed()
+    db.engine.dispose()
+    print('{:>8} {:>8} {:>10} {:>8}'.format('workers', 'clients', 'req/sec', 'errors'))
+    for count in WORKERS:
+        rate, failures = run(count)
+        print('{:>8} {:>8} {:>10.1f} {:>8}'.format(count, CLIENTS, rate, failures))
@@ -1,8 +1,96 @@
-import logging
-from app.vcap import get_database_uri
-
-SQLALCHEMY_DATABASE_URI = get_database_uri()
-SQLALCHEMY_TRACK_MODIFICATIONS = False
-
-SECRET_KEY = 'secret-for-dev-only'
-LOGGING_LEVEL = logging.INFO
\ No newline at end of file
+import os
+import logging
+from app.vcap import get_database_uri, get_redis_url, get_replica_uris
+
+SQLALCHEMY_DATABASE_URI = get_database_uri()
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Read replicas of the database, one bind each (replica0, replica1...).
+# The read endpoints use a replica less than REPLICA_MAX_LAG seconds
+# behind, measured at most every REPLICA_LAG_CHECK_SECONDS, and fall
+# back to the primary otherwise. A client that wrote reads from the
+# primary for the next READ_YOUR_WRITES_SECONDS
+SQLALCHEMY_BINDS = dict(('replica{}'.format(index), uri)
+                        for index, uri in enumerate(get_replica_uris()))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '10'))
+
+# Production web server concurrency, read by gunicorn_config.py
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '4'))
+
+# Background jobs: threads per worker process running them (0 runs a
+# job inside the request that creates it) and rows handled per batch.
+# A running job that records no progress for JOB_STALE_SECONDS lost its
+# worker and is failed when a worker starts.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '1000'))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '300'))
+
+# Connection pool of each worker process. A thread holds at most one
+# connection at a time so the pool matches the request and job
+# threads. Keep instances * WEB_WORKERS * (POOL_SIZE + MAX_OVERFLOW) under the
+# connection limit of the database plan.
+SQLALCHEMY_POOL_SIZE = int(os.getenv('SQLALCHEMY_POOL_SIZE', str(WEB_THREADS + JOB_WORKERS)))
+SQLALCHEMY_MAX_OVERFLOW = int(os.getenv('SQLALCHEMY_MAX_OVERFLOW', '1'))
+SQLALCHEMY_POOL_TIMEOUT = int(os.getenv('SQLALCHEMY_POOL_TIMEOUT', '10'))
+SQLALCHEMY_POOL_RECYCLE = int(os.getenv('SQLALCHEMY_POOL_RECYCLE', '599'))
+
+SECRET_KEY = 'secret-for-dev-only'
+LOGGING_LEVEL = logging.INFO
+
+# Largest page a list endpoint returns and rows fetched per streamed batch
+PAGE_LIMIT_MAX = 1000
+STREAM_BATCH_SIZE = 500
+
+# Orders removed per transaction by the bulk delete endpoint
+BULK_DELETE_BATCH_SIZE = 1000
+# Order ids changed per UPDATE statement by the bulk status endpoint
+BULK_STATUS_BATCH_SIZE = 1000
+
+# Read-through cache for single Orders and Items: auto, memory, redis or
+# none. A write only evicts the entry from the memory cache of its own
+# process, so other processes serve the old row and ETag for up to
+# CACHE_TTL seconds. auto uses redis when a server is bound (see
+# app/vcap.py), memory when one process serves every request, and no
+# cache on Cloud Foundry or with several workers.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'auto')
+CACHE_TTL = int(os.getenv('CACHE_TTL', '60'))
+CACHE_MAX_SIZE = 4096
+CACHE_REDIS_URL = get_redis_url()
+
+# Database instrumentation. DB_STATS_HEADERS adds X-DB-Query-Count and
+# X-DB-Time-Ms to every response, statements slower than SLOW_QUERY_MS
+# are logged with their route, and a request that runs the same
+# statement more than QUERY_REPEAT_LIMIT times is reported as an N+1
+# query (an assertion error in testing, 0 turns the check off). Tests
+# run with TESTING_QUERY_REPEAT_LIMIT when the check is off.
+DB_STATS_HEADERS = os.getenv('DB_STATS_HEADERS', 'false').lower() == 'true'
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+QUERY_REPEAT_LIMIT = int(os.getenv('QUERY_REPEAT_LIMIT', '0'))
+TESTING_QUERY_REPEAT_LIMIT = 3
+
+# JSON responses. List and single row responses are encoded straight
+# from result tuples with JSON_ENCODER: ujson, simplejson, json or auto
+# for the fastest one installed. jsonify never pretty-prints outside of
+# debug mode.
+JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
+JSONIFY_PRETTYPRINT_REGULAR = False
+
+# Idempotency-Key of POST /orders: seconds a stored response is
+# replayed and seconds a repeated request waits for the first one. A
+# running request holds its key for IDEMPOTENCY_LOCK_SECONDS, longer
+# than WEB_TIMEOUT, after which a retry takes over the key of a request
+# whose worker was killed
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '10'))
+
+# Response compression with gzip, or brotli when it is installed.
+# Bodies under COMPRESS_MIN_SIZE bytes are sent uncompressed and the
+# levels trade CPU for size (gzip 1-9, brotli 0-11)
+COMPRESS_RESPONSES = os.getenv('COMPRESS_RESPONSES', 'true').lower() == 'true'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
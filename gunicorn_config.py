@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for the Order service
+Starts WEB_WORKERS pre-forked worker processes with WEB_THREADS
+threads each. The connection pool of every worker is sized from the
+same settings in config.py.
+
+The workers share their Prometheus metrics through files in the
+prometheus_multiproc_dir directory, a new temporary directory unless
+the environment names one.
+"""
+
+import os
+import tempfile
+
+# must be set before the app imports prometheus_client
+if 'prometheus_multiproc_dir' not in os.environ:
+    os.environ['prometheus_multiproc_dir'] = tempfile.mkdtemp(prefix='orders-metrics-')
+
+from app import app as service
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', '5000'))
+workers = service.config['WEB_WORKERS']
+threads = service.config['WEB_THREADS']
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+accesslog = '-'
+
+
+def on_starting(arbiter):
+    """ Creates the tables and compresses the static assets before the workers fork """
+    from wsgi import server
+    from app import db
+    server.init_db()
+    # workers must open their own connections
+    db.engine.dispose()
+    # metrics left by the workers of an earlier run would be added up again
+    metrics_dir = os.environ['prometheus_multiproc_dir']
+    for name in os.listdir(metrics_dir):
+        if name.endswith('.db'):
+            os.remove(os.path.join(metrics_dir, name))
+    # static assets are served from their compressed copies
+    from app.compression import compress_static
+    compress_static()
+
+def post_worker_init(worker):
+    """ Fails the jobs of stopped workers and resubmits the pending jobs """
+    from app import jobs
+    with service.app_context():
+        jobs.recover_jobs()
+
+def child_exit(server, worker):
+    """ Stops counting the live gauges of a worker that exited """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -4,7 +4,7 @@ Starts the Order service and initializes logging
 """
 
 import os
-from app import app, server
+from app import app, server, jobs
 
 # Pull options from environment
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
@@ -20,4 +20,5 @@ if __name__ == "__main__":
     print "========================================="
     server.initialize_logging()
     server.init_db()  # make our sqlalchemy tables
+    jobs.recover_jobs()  # resume the jobs left by the last run
     app.run(host='0.0.0.0', port=int(PORT), debug=DEBUG)
\ No newline at end of file
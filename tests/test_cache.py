@@ -0,0 +1,162 @@
+"""
+Test cases for the Cache
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import sys
+import json
+import unittest
+from mock import patch
+from app.cache import Cache, LRUBackend, RedisBackend, create_cache
+from app.vcap import get_redis_url
+
+
+class FakeRedis(object):
+    """ Local stand-in for the parts of a Redis client the cache uses """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match, count):
+        prefix = match.rstrip('*')
+        return iter([key for key in self.data if key.startswith(prefix)])
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCache(unittest.TestCase):
+    """ Test Cases for the Cache """
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        """ A clock the tests can move forward """
+        return self.now
+
+    def test_lru_get_and_set(self):
+        """ Store and read back a value """
+        backend = LRUBackend(max_size=2, ttl=10, clock=self.clock)
+        backend.set('orders:1', {'id': 1})
+        self.assertEqual(backend.get('orders:1'), {'id': 1})
+        self.assertEqual(backend.get('orders:2'), None)
+
+    def test_lru_evicts_least_recently_used(self):
+        """ The least recently used entry is evicted first """
+        backend = LRUBackend(max_size=2, ttl=10, clock=self.clock)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(backend.get('a'), 1)
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_lru_entries_expire(self):
+        """ Entries older than the ttl are not returned """
+        backend = LRUBackend(max_size=2, ttl=10, clock=self.clock)
+        backend.set('a', 1)
+        self.now += 11
+        self.assertEqual(backend.get('a'), None)
+        self.assertEqual(len(backend), 0)
+
+    def test_redis_backend(self):
+        """ Values round trip through a Redis client """
+        client = FakeRedis()
+        backend = RedisBackend(client, ttl=30)
+        backend.set('orders:1', {'id': 1, 'status': 'shipped'})
+        self.assertEqual(client.ttls['orders-cache:orders:1'], 30)
+        self.assertEqual(backend.get('orders:1'), {'id': 1, 'status': 'shipped'})
+        backend.delete('orders:1')
+        self.assertEqual(backend.get('orders:1'), None)
+        backend.set('orders:2', 2)
+        client.setex('other:1', 30, 'kept')
+        backend.clear()
+        self.assertEqual(client.data.keys(), ['other:1'])
+
+    def test_redis_clear_in_batches(self):
+        """ Clearing a large Redis cache deletes its keys batch by batch """
+        client = FakeRedis()
+        backend = RedisBackend(client)
+        for key in range(25):
+            backend.set('orders:{}'.format(key), key)
+        with patch.object(sys.modules['app.cache'], 'CLEAR_BATCH', 10), \
+                patch.object(client, 'delete', wraps=client.delete) as delete:
+            backend.clear()
+        self.assertEqual([len(call[0]) for call in delete.call_args_list], [10, 10, 5])
+        self.assertEqual(client.data, {})
+
+    def test_hit_and_miss_counters(self):
+        """ The cache counts hits and misses """
+        cache = Cache(LRUBackend(clock=self.clock))
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a'), None)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['backend'], 'LRUBackend')
+
+    def test_disabled_cache(self):
+        """ A cache without a backend never hits """
+        cache = create_cache({'CACHE_BACKEND': 'none'})
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_auto_backend(self):
+        """ The default cache is shared, or in-process only for a single process """
+        with patch.dict(os.environ, clear=True):
+            self.assertEqual(create_cache({'WEB_WORKERS': 1}).stats()['backend'],
+                             'LRUBackend')
+            self.assertEqual(create_cache({'WEB_WORKERS': 4}).stats()['backend'], None)
+            with patch.object(sys.modules['app.cache'], 'redis') as redis:
+                cache = create_cache({'WEB_WORKERS': 4, 'CACHE_REDIS_URL': 'redis://cache:6379/0'})
+            redis.StrictRedis.from_url.assert_called_with('redis://cache:6379/0')
+            self.assertEqual(cache.stats()['backend'], 'RedisBackend')
+        with patch.dict(os.environ, VCAP_APPLICATION='{}'):
+            self.assertEqual(create_cache({'WEB_WORKERS': 1}).stats()['backend'], None)
+
+    def test_memory_cache_of_many_processes_warns(self):
+        """ An explicit memory cache with several workers logs its staleness """
+        with patch.object(Cache.logger, 'warning') as warning:
+            cache = create_cache({'CACHE_BACKEND': 'memory', 'WEB_WORKERS': 4})
+        self.assertEqual(cache.stats()['backend'], 'LRUBackend')
+        self.assertTrue(warning.called)
+
+    def test_redis_url_from_vcap(self):
+        """ A bound rediscloud service provides the Redis connection String """
+        services = {'rediscloud': [{'credentials': {'hostname': 'redis.example.com',
+                                                    'port': '6380', 'password': 'secret'}}]}
+        with patch.dict(os.environ, {'VCAP_SERVICES': json.dumps(services)}, clear=True):
+            self.assertEqual(get_redis_url(), 'redis://:secret@redis.example.com:6380/0')
+        with patch.dict(os.environ, {'CACHE_REDIS_URL': 'redis://local:6379/1'}, clear=True):
+            self.assertEqual(get_redis_url(), 'redis://local:6379/1')
+        with patch.dict(os.environ, clear=True):
+            self.assertEqual(get_redis_url(), None)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
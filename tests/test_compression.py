@@ -0,0 +1,149 @@
+"""
+Test cases for the Response Compression
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import zlib
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from app import server, db, compression
+from app.compression import compress_static
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+def gunzip(data):
+    """ Decompresses a gzip body """
+    return zlib.decompress(data, zlib.MAX_WBITS | 16)
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCompression(unittest.TestCase):
+    """ Test Cases for the Response Compression """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=i, name='hammer', quantity=1, price=2.0)
+                               for i in range(50)])
+        self.app = server.app.test_client()
+        self.static_folder = server.app.static_folder
+
+    def tearDown(self):
+        server.app.static_folder = self.static_folder
+        db.session.remove()
+        db.drop_all()
+
+    def get(self, url, encoding=None, headers=None):
+        """ Gets a url accepting a content coding """
+        headers = dict(headers or {})
+        if encoding:
+            headers['Accept-Encoding'] = encoding
+        return self.app.get(url, headers=headers)
+
+    def test_gzip_list(self):
+        """ A large list is gzip compressed when the client accepts it """
+        plain = self.get('/items')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+        resp = self.get('/items', 'gzip')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+        self.assertTrue(len(resp.data) * 5 < len(plain.data))
+        self.assertEqual(gunzip(resp.data), plain.data)
+
+    def test_small_response(self):
+        """ Responses under the minimum size are not compressed """
+        resp = self.get('/items/1', 'gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(json.loads(resp.data)['id'], 1)
+
+    def test_level_and_switch(self):
+        """ The level is configurable and compression can be turned off """
+        config = server.app.config
+        level = config['COMPRESS_LEVEL']
+        config['COMPRESS_LEVEL'] = 1
+        self.assertEqual(self.get('/items', 'gzip').headers['Content-Encoding'], 'gzip')
+        config['COMPRESS_RESPONSES'] = False
+        try:
+            self.assertNotIn('Content-Encoding', self.get('/items', 'gzip').headers)
+        finally:
+            config['COMPRESS_LEVEL'] = level
+            config['COMPRESS_RESPONSES'] = True
+
+    def test_streamed_list(self):
+        """ A streamed list is compressed as it is produced """
+        plain = self.get('/items?stream=true')
+        resp = self.get('/items?stream=true', 'gzip;q=0.5, identity')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gunzip(resp.data), plain.data)
+
+    @unittest.skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """ brotli is used when the client accepts it as much as gzip """
+        plain = self.get('/items')
+        resp = self.get('/items', 'gzip, deflate, br')
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(resp.data), plain.data)
+        resp = self.get('/items', 'gzip, br;q=0.5')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_weak_etag(self):
+        """ A compressed response has a weak ETag that still matches """
+        resp = self.get('/items', 'gzip')
+        etag = resp.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        resp = self.get('/items', 'gzip', {'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_precompressed_static(self):
+        """ Static assets are served from their pre-compressed copies """
+        folder = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(folder, 'site.css'), 'w') as css:
+                css.write('body { color: black; }\n' * 100)
+            with open(os.path.join(folder, 'tiny.css'), 'w') as css:
+                css.write('p {}')
+            written = compress_static(folder)
+            self.assertIn(os.path.join(folder, 'site.css.gz'), written)
+            self.assertNotIn(os.path.join(folder, 'tiny.css.gz'), written)
+            self.assertEqual(compress_static(folder), [])
+
+            server.app.static_folder = folder
+            resp = self.get('/static/site.css', 'gzip')
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            with open(os.path.join(folder, 'site.css.gz'), 'rb') as gzipped:
+                self.assertEqual(resp.data, gzipped.read())
+            resp.close()
+            resp = self.get('/static/site.css')
+            self.assertNotIn('Content-Encoding', resp.headers)
+            resp.close()
+        finally:
+            shutil.rmtree(folder)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
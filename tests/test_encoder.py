@@ -0,0 +1,92 @@
+"""
+Test cases for the JSON Encoder
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime
+from app import server, db, encoder
+from app.encoder import RowEncoder, get_dumps, row_encoder
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestEncoder(unittest.TestCase):
+    """ Test Cases for the JSON Encoder """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        order = Order(customer_id=1, date=datetime(2018, 3, 1, 10, 5, 9), status='processing')
+        order.save_with_items([Item(product_id=1, name=u'caf\xe9 "1/2"', quantity=3, price=0.1),
+                               Item(product_id=2, name='nails', quantity=1, price=2.5)])
+        Order(customer_id=2, date=datetime(2017, 12, 31), status='shipped').save()
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def expected(self, model):
+        """ Returns the rows of a model as jsonify encodes them """
+        with server.app.test_request_context():
+            return json.loads(server.jsonify([row.serialize() for row in model.all()]).data)
+
+    def test_rows_match_jsonify(self):
+        """ Every backend encodes result tuples like jsonify encodes serialize() """
+        for name in encoder.BACKENDS:
+            for model in (Order, Item):
+                encoder_ = RowEncoder(model.__table__.columns, get_dumps(name))
+                rows = db.session.query(*encoder_.columns).order_by(model.id).all()
+                self.assertEqual(json.loads(encoder_.encode_rows(rows)), self.expected(model))
+
+    def test_keys_are_sorted(self):
+        """ Rows are encoded with sorted keys and no whitespace """
+        row = row_encoder(Order).values(Order.get(1))
+        self.assertEqual(row_encoder(Order).encode(row),
+                         '{"customer_id":1,"date":"Thu, 01 Mar 2018 10:05:09 GMT","id":1,'
+                         '"item_count":2,"order_total":2.8,"status":"processing","version":1}')
+
+    def test_nulls(self):
+        """ Missing values are encoded as null """
+        order = Order(customer_id=None, date=None, status=None)
+        data = json.loads(row_encoder(Order).encode(row_encoder(Order).values(order)))
+        self.assertEqual(set(data.values()), set([None]))
+
+    def test_unknown_backend(self):
+        """ Asking for a backend that is not installed fails """
+        self.assertRaises(ValueError, get_dumps, 'yaml')
+
+    def test_list_and_row_responses(self):
+        """ The list, page, stream and single row responses use the encoder """
+        expected = self.expected(Item)
+        for url in ('/items', '/items?limit=5', '/items?stream=true'):
+            resp = self.app.get(url)
+            self.assertEqual(resp.content_type, 'application/json')
+            self.assertEqual(json.loads(resp.data), expected)
+        resp = self.app.get('/items/1')
+        self.assertEqual(json.loads(resp.data), expected[0])
+        self.assertNotIn('\n', resp.data)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Test cases for the Idempotency Keys
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime, timedelta
+from mock import patch
+from flask_api import status    # HTTP Status Codes
+from app import server, db, idempotency
+from app.idempotency import IdempotencyKey
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+NEW_ORDER = {'customer_id': 1, 'date': '2018-04-23T11:11', 'status': 'processing',
+             'items': [{'product_id': 3, 'name': 'Rice', 'quantity': 1, 'price': 4.50}]}
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestIdempotency(unittest.TestCase):
+    """ Test Cases for the Idempotency Keys """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def post_order(self, key, data=None):
+        """ Posts an Order with an Idempotency-Key """
+        return self.app.post('/orders', data=json.dumps(data or NEW_ORDER),
+                             content_type='application/json',
+                             headers={'Idempotency-Key': key})
+
+    def test_retry_is_replayed(self):
+        """ A retried POST gets the first response and creates nothing """
+        first = self.post_order('checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        retry = self.post_order('checkout-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.headers['Location'], first.headers['Location'])
+        self.assertEqual(retry.content_type, 'application/json')
+        self.assertEqual(json.loads(retry.data), json.loads(first.data))
+        self.assertEqual(len(Order.all()), 1)
+        self.assertEqual(len(Item.all()), 1)
+
+        self.post_order('checkout-2')
+        self.assertEqual(len(Order.all()), 2)
+
+    def test_key_reused_for_another_order(self):
+        """ A key cannot be used for a different body """
+        self.post_order('checkout-1')
+        resp = self.post_order('checkout-1', dict(NEW_ORDER, customer_id=2))
+        self.assertEqual(resp.status_code, 422)
+        self.assertEqual(len(Order.all()), 1)
+
+    def test_failed_request_releases_the_key(self):
+        """ A request that fails can be retried with the same key """
+        resp = self.post_order('checkout-1', dict(NEW_ORDER, items=[{'name': 'Rice'}]))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(IdempotencyKey.query.get('checkout-1'), None)
+        resp = self.post_order('checkout-1', dict(NEW_ORDER, customer_id=2))
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_bad_key(self):
+        """ Keys longer than the column are rejected """
+        resp = self.post_order('k' * 300)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_key(self):
+        """ An expired key runs the request again """
+        self.post_order('checkout-1')
+        IdempotencyKey.query.update({IdempotencyKey.expires_at: datetime.utcnow()})
+        db.session.commit()
+        resp = self.post_order('checkout-1')
+        self.assertNotIn('Idempotent-Replayed', resp.headers)
+        self.assertEqual(len(Order.all()), 2)
+
+    def test_purge_expired_keys(self):
+        """ Expired keys are deleted when new keys are claimed """
+        self.post_order('checkout-1')
+        IdempotencyKey.query.update(
+            {IdempotencyKey.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        IdempotencyKey.last_purge = 0.0
+        self.post_order('checkout-2')
+        self.assertEqual([row.key for row in IdempotencyKey.query.all()], ['checkout-2'])
+
+    def test_waits_for_the_first_request(self):
+        """ A repeat of a running request waits for its response """
+        fingerprint = self.fingerprint()
+        self.assertTrue(IdempotencyKey.claim('checkout-1', fingerprint))
+
+        def first_request_finishes(seconds):
+            IdempotencyKey.complete('checkout-1', server.app.response_class(
+                '{"id": 7}', 201, {'Location': 'http://localhost/orders/7'},
+                mimetype='application/json'))
+
+        with patch.object(idempotency.time, 'sleep', side_effect=first_request_finishes) \
+                as sleep:
+            resp = self.post_order('checkout-1')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(resp.data), {'id': 7})
+        self.assertEqual(resp.headers['Location'], 'http://localhost/orders/7')
+        self.assertEqual(Order.all(), [])
+
+    def test_gives_up_waiting(self):
+        """ A repeat gets 409 when the first request runs for too long """
+        self.assertTrue(IdempotencyKey.claim('checkout-1', self.fingerprint()))
+        wait = server.app.config['IDEMPOTENCY_WAIT_SECONDS']
+        server.app.config['IDEMPOTENCY_WAIT_SECONDS'] = 0
+        try:
+            resp = self.post_order('checkout-1')
+        finally:
+            server.app.config['IDEMPOTENCY_WAIT_SECONDS'] = wait
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Order.all(), [])
+
+    def test_stale_claim_is_taken_over(self):
+        """ A retry takes over the key of a request that never finished """
+        self.assertTrue(IdempotencyKey.claim('checkout-1', 'killed worker'))
+        self.assertFalse(IdempotencyKey.claim('checkout-1', self.fingerprint()))
+        row = IdempotencyKey.query.get('checkout-1')
+        self.assertTrue(row.expires_at <= datetime.utcnow() + timedelta(
+            seconds=server.app.config['IDEMPOTENCY_LOCK_SECONDS']))
+        IdempotencyKey.query.update(
+            {IdempotencyKey.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+        with patch.object(idempotency.time, 'sleep') as sleep:
+            resp = self.post_order('checkout-1')
+        self.assertFalse(sleep.called)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(Order.all()), 1)
+        # the stored response is kept for the full TTL
+        row = IdempotencyKey.query.get('checkout-1')
+        self.assertEqual(row.status_code, 201)
+        self.assertTrue(row.expires_at > datetime.utcnow() + timedelta(
+            seconds=server.app.config['IDEMPOTENCY_LOCK_SECONDS']))
+        resp = self.post_order('checkout-1')
+        self.assertEqual(resp.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(Order.all()), 1)
+
+    def fingerprint(self):
+        """ Returns the fingerprint of posting NEW_ORDER """
+        with server.app.test_request_context('/orders', method='POST',
+                                             data=json.dumps(NEW_ORDER)):
+            return idempotency.request_fingerprint()
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Test cases for the Bulk Importer
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from StringIO import StringIO
+from datetime import datetime
+from mock import patch
+from sqlalchemy import event
+from app import app, db
+from app.models import Item, Order
+from app.importer import import_stream, read_csv
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+CSV_DATA = """order_ref,customer_id,date,status,product_id,name,quantity,price
+a,1,2018-03-01T10:00,processing,1,hammer,1,9.5
+a,1,2018-03-01T10:00,processing,2,nails,100,0.05
+b,2,2018-03-02T11:00,shipped,,,,
+c,3,2018-03-03T12:00,processing,3,saw,many,12.0
+c,3,2018-03-03T12:00,processing,4,glue,1,3.0
+d,4,2018-03-04T13:00,processing,5,tape,2,1.5
+"""
+
+
+def order_line(customer_id, items=None, **fields):
+    """ Returns one NDJSON line describing an order """
+    data = {'customer_id': customer_id, 'date': '2018-03-01T10:00',
+            'status': 'processing', 'items': items or []}
+    data.update(fields)
+    return json.dumps(data) + '\n'
+
+def item(product_id, name='widget'):
+    """ Returns an item dictionary """
+    return {'product_id': product_id, 'name': name, 'quantity': 1, 'price': 2.5}
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestImporter(unittest.TestCase):
+    """ Test Cases for the Bulk Importer """
+
+    @classmethod
+    def setUpClass(cls):
+        """ These run once per Test suite """
+        app.debug = False
+        app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        Order.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # make our sqlalchemy tables
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_import_ndjson(self):
+        """ Import orders with their items from NDJSON """
+        data = ''.join([order_line(1, [item(1), item(2)]),
+                        '\n',
+                        order_line(2, [item(3)]),
+                        order_line(3)])
+        summary = import_stream(StringIO(data), 'ndjson', batch_size=2)
+        self.assertEqual(summary['orders'], 3)
+        self.assertEqual(summary['items'], 3)
+        self.assertEqual(summary['rejected'], 0)
+        self.assertTrue(summary['rows_per_second'] >= 0)
+        orders = Order.query.order_by(Order.id).all()
+        self.assertEqual([order.customer_id for order in orders], [1, 2, 3])
+        self.assertEqual([i.product_id for i in orders[0].items], [1, 2])
+
+    def test_import_skips_bad_rows(self):
+        """ Bad JSON and invalid orders are reported and skipped """
+        data = ''.join([order_line(1, [item(1)]),
+                        '{not json\n',
+                        order_line(2, date='yesterday'),
+                        json.dumps({'customer_id': 3}) + '\n',
+                        order_line(4, [item(4)])])
+        summary = import_stream(StringIO(data), 'ndjson')
+        self.assertEqual(summary['orders'], 2)
+        self.assertEqual(summary['items'], 2)
+        self.assertEqual(summary['rejected'], 3)
+        self.assertEqual([line for line, _ in summary['errors']], [2, 3, 4])
+        self.assertIn('missing', summary['errors'][2][1])
+
+    def test_import_isolates_database_errors(self):
+        """ A row the database refuses does not lose the rest of its batch """
+        data = ''.join([order_line(1, [item(1)]),
+                        order_line(2, [item(2, name=None)]),
+                        order_line(3, [item(3)])])
+        summary = import_stream(StringIO(data), 'ndjson', batch_size=10)
+        self.assertEqual(summary['orders'], 2)
+        self.assertEqual(summary['items'], 2)
+        self.assertEqual([line for line, _ in summary['errors']], [2])
+        self.assertEqual(sorted(order.customer_id for order in Order.all()), [1, 3])
+        self.assertEqual(len(Item.all()), 2)
+
+    def test_one_orders_insert_per_batch(self):
+        """ A batch inserts its Orders with one statement and its Items in chunks """
+        Order(customer_id=9, date=datetime.now(), status='processing').save()
+        data = ''.join(order_line(customer_id, [item(i) for i in range(100)])
+                       for customer_id in range(4))
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split('(')[0].strip())
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            summary = import_stream(StringIO(data), 'ndjson', batch_size=2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(summary['orders'], 4)
+        self.assertEqual(statements.count('INSERT INTO orders'), 2)
+        # 200 Items per batch in INSERTs of 150 rows
+        self.assertEqual(statements.count('INSERT INTO items'), 4)
+        orders = Order.query.order_by(Order.id).all()
+        self.assertEqual([order.id for order in orders], [1, 2, 3, 4, 5])
+        self.assertEqual([len(order.items) for order in orders], [0, 100, 100, 100, 100])
+
+    def test_taken_ids_fall_back_to_generated_ids(self):
+        """ A batch whose reserved ids were taken is saved order by order """
+        Order(customer_id=9, date=datetime.now(), status='processing').save()
+        data = ''.join([order_line(1, [item(1)]), order_line(2, [item(2)])])
+        with patch('app.importer.next_id', return_value=1):
+            summary = import_stream(StringIO(data), 'ndjson')
+        self.assertEqual(summary['orders'], 2)
+        self.assertEqual(summary['rejected'], 0)
+        orders = Order.query.order_by(Order.id).all()
+        self.assertEqual([order.customer_id for order in orders], [9, 1, 2])
+        self.assertEqual([len(order.items) for order in orders], [0, 1, 1])
+
+    def test_read_csv_groups_rows(self):
+        """ Consecutive CSV rows of an order_ref make one order """
+        records = list(read_csv(StringIO(CSV_DATA)))
+        orders = [data for _, data, _ in records if data]
+        self.assertEqual(len(orders[0]['items']), 2)
+        self.assertEqual(orders[0]['items'][1]['price'], 0.05)
+        self.assertEqual(orders[1]['items'], [])
+        errors = [(line, error) for line, _, error in records if error]
+        self.assertEqual(errors, [(5, 'Invalid item on line 5')])
+
+    def test_import_csv(self):
+        """ Import orders from CSV """
+        summary = import_stream(StringIO(CSV_DATA), 'csv')
+        self.assertEqual(summary['orders'], 3)
+        self.assertEqual(summary['items'], 3)
+        self.assertEqual(summary['rejected'], 1)
+        self.assertEqual(sorted(order.customer_id for order in Order.all()), [1, 2, 4])
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Test cases for the Database Instrumentation
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime
+from mock import patch
+from app import server, db, instrumentation
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestInstrumentation(unittest.TestCase):
+    """ Test Cases for the Database Instrumentation """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        self.config = dict(server.app.config)
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        for customer_id in range(3):
+            order = Order(customer_id=customer_id, date=datetime.now(), status='processing')
+            order.save_with_items([Item(product_id=1, name='hammer', quantity=1, price=11.5)])
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        server.app.config.update(self.config)
+        server.app.testing = False
+        db.session.remove()
+        db.drop_all()
+
+    def test_query_headers(self):
+        """ Responses carry the statement count and database time when enabled """
+        resp = self.app.get('/orders')
+        self.assertNotIn('X-DB-Query-Count', resp.headers)
+        server.app.config['DB_STATS_HEADERS'] = True
+        resp = self.app.get('/orders?expand=items')
+        self.assertEqual(resp.headers['X-DB-Query-Count'], '2')
+        self.assertTrue(float(resp.headers['X-DB-Time-Ms']) >= 0)
+
+    def test_slow_query_log(self):
+        """ Statements slower than the threshold are logged with their route """
+        server.app.config['SLOW_QUERY_MS'] = 0
+        with patch.object(instrumentation.slow_query_logger, 'warning') as warning:
+            self.app.get('/orders')
+        self.assertTrue(warning.called)
+        self.assertEqual(warning.call_args[0][2], 'GET /orders')
+        self.assertIn('FROM orders', warning.call_args[0][3])
+
+    def test_repeated_statements_fail_in_testing(self):
+        """ A route that runs the same statement too often fails in testing """
+        server.app.testing = True
+        server.app.config['QUERY_REPEAT_LIMIT'] = 2
+        server.app.config['BULK_DELETE_BATCH_SIZE'] = 1
+        with self.assertRaises(AssertionError) as context:
+            self.app.delete('/orders?ids=1,2,3')
+        self.assertIn('Possible N+1 queries in DELETE /orders', str(context.exception))
+
+    def test_bulk_status_batch_size(self):
+        """ The bulk status route runs one UPDATE per BULK_STATUS_BATCH_SIZE ids """
+        server.app.testing = True
+        server.app.config['QUERY_REPEAT_LIMIT'] = 2
+        server.app.config['BULK_STATUS_BATCH_SIZE'] = 1
+        body = json.dumps({'status': 'cancelled', 'ids': [1, 2, 3]})
+        with self.assertRaises(AssertionError) as context:
+            self.app.put('/orders/status', data=body, content_type='application/json')
+        self.assertIn('Possible N+1 queries in PUT /orders/status', str(context.exception))
+        server.app.config['BULK_STATUS_BATCH_SIZE'] = 3
+        resp = self.app.put('/orders/status', data=body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_bulk_routes_do_not_repeat_statements(self):
+        """ Creating an Order with many Items runs each statement once """
+        server.app.testing = True
+        server.app.config['QUERY_REPEAT_LIMIT'] = 1
+        items = [{'product_id': i, 'name': 'item', 'quantity': 1, 'price': 1.0}
+                 for i in range(10)]
+        body = {'customer_id': 9, 'date': '2018-03-01T10:00', 'status': 'processing',
+                'items': items}
+        resp = self.app.post('/orders', data=json.dumps(body),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, 201)
+        resp = self.app.delete('/orders/1')
+        self.assertEqual(resp.status_code, 204)
+
+    def test_repeated_statements_warn(self):
+        """ Outside of testing repeated statements are logged """
+        server.app.config['QUERY_REPEAT_LIMIT'] = 2
+        server.app.config['BULK_DELETE_BATCH_SIZE'] = 1
+        with patch.object(instrumentation.logger, 'warning') as warning:
+            resp = self.app.delete('/orders?ids=1,2,3')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(warning.called)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
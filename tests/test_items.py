@@ -172,6 +172,23 @@ class TestItems(unittest.TestCase):
         self.assertEqual(items[1].quantity, 2)
         self.assertEqual(items[1].price, 11.00)
 
+    def test_find_by_filters(self):
+        """ Find Items matching several filters """
+        item = Item(order_id=1, product_id=1, name="wrench", quantity=1, price=10.50)
+        item.save()
+        item2 = Item(order_id=1, product_id=2, name="hammer", quantity=2, price=11)
+        item2.save()
+        item3 = Item(order_id=2, product_id=2, name="hammer", quantity=1, price=11)
+        item3.save()
+        items = Item.find_by_filters({'order_id': '1', 'product_id': '2'}).all()
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].quantity, 2)
+        items = Item.find_by_filters({'quantity': '1', 'price_min': '11'}).all()
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].order_id, 2)
+        self.assertEqual(len(Item.find_by_filters({}).all()), 3)
+        self.assertRaises(DataValidationError, Item.find_by_filters, {'price_max': 'high'})
+
     def test_find_by_name(self):
         """ Find Items by name"""
         item = Item(order_id=1, product_id=1, name="wrench", quantity=1, price=10.50)
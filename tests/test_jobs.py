@@ -0,0 +1,251 @@
+"""
+Test cases for the Background Jobs
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime, timedelta
+from mock import patch
+from flask_api import status    # HTTP Status Codes
+from app import server, db, jobs
+from app.jobs import Job, JobFile, JobRunner, Progress, run_job
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestJobs(unittest.TestCase):
+    """ Test Cases for the Background Jobs """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        self.batch_size = server.app.config['JOB_BATCH_SIZE']
+        server.app.config['JOB_BATCH_SIZE'] = 2
+        self.workers = jobs.runner.workers
+        jobs.runner.workers = 0  # run the jobs inside the request
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        for customer_id in range(5):
+            order = Order(customer_id=customer_id % 2, date=datetime.now(), status='processing')
+            order.save_with_items([Item(product_id=1, name='hammer', quantity=1, price=2.0)])
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        server.app.config['JOB_BATCH_SIZE'] = self.batch_size
+        jobs.runner.workers = self.workers
+        db.session.remove()
+        db.drop_all()
+
+    def post_job(self, kind, params):
+        """ Posts a Job and returns the response """
+        return self.app.post('/jobs', data=json.dumps({'kind': kind, 'params': params}),
+                             content_type='application/json')
+
+    def test_purge_job(self):
+        """ Purge the Orders of a customer in the background """
+        resp = self.post_job('purge', {'filter': {'customer_id': 0}})
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        location = resp.headers['Location']
+        data = json.loads(self.app.get(location).data)
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['processed'], 3)
+        self.assertEqual(data['progress'], 1.0)
+        self.assertEqual(data['result'], {'deleted': 3})
+        self.assertTrue(data['rows_per_second'] >= 0)
+        self.assertEqual(sorted(o.customer_id for o in Order.all()), [1, 1])
+        self.assertEqual(len(Item.all()), 2)
+
+    def test_status_job(self):
+        """ Ship Orders selected by id in the background """
+        Order.transition_status('cancelled', [1])
+        resp = self.post_job('status', {'status': 'shipped', 'ids': [1, 2, 3]})
+        data = json.loads(resp.data)
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual(data['result'], {'updated': 2})
+        self.assertEqual([o.status for o in Order.query.order_by(Order.id)],
+                         ['cancelled', 'shipped', 'shipped', 'processing', 'processing'])
+
+    def test_rebuild_totals_job(self):
+        """ Rebuild the Order totals in the background """
+        db.session.execute(Order.__table__.update().values(order_total=0))
+        db.session.commit()
+        resp = self.post_job('rebuild_totals', {'all': True})
+        data = json.loads(resp.data)
+        self.assertEqual(data['result'], {'updated': 5})
+        self.assertEqual(Order.find_by_filters({'min_total': 2}).count(), 5)
+
+    def test_rebuild_selected_totals(self):
+        """ Rebuild the totals of the Orders selected by a filter """
+        db.session.execute(Order.__table__.update().values(order_total=0))
+        db.session.commit()
+        resp = self.post_job('rebuild_totals', {'filter': {'customer_id': 1}})
+        self.assertEqual(json.loads(resp.data)['result'], {'updated': 2})
+        self.assertEqual(Order.find_by_filters({'min_total': 2}).count(), 2)
+
+    def test_export_job(self):
+        """ Export the Orders of a customer to a file in the background """
+        resp = self.post_job('export', {'format': 'csv', 'filter': {'customer_id': 1}})
+        data = json.loads(resp.data)
+        self.assertEqual(data['status'], 'succeeded')
+        self.assertEqual(data['result']['exported'], 2)
+        self.assertEqual(data['processed'], 2)
+        resp = self.app.get('/jobs/{}/file'.format(data['id']))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        lines = resp.data.splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['order_id', 'customer_id'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['2', '4'])
+        self.assertEqual(data['result']['bytes'], len(resp.data))
+        self.assertEqual(JobFile.query.count(), data['result']['parts'])
+
+    def test_export_every_order(self):
+        """ An export without ids or a filter writes every Order with its Items """
+        data = json.loads(self.post_job('export', {}).data)
+        self.assertEqual(data['result']['exported'], 5)
+        # one part per JOB_BATCH_SIZE Orders
+        self.assertEqual(data['result']['parts'], 3)
+        resp = self.app.get('/jobs/{}/file'.format(data['id']))
+        orders = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([order['id'] for order in orders], [1, 2, 3, 4, 5])
+        self.assertEqual(orders[0]['items'][0]['name'], 'hammer')
+
+    def test_export_file_requests(self):
+        """ Only a succeeded export Job has a file """
+        resp = self.post_job('export', {'format': 'xml'})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        job = Job.create('purge', {'ids': [1]})
+        resp = self.app.get('/jobs/{}/file'.format(job.id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        job = Job.create('export', {})
+        resp = self.app.get('/jobs/{}/file'.format(job.id))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_recover_jobs(self):
+        """ Pending Jobs run again and running Jobs without a heartbeat fail """
+        pending = Job.create('purge', {'ids': [1]})
+        stale = Job.create('export', {})
+        alive = Job.create('purge', {'ids': [3]})
+        now = datetime.utcnow()
+        for job, heartbeat in ((stale, now - timedelta(hours=1)), (alive, now)):
+            job.status = 'running'
+            job.started_at = job.heartbeat_at = heartbeat
+        JobFile.write(stale.id, 0, 'partial')
+        db.session.commit()
+        self.assertEqual(jobs.recover_jobs(), (1, 1))
+        self.assertEqual(JobFile.query.count(), 0)
+        self.assertEqual(Job.get(pending.id).status, 'succeeded')
+        self.assertEqual(Job.get(stale.id).status, 'failed')
+        self.assertIn('interrupted', Job.get(stale.id).error)
+        self.assertEqual(Job.get(alive.id).status, 'running')
+        self.assertEqual(sorted(o.id for o in Order.all()), [2, 3, 4, 5])
+
+    def test_cancelled_export_keeps_no_file(self):
+        """ The chunks written before an export was cancelled are deleted """
+        job = Job.create('export', {})
+        advance = Progress.advance
+
+        def cancel_after_second_batch(progress, count):
+            if progress.processed:
+                Job.get(job.id).cancel()
+            advance(progress, count)
+
+        server.app.config['JOB_BATCH_SIZE'] = 1
+        with patch.object(Progress, 'advance', cancel_after_second_batch):
+            run_job(job.id)
+        self.assertEqual(Job.get(job.id).status, 'cancelled')
+        self.assertEqual(JobFile.query.count(), 0)
+
+    def test_failed_job(self):
+        """ A Job whose handler raises fails with its error """
+        job = Job.create('purge', {'ids': [1]})
+        with patch.dict(jobs.HANDLERS, purge=lambda params, progress: 1 / 0):
+            run_job(job.id)
+        data = json.loads(self.app.get('/jobs/{}'.format(job.id)).data)
+        self.assertEqual(data['status'], 'failed')
+        self.assertIn('division', data['error'])
+        self.assertEqual(len(Order.all()), 5)
+
+    def test_bad_job_requests(self):
+        """ Unknown kinds and Jobs that do not exist """
+        resp = self.post_job('explode', {})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.post_job('purge', [1, 2])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.post_job('status', {'status': 'lost', 'ids': [1]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('status must be one of', json.loads(resp.data)['message'])
+        resp = self.app.get('/jobs/99')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.put('/jobs/99/cancel')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_jobs_need_a_selection(self):
+        """ A misspelled, blank or missing filter does not select every Order """
+        for kind, params in (('purge', {'filter': {'cusomer_id': 1}}),
+                             ('purge', {'filter': {'customer_id': ''}}),
+                             ('purge', {'filter': {}}),
+                             ('status', {'status': 'cancelled', 'filter': {'date_form': '2018'}}),
+                             ('rebuild_totals', {}),
+                             ('rebuild_totals', {'all': 'yes'})):
+            resp = self.post_job(kind, params)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(Order.find_by_filters({'status': 'processing'}).count(), 5)
+
+    def test_cancel_pending_job(self):
+        """ A pending Job is cancelled before it runs """
+        job = Job.create('purge', {'ids': [1]})
+        resp = self.app.put('/jobs/{}/cancel'.format(job.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['status'], 'cancelled')
+        run_job(job.id)
+        self.assertEqual(len(Order.all()), 5)
+        resp = self.app.put('/jobs/{}/cancel'.format(job.id))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_cancel_running_job(self):
+        """ A running Job stops after the batch it is working on """
+        job = Job.create('purge', {'filter': {'status': 'processing'}})
+        advance = Progress.advance
+
+        def cancel_after_first_batch(progress, count):
+            Job.get(job.id).cancel()
+            advance(progress, count)
+
+        with patch.object(Progress, 'advance', cancel_after_first_batch):
+            run_job(job.id)
+        data = json.loads(self.app.get('/jobs/{}'.format(job.id)).data)
+        self.assertEqual(data['status'], 'cancelled')
+        self.assertEqual(data['processed'], 2)
+        self.assertEqual(len(Order.all()), 3)
+
+    def test_runner_uses_a_thread_pool(self):
+        """ Jobs submitted to a runner with workers run in its pool """
+        runner = JobRunner(1)
+        job = Job.create('rebuild_totals', {'all': True})
+        db.session.remove()
+        runner.submit(job.id).result(timeout=10)
+        runner.executor.shutdown()
+        self.assertEqual(Job.get(job.id).status, 'succeeded')
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
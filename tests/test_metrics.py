@@ -0,0 +1,91 @@
+"""
+Test cases for the Metrics
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime
+from prometheus_client import REGISTRY
+from app import server, db
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+def sample(name, **labels):
+    """ Returns the current value of a metric sample or 0 """
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMetrics(unittest.TestCase):
+    """ Test Cases for the Metrics """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=1, price=11.5)])
+        self.order_id = order.id
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_request_latency(self):
+        """ Requests are counted by route and status code """
+        labels = {'method': 'GET', 'route': '/orders/<int:order_id>', 'status': '200'}
+        before = sample('orders_http_request_duration_seconds_count', **labels)
+        self.app.get('/orders/{}'.format(self.order_id))
+        self.app.get('/orders/{}'.format(self.order_id))
+        after = sample('orders_http_request_duration_seconds_count', **labels)
+        self.assertEqual(after - before, 2)
+        missing = sample('orders_http_request_duration_seconds_count', method='GET',
+                         route='/orders/<int:order_id>', status='404')
+        self.app.get('/orders/0')
+        self.assertEqual(sample('orders_http_request_duration_seconds_count', method='GET',
+                                route='/orders/<int:order_id>', status='404') - missing, 1)
+
+    def test_queries_per_request(self):
+        """ The statements and database time of a request are recorded """
+        labels = {'method': 'GET', 'route': '/orders'}
+        count = sample('orders_http_request_db_queries_count', **labels)
+        total = sample('orders_http_request_db_queries_sum', **labels)
+        resp = self.app.get('/orders?expand=items')
+        self.assertEqual(len(json.loads(resp.data)), 1)
+        self.assertEqual(sample('orders_http_request_db_queries_count', **labels) - count, 1)
+        self.assertEqual(sample('orders_http_request_db_queries_sum', **labels) - total, 2)
+        self.assertTrue(sample('orders_http_request_db_seconds_sum', **labels) > 0)
+        self.assertTrue(sample('orders_http_request_serialization_seconds_sum', **labels) > 0)
+
+    def test_metrics_endpoint(self):
+        """ The metrics are served in the Prometheus text format """
+        self.app.get('/orders')
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('orders_http_request_duration_seconds_bucket{', resp.data)
+        self.assertIn('route="/orders"', resp.data)
+        self.assertIn('orders_db_pool_checked_out', resp.data)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
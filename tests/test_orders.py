@@ -8,7 +8,7 @@ Test cases can be run with:
 import os
 import unittest
 from app import app, db
-from app.models import Item, Order, DataValidationError
+from app.models import Item, Order, DataValidationError, StaleVersionError
 from datetime import datetime
 from werkzeug.exceptions import NotFound
 
@@ -87,6 +87,54 @@ class TestOrders(unittest.TestCase):
         order.delete()
         self.assertEqual(len(Order.all()), 0)
 
+    def test_delete_an_order_with_items(self):
+        """ Delete an Order and all of its Items """
+        date = datetime.now()
+        order = Order(customer_id=1, date=date, status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=1, price=11.50),
+                               Item(product_id=2, name='nails', quantity=9, price=0.05)])
+        self.assertEqual(len(order.items), 2)
+
+        order.delete()
+        self.assertEqual(Order.all(), [])
+        self.assertEqual(Item.all(), [])
+
+    def test_remove_orders_by_ids(self):
+        """ Delete many Orders in batches """
+        date = datetime.now()
+        for customer_id in range(5):
+            order = Order(customer_id=customer_id, date=date, status='cancelled')
+            order.save_with_items([Item(product_id=1, name='hammer', quantity=1, price=1)])
+        deleted = Order.remove_by_ids([1, 2, 3, 4, 42], batch_size=2)
+        self.assertEqual(deleted, 4)
+        self.assertEqual(len(Order.all()), 1)
+        self.assertEqual(len(Item.all()), 1)
+
+    def test_save_order_with_items(self):
+        """ Save an Order and its Items in one transaction """
+        date = datetime.now()
+        order = Order(customer_id=1, date=date, status='processing')
+        items = [Item(product_id=1, name='hammer', quantity=1, price=11.50),
+                 Item(product_id=2, name='nails', quantity=100, price=0.05)]
+        saved = order.save_with_items(items)
+
+        self.assertEqual(order.id, 1)
+        self.assertEqual(len(saved), 2)
+        self.assertEqual(saved[0].order_id, order.id)
+        self.assertEqual(saved[1].name, 'nails')
+        self.assertEqual(len(Item.find_by_order_id(order.id).all()), 2)
+
+    def test_save_order_with_bad_item_rolls_back(self):
+        """ A failing Item leaves no partial Order behind """
+        date = datetime.now()
+        order = Order(customer_id=1, date=date, status='processing')
+        items = [Item(product_id=1, name='hammer', quantity=1, price=11.50),
+                 Item(product_id=2, name=None, quantity=1, price=1.00)]
+
+        self.assertRaises(Exception, order.save_with_items, items)
+        self.assertEqual(Order.all(), [])
+        self.assertEqual(Item.all(), [])
+
     def test_serialize_an_order(self):
         """ Test serialization of an Order """
         date = datetime.now()
@@ -220,6 +268,102 @@ class TestOrders(unittest.TestCase):
 
         self.assertEqual(order.__repr__(), "<Order>")
 
+    def test_migrate_db(self):
+        """ Migrating adds missing indexes to an existing database """
+        index = [ix for ix in Order.__table__.indexes
+                 if ix.name == 'ix_orders_customer_id_date'][0]
+        index.drop(db.engine)
+
+        changes = Order.migrate_db()
+        self.assertEqual(len(changes), 1)
+        self.assertIn('ix_orders_customer_id_date', changes[0])
+        self.assertEqual(Order.migrate_db(), [])
+
+    def test_totals_follow_item_writes(self):
+        """ item_count and order_total follow every write to the Items """
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=2, price=10.0)])
+        self.assertEqual((order.item_count, order.order_total), (1, 20.0))
+
+        other = Order(customer_id=2, date=datetime.now(), status='processing')
+        other.save()
+        self.assertEqual((other.item_count, other.order_total), (0, 0))
+        item = Item(order_id=other.id, product_id=2, name='nails', quantity=10, price=0.5)
+        item.save()
+        self.assertEqual((other.item_count, other.order_total), (1, 5.0))
+
+        # moving an Item updates both Orders
+        item.order_id = order.id
+        item.save()
+        self.assertEqual((order.item_count, order.order_total), (2, 25.0))
+        self.assertEqual((other.item_count, other.order_total), (0, 0))
+
+        order.patch_items([{'op': 'update', 'id': item.id, 'product_id': 2,
+                            'name': 'nails', 'quantity': 20, 'price': 0.5}])
+        self.assertEqual((order.item_count, order.order_total), (2, 30.0))
+
+        item = Item.get(item.id)
+        item.delete()
+        self.assertEqual((order.item_count, order.order_total), (1, 20.0))
+
+    def test_writes_increment_the_version(self):
+        """ Every kind of write moves an Order and its Items to a new version """
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=2, price=10.0)])
+        item = Item.find_by_order_id(order.id).first()
+        self.assertEqual((order.version, item.version), (1, 1))
+        order.status = 'shipped'
+        order.save()
+        self.assertEqual(order.version, 2)
+        item.quantity = 3
+        item.save()  # also refreshes the totals of the Order
+        self.assertEqual((order.version, item.version), (3, 2))
+        order.patch_items([{'op': 'update', 'id': item.id, 'product_id': 1,
+                            'name': 'hammer', 'quantity': 4, 'price': 10.0}])
+        self.assertEqual((order.version, item.version), (4, 3))
+        Order.transition_status('returned', [order.id])
+        self.assertEqual(Order.get(order.id).version, 5)
+
+    def test_conditional_updates(self):
+        """ update_by_id only changes a row that still has an expected version """
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=2, price=10.0)])
+        item_id = Item.find_by_order_id(order.id).first().id
+        self.assertTrue(Order.update_by_id(order.id, {'status': 'shipped'}, [1]))
+        self.assertRaises(StaleVersionError, Order.update_by_id, order.id,
+                          {'status': 'cancelled'}, [1])
+        self.assertFalse(Order.update_by_id(order.id + 1, {'status': 'cancelled'}, [1]))
+        self.assertEqual(Order.get(order.id).status, 'shipped')
+
+        data = {'product_id': 1, 'name': 'hammer', 'quantity': 5, 'price': 10.0}
+        self.assertTrue(Item.update_by_id(order.id, item_id, data, [1, 2]))
+        self.assertEqual(Order.get(order.id).order_total, 50.0)
+        self.assertFalse(Item.update_by_id(order.id + 1, item_id, data))
+        self.assertRaises(StaleVersionError, Item.delete_by_id, order.id, item_id, [1])
+        self.assertTrue(Item.delete_by_id(order.id, item_id, [2]))
+        self.assertEqual(Order.get(order.id).item_count, 0)
+
+    def test_save_with_items_bad_price(self):
+        """ Items without a numeric price are rejected """
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        items = [Item(product_id=1, name='hammer', quantity=1, price='cheap')]
+        self.assertRaises(DataValidationError, order.save_with_items, items)
+        self.assertEqual(Order.all(), [])
+
+    def test_rebuild_totals(self):
+        """ Rebuild the totals of existing Orders """
+        order = Order(customer_id=1, date=datetime.now(), status='processing')
+        order.save_with_items([Item(product_id=1, name='hammer', quantity=3, price=2.0)])
+        empty = Order(customer_id=2, date=datetime.now(), status='processing')
+        empty.save()
+        db.session.execute(Order.__table__.update().values(item_count=9, order_total=99))
+        db.session.commit()
+
+        self.assertEqual(Order.rebuild_totals(batch_size=1), 2)
+        self.assertEqual((order.item_count, order.order_total), (1, 6.0))
+        self.assertEqual((empty.item_count, empty.order_total), (0, 0))
+        self.assertEqual([o.id for o in Order.find_by_filters({'min_total': '5'})], [order.id])
+
     def test_remove_all(self):
         """ Tests removing Orders from the database """
         date = datetime.now()
@@ -0,0 +1,124 @@
+"""
+Test cases for the Read Replica routing
+The replica is a second database that the tests fill on their own, so
+a response shows which database served it.
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime
+from mock import patch
+from app import server, db, cache, replicas
+from app.models import Item, Order
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+REPLICA_URI = os.getenv('REPLICA_URI', 'sqlite:////tmp/test_replica.db')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestReplicas(unittest.TestCase):
+    """ Test Cases for the Read Replica routing """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+        cls.binds = server.app.config['SQLALCHEMY_BINDS']
+        server.app.config['SQLALCHEMY_BINDS'] = {'replica0': REPLICA_URI}
+
+    @classmethod
+    def tearDownClass(cls):
+        server.app.config['SQLALCHEMY_BINDS'] = cls.binds
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+        self.replica = db.get_engine(server.app, bind='replica0')
+        db.Model.metadata.drop_all(bind=self.replica)
+        db.Model.metadata.create_all(bind=self.replica)
+        Order(customer_id=1, date=datetime.now(), status='processing').save()
+        # the replica holds a different Order with the same id
+        self.replica.execute(Order.__table__.insert(), id=1, customer_id=2,
+                             date=datetime.now(), status='shipped', item_count=1)
+        self.replica.execute(Item.__table__.insert(), id=1, order_id=1, product_id=1,
+                             name='hammer', quantity=1, price=2.0)
+        cache.clear()
+        replicas.replica_set.clear()
+        self.app = server.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.Model.metadata.drop_all(bind=self.replica)
+
+    def customers(self, url='/orders'):
+        """ Returns the customer ids of the Orders of a list """
+        return [order['customer_id'] for order in json.loads(self.app.get(url).data)]
+
+    def test_reads_go_to_the_replica(self):
+        """ The read endpoints query the replica """
+        self.assertEqual(self.customers(), [2])
+        self.assertEqual(self.customers('/orders?stream=true'), [2])
+        resp = self.app.get('/orders/1')
+        self.assertEqual(json.loads(resp.data)['customer_id'], 2)
+        resp = self.app.get('/reports/revenue?group_by=status')
+        self.assertEqual([row['status'] for row in json.loads(resp.data)], ['shipped'])
+
+    def test_replica_reads_are_not_cached(self):
+        """ A row read from the replica is not put in the cache """
+        self.app.get('/orders/1')
+        self.assertEqual(cache.get('orders:1'), None)
+
+    def test_writes_go_to_the_primary(self):
+        """ Writes change the primary and the client then reads its writes there """
+        resp = self.app.post('/orders', data=json.dumps({
+            'customer_id': 3, 'date': '2018-04-23T11:11', 'status': 'processing',
+            'items': [{'product_id': 1, 'name': 'nails', 'quantity': 1, 'price': 2.0}]}),
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertIn(replicas.PRIMARY_COOKIE, resp.headers['Set-Cookie'])
+        self.assertEqual(self.customers(), [1, 3])
+        self.assertEqual([item.name for item in Item.all()], ['nails'])
+        self.assertEqual(self.replica.execute('SELECT COUNT(*) FROM items').scalar(), 1)
+
+    def test_lagging_replica(self):
+        """ A replica too far behind is skipped until it catches up """
+        with patch.object(replicas, 'measure_lag', return_value=60.0) as measure:
+            self.assertEqual(self.customers(), [1])
+            self.assertEqual(self.customers(), [1])
+            self.assertEqual(measure.call_count, 1)
+        replicas.replica_set.clear()
+        self.assertEqual(self.customers(), [2])
+
+    def test_unavailable_replica(self):
+        """ A replica that cannot be reached is skipped """
+        with patch.object(replicas, 'measure_lag', return_value=None):
+            self.assertEqual(self.customers(), [1])
+
+    def test_mysql_lag(self):
+        """ The lag of a MySQL replica comes from its slave status """
+        engine = self.replica
+        with patch.object(engine.dialect, 'name', 'mysql'), \
+                patch.object(engine, 'execute') as execute:
+            execute.return_value.first.return_value = {'Seconds_Behind_Master': 7}
+            self.assertEqual(replicas.measure_lag(engine), 7.0)
+            execute.return_value.first.return_value = {'Seconds_Behind_Master': None}
+            self.assertEqual(replicas.measure_lag(engine), None)
+            execute.return_value.first.return_value = None
+            self.assertEqual(replicas.measure_lag(engine), 0.0)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
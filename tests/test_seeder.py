@@ -0,0 +1,117 @@
+"""
+Test cases for the Synthetic Data generator
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import os
+import random
+import unittest
+from datetime import datetime
+from collections import Counter
+from sqlalchemy import func
+from app import server, db
+from app.models import Item, Order
+from app.seeder import seed_orders, power_law, Distribution
+
+DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestSeeder(unittest.TestCase):
+    """ Test Cases for the Synthetic Data generator """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before all tests """
+        server.app.debug = False
+        server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+    def setUp(self):
+        server.init_db()
+        db.drop_all()    # clean up the last tests
+        db.create_all()  # create new tables
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def dataset(self):
+        """ Returns the generated rows without their generated item ids """
+        orders = db.session.query(Order.id, Order.customer_id, Order.date, Order.status,
+                                  Order.item_count, Order.order_total).order_by(Order.id).all()
+        items = db.session.query(Item.order_id, Item.product_id, Item.quantity, Item.price) \
+            .order_by(Item.id).all()
+        return orders, items
+
+    def reseed(self, **settings):
+        """ Returns the dataset of a seed in an empty database """
+        db.drop_all()
+        db.create_all()
+        seed_orders(300, **settings)
+        return self.dataset()
+
+    def test_same_seed_same_data(self):
+        """ A seed always generates the same rows """
+        first = self.reseed(seed=7)
+        self.assertEqual(len(first[0]), 300)
+        self.assertEqual(self.reseed(seed=7), first)
+        self.assertNotEqual(self.reseed(seed=8), first)
+
+    def test_totals_match_items(self):
+        """ The summary columns agree with the generated items """
+        summary = seed_orders(120, items=(2, 4))
+        self.assertEqual(summary['orders'], 120)
+        self.assertEqual(summary['items'], Item.query.count())
+        counts = dict(db.session.query(Item.order_id, func.count(Item.id))
+                      .group_by(Item.order_id).all())
+        totals = dict(db.session.query(Item.order_id, func.sum(Item.quantity * Item.price))
+                      .group_by(Item.order_id).all())
+        for order in Order.all():
+            self.assertTrue(2 <= order.item_count <= 4)
+            self.assertEqual(order.item_count, counts[order.id])
+            self.assertAlmostEqual(float(order.order_total), float(totals[order.id]),
+                                   places=2)
+
+    def test_appends_after_existing_orders(self):
+        """ Generated orders follow the ones already in the database """
+        Order(customer_id=1, date=datetime.now(), status='processing').save()
+        seed_orders(10, items=(0, 0))
+        self.assertEqual([order.id for order in Order.all()], range(1, 12))
+        self.assertEqual(Item.query.count(), 0)
+
+    def test_distributions(self):
+        """ Customers follow a power law, statuses and dates their settings """
+        seed_orders(2000, customers=100, statuses=[('processing', 1), ('shipped', 3)],
+                    date_from=datetime(2018, 6, 1), date_to=datetime(2018, 7, 1))
+        customers = Counter(customer_id for customer_id, in
+                            db.session.query(Order.customer_id).all())
+        self.assertEqual(customers.most_common(1)[0][0], 1)
+        self.assertTrue(customers[1] > 10 * customers.get(50, 1))
+        statuses = Counter(status for status, in db.session.query(Order.status).all())
+        self.assertEqual(set(statuses), set(['processing', 'shipped']))
+        self.assertTrue(2 < statuses['shipped'] / float(statuses['processing']) < 4)
+        first, last = db.session.query(func.min(Order.date), func.max(Order.date)).one()
+        self.assertTrue(datetime(2018, 6, 1) <= first <= last <= datetime(2018, 7, 1))
+
+    def test_uniform_power_law(self):
+        """ An exponent of 0 draws every value """
+        values = power_law(3, 6, 0).sample(random.Random(0), 400)
+        self.assertEqual(set(values), set([3, 4, 5, 6]))
+
+    def test_bad_settings(self):
+        """ Settings that describe no values are rejected """
+        self.assertRaises(ValueError, power_law, 5, 1, 1.0)
+        self.assertRaises(ValueError, Distribution, ['shipped'], [0])
+        self.assertRaises(ValueError, seed_orders, 10, date_from=datetime(2019, 1, 1),
+                          date_to=datetime(2018, 1, 1))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
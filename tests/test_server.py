@@ -8,12 +8,14 @@ Test cases can be run with the following:
 import os
 import unittest
 import json
+import zlib
 import logging
 from flask_api import status    # HTTP Status Codes
 from app import server, db
 from app.models import Item, Order, DataValidationError
 from datetime import datetime
 from mock import MagicMock, patch
+from sqlalchemy import event
 
 DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://root@localhost:3306/development')
 
@@ -38,6 +40,7 @@ class TestServer(unittest.TestCase):
     def setUpClass(cls):
         """ Run once before all tests """
         server.app.debug = False
+        server.app.testing = True    # fail on N+1 queries
         server.initialize_logging(logging.INFO)
         # Set up the test database
         server.app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
@@ -139,6 +142,241 @@ class TestServer(unittest.TestCase):
         data = json.loads(resp.data)
         self.assertEqual(len(data), 1)
 
+    def test_list_orders_with_combined_filters(self):
+        """ Get list of orders matching every filter """
+        Order(customer_id=1, date=datetime(2018, 1, 1), status='shipped').save()
+        resp = self.app.get('/orders?customer_id=1&status=shipped')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['status'], 'shipped')
+
+        resp = self.app.get('/orders?status=shipped,processing&customer_id=1')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+
+        resp = self.app.get('/orders?date_from=2017-12-31&date_to=2018-01-02')
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['status'], 'shipped')
+
+    def test_list_items_with_combined_filters(self):
+        """ Get list of items matching every filter """
+        resp = self.app.get('/items?quantity=2&price_min=5')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'beer')
+
+        resp = self.app.get('/items?product_id=1,3&price_max=11')
+        self.assertEqual(len(json.loads(resp.data)), 1)
+
+        resp = self.app.get('/items?name=beer&name=hammer')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+
+    def test_list_with_bad_filter(self):
+        """ Filtering with a value of the wrong type """
+        resp = self.app.get('/orders?customer_id=abc')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/orders?date_from=tomorrow')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_order_with_items(self):
+        """ Get a single Order with its Items """
+        order = Order.find_by_customer_id(1)[0]
+        resp = self.app.get('/orders/{}?expand=items'.format(order.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data['items']), 2)
+        self.assertEqual(data['items'][0]['name'], 'hammer')
+
+    def test_list_orders_with_items(self):
+        """ List Orders with their Items in a constant number of queries """
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            resp = self.app.get('/orders?expand=items')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([len(order['items']) for order in data], [2, 1])
+        self.assertEqual(len(statements), 2)
+
+        resp = self.app.get('/orders?expand=items&limit=1')
+        self.assertEqual(len(json.loads(resp.data)[0]['items']), 2)
+        resp = self.app.get('/orders?expand=items&stream=true')
+        self.assertEqual(json.loads(resp.data), data)
+
+    def test_list_orders_paginated(self):
+        """ Page through Orders with after_id and limit """
+        resp = self.app.get('/orders?limit=1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        link = resp.headers.get('Link')
+        self.assertIn('rel="next"', link)
+        self.assertIn('after_id={}'.format(data[0]['id']), link)
+
+        resp = self.app.get('/orders?limit=1&after_id={}'.format(data[0]['id']))
+        next_data = json.loads(resp.data)
+        self.assertEqual(len(next_data), 1)
+        self.assertGreater(next_data[0]['id'], data[0]['id'])
+
+        resp = self.app.get('/orders?limit=1&after_id={}'.format(next_data[0]['id']))
+        self.assertEqual(json.loads(resp.data), [])
+        self.assertEqual(resp.headers.get('Link'), None)
+
+    def test_list_items_paginated_with_filter(self):
+        """ Page through Items while keeping the filter """
+        resp = self.app.get('/items?quantity=2&limit=1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 1)
+        self.assertIn('quantity=2', resp.headers.get('Link'))
+
+    def test_list_with_bad_limit(self):
+        """ Pagination rejects a bad limit """
+        resp = self.app.get('/orders?limit=abc')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/items?limit=0')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_items(self):
+        """ Stream every Item as a JSON array """
+        resp = self.app.get('/items?stream=true')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 3)
+        self.assertEqual([item['id'] for item in data], [1, 2, 3])
+
+    def test_stream_orders(self):
+        """ Stream every Order as a JSON array """
+        resp = self.app.get('/orders?stream=true&status=processing')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(len(data), 2)
+        self.assertIn('date', data[0])
+
+    def test_export_orders_ndjson(self):
+        """ Export Orders with their Items as NDJSON """
+        Order(customer_id=3, date=datetime.now(), status='shipped').save()
+        resp = self.app.get('/orders/export')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        orders = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([order['customer_id'] for order in orders], [1, 2, 3])
+        self.assertEqual([item['name'] for item in orders[0]['items']],
+                         ['hammer', 'toilet paper'])
+        self.assertEqual(orders[1]['items'][0]['order_id'], orders[1]['id'])
+        self.assertEqual(orders[2]['items'], [])
+
+    def test_export_orders_like_expanded_orders(self):
+        """ Export the Orders the way GET /orders?expand=items returns them """
+        resp = self.app.get('/orders/export')
+        lines = resp.data.splitlines()
+        self.assertNotIn('": ', lines[0])
+        resp = self.app.get('/orders?expand=items')
+        self.assertEqual([json.loads(line) for line in lines], json.loads(resp.data))
+
+    def test_export_orders_csv_filtered(self):
+        """ Export the Items of filtered Orders as CSV """
+        resp = self.app.get('/orders/export?format=csv&customer_id=1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        lines = resp.data.splitlines()
+        self.assertEqual(lines[0], 'order_id,customer_id,date,status,item_count,order_total,'
+                                   'order_version,item_id,product_id,name,quantity,price,'
+                                   'item_version')
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].endswith(',processing,2,16.5,3,2,2,toilet paper,2,2.5,1'))
+
+    def test_export_orders_gzip(self):
+        """ Export Orders gzip compressed when the client accepts it """
+        resp = self.app.get('/orders/export', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        lines = zlib.decompress(resp.data, zlib.MAX_WBITS | 16).splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_get_order_total(self):
+        """ Get the totals of an Order """
+        order = Order.find_by_customer_id(1)[0]
+        resp = self.app.get('/orders/{}/total'.format(order.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data), {'order_id': order.id, 'item_count': 2,
+                                                 'quantity': 3, 'total': 16.5})
+        resp = self.app.get('/orders/0/total')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_order_totals(self):
+        """ List the totals of every Order in one query """
+        Order(customer_id=3, date=datetime.now(), status='shipped').save()
+        resp = self.app.get('/orders/totals')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([row['item_count'] for row in data], [2, 1, 0])
+        self.assertEqual([row['total'] for row in data], [16.5, 21.0, 0])
+        resp = self.app.get('/orders/totals?status=shipped')
+        self.assertEqual(len(json.loads(resp.data)), 1)
+        resp = self.app.get('/orders/totals?limit=2')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+        self.assertIn('rel="next"', resp.headers['Link'])
+
+    def test_list_orders_by_total(self):
+        """ List Orders by their stored total """
+        resp = self.app.get('/orders?min_total=20')
+        data = json.loads(resp.data)
+        self.assertEqual([order['order_total'] for order in data], [21.0])
+        self.assertEqual(data[0]['item_count'], 1)
+        resp = self.app.delete('/orders/1/items/2')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get('/orders?max_total=12')
+        self.assertEqual([order['order_total'] for order in json.loads(resp.data)], [11.5])
+
+    def test_revenue_report(self):
+        """ Report the revenue by customer, product, day and status """
+        Order(customer_id=1, date=datetime(2018, 1, 1), status='shipped').save_with_items(
+            [Item(product_id=1, name='hammer', quantity=2, price=11.50)])
+        resp = self.app.get('/reports/revenue?group_by=customer')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data), [
+            {'customer_id': 1, 'orders': 2, 'items': 3, 'quantity': 5, 'revenue': 39.5},
+            {'customer_id': 2, 'orders': 1, 'items': 1, 'quantity': 2, 'revenue': 21.0}])
+        data = json.loads(self.app.get('/reports/revenue?group_by=product').data)
+        self.assertEqual([(row['product_id'], row['revenue']) for row in data],
+                         [(1, 34.5), (2, 5.0), (3, 21.0)])
+        data = json.loads(self.app.get('/reports/revenue?group_by=day&to=2018-01-02').data)
+        self.assertEqual(data, [{'day': '2018-01-01', 'orders': 1, 'items': 1,
+                                 'quantity': 2, 'revenue': 23.0}])
+        data = json.loads(self.app.get('/reports/revenue?group_by=status').data)
+        self.assertEqual([row['status'] for row in data], ['processing', 'shipped'])
+
+    def test_revenue_report_to_whole_day(self):
+        """ Report the revenue up to a date including the whole day """
+        Order(customer_id=1, date=datetime(2018, 1, 2, 15, 30), status='shipped').save_with_items(
+            [Item(product_id=1, name='hammer', quantity=2, price=11.50)])
+        data = json.loads(self.app.get('/reports/revenue?group_by=day&to=2018-01-02').data)
+        self.assertEqual([(row['day'], row['revenue']) for row in data], [('2018-01-02', 23.0)])
+        data = json.loads(self.app.get('/reports/revenue?group_by=day&to=2018-01-02T15:30').data)
+        self.assertEqual(len(data), 1)
+        data = json.loads(self.app.get('/reports/revenue?group_by=day&to=2018-01-02T15:29').data)
+        self.assertEqual(data, [])
+        resp = self.app.get('/reports/revenue?group_by=day&to=yesterday')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revenue_report_bad_group(self):
+        """ Report the revenue by an unknown group """
+        resp = self.app.get('/reports/revenue?group_by=weather')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/reports/revenue')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_orders_bad_format(self):
+        """ Export with an unknown format """
+        resp = self.app.get('/orders/export?format=xml')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_order_item_list(self):
         """ Get a list of Items from an Order """
         order = Order.find_by_customer_id(1)[0]
@@ -170,6 +408,74 @@ class TestServer(unittest.TestCase):
         data = json.loads(resp.data)
         self.assertEqual(data['price'], 11.5)
 
+    def test_get_order_from_cache(self):
+        """ A second read of an Order is served from the cache """
+        hits = server.cache.hits
+        resp = self.app.get('/orders/1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get('/orders/1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['customer_id'], 1)
+        resp = self.app.get('/cache/stats')
+        self.assertEqual(json.loads(resp.data)['hits'], hits + 1)
+
+    def test_cache_invalidated_on_write(self):
+        """ Writes are visible to the next read of a cached row """
+        self.app.get('/orders/1')
+        self.app.put('/orders/1/cancel', content_type='application/json')
+        resp = self.app.get('/orders/1')
+        self.assertEqual(json.loads(resp.data)['status'], 'cancelled')
+
+        self.app.get('/items/1')
+        new_item = {'product_id': 1, 'name': 'mallet', 'quantity': 1, 'price': 9.5}
+        self.app.put('/orders/1/items/1', data=json.dumps(new_item),
+                     content_type='application/json')
+        resp = self.app.get('/items/1')
+        self.assertEqual(json.loads(resp.data)['name'], 'mallet')
+
+        self.app.delete('/orders/1')
+        resp = self.app.get('/items/1')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get('/orders/1')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_order_not_modified(self):
+        """ Get an unchanged Order with If-None-Match """
+        resp = self.app.get('/orders/1')
+        etag = resp.headers.get('ETag')
+        self.assertNotEqual(etag, None)
+        resp = self.app.get('/orders/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(resp.data), 0)
+
+        self.app.put('/orders/1/cancel', content_type='application/json')
+        resp = self.app.get('/orders/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers.get('ETag'), etag)
+
+    def test_list_not_modified(self):
+        """ Get unchanged lists with If-None-Match """
+        for url in ('/orders', '/items?order_id=1', '/orders/1/items', '/items/1'):
+            resp = self.app.get(url)
+            etag = resp.headers.get('ETag')
+            resp = self.app.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_update_item_with_stale_etag(self):
+        """ Update an Item with an If-Match that is out of date """
+        resp = self.app.get('/items/1')
+        etag = resp.headers.get('ETag')
+        new_item = {'product_id': 1, 'name': 'mallet', 'quantity': 1, 'price': 9.5}
+        resp = self.app.put('/orders/1/items/1', data=json.dumps(new_item),
+                            content_type='application/json', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_item['name'] = 'sledgehammer'
+        resp = self.app.put('/orders/1/items/1', data=json.dumps(new_item),
+                            content_type='application/json', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get('/items/1')
+        self.assertEqual(json.loads(resp.data)['name'], 'mallet')
+
     def test_get_order_not_found(self):
         """ Get an order thats not found """
         resp = self.app.get('/orders/0')
@@ -276,6 +582,77 @@ class TestServer(unittest.TestCase):
         new_count = self.get_order_count()
         self.assertEqual(new_count, order_count - 1)
 
+    def test_delete_many_orders(self):
+        """ Deleting many Orders and their Items at once """
+        order = Order(customer_id=3, date=datetime.now(), status='cancelled')
+        order.save()
+        resp = self.app.delete('/orders?ids=1,{}&ids=99'.format(order.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['deleted'], 2)
+        self.assertEqual(self.get_order_count(), 1)
+        self.assertEqual(self.get_item_count(), 1)
+
+    def test_delete_many_orders_without_ids(self):
+        """ Deleting many Orders needs a list of ids """
+        resp = self.app.delete('/orders')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete('/orders?ids=1,two')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_order_count(), 2)
+
+    def test_update_many_orders_status(self):
+        """ Ship many Orders by id in one request """
+        order = Order(customer_id=3, date=datetime.now(), status='cancelled')
+        order.save()
+        self.app.get('/orders/1')  # cache the Order
+        body = {'status': 'shipped', 'ids': [1, 2, order.id, 99]}
+        resp = self.app.put('/orders/status', data=json.dumps(body),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['updated'], 2)
+        resp = self.app.get('/orders/1')
+        self.assertEqual(json.loads(resp.data)['status'], 'shipped')
+        # a cancelled Order cannot be shipped
+        resp = self.app.get('/orders/{}'.format(order.id))
+        self.assertEqual(json.loads(resp.data)['status'], 'cancelled')
+
+    def test_update_orders_status_by_filter(self):
+        """ Cancel the Orders of a customer selected by a filter """
+        Order(customer_id=1, date=datetime(2018, 1, 1), status='processing').save()
+        body = {'status': 'cancelled',
+                'filter': {'customer_id': 1, 'date_from': '2018-01-01', 'date_to': '2018-01-02'}}
+        resp = self.app.put('/orders/status', data=json.dumps(body),
+                            content_type='application/json')
+        self.assertEqual(json.loads(resp.data)['updated'], 1)
+        resp = self.app.get('/orders?status=cancelled')
+        self.assertEqual([o['customer_id'] for o in json.loads(resp.data)], [1])
+        body = {'status': 'returned', 'filter': {'customer_id': [1, 2]}}
+        resp = self.app.put('/orders/status', data=json.dumps(body),
+                            content_type='application/json')
+        self.assertEqual(json.loads(resp.data)['updated'], 0)
+
+    def test_update_orders_status_bad_requests(self):
+        """ Changing the status of many Orders needs a valid status and selection """
+        for body in ({'status': 'lost', 'ids': [1]}, {'status': 'shipped'},
+                     {'status': 'shipped', 'ids': 'all'}, {'status': 'shipped', 'ids': ['x']},
+                     {'status': 'shipped', 'filter': {'customer_id': 'x'}}, ['shipped']):
+            resp = self.app.put('/orders/status', data=json.dumps(body),
+                                content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/orders?status=processing')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+
+    def test_update_orders_status_blank_filter(self):
+        """ A blank or unknown filter does not select every Order """
+        for args in ({'customer_id': ''}, {'customer_id': []}, {'customer_id': None},
+                     {'status': 'processing,'}, {'cusomer_id': 1}):
+            body = {'status': 'cancelled', 'filter': args}
+            resp = self.app.put('/orders/status', data=json.dumps(body),
+                                content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/orders?status=processing')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+
     def test_update_item(self):
         """ Update an existing Item """
         item = Item.find_by_name('toilet paper')[0]
@@ -286,6 +663,80 @@ class TestServer(unittest.TestCase):
         new_json = json.loads(resp.data)
         self.assertEqual(new_json['name'], 'wrench')
 
+    def test_update_item_bad_numbers(self):
+        """ An Item update with a quantity or price that is not a number is rejected """
+        for quantity, price in (('a', 11.5), (1, 'cheap')):
+            new_item = {'product_id': 2, 'name': 'wrench', 'quantity': quantity, 'price': price}
+            resp = self.app.put('/orders/1/items/1', data=json.dumps(new_item),
+                                content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/items/1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(json.loads(resp.data)['name'], 'wrench')
+
+    def test_patch_items(self):
+        """ Add, update and remove Items of an Order in one request """
+        operations = [
+            {'op': 'add', 'product_id': 4, 'name': 'saw', 'quantity': 1, 'price': 20.0},
+            {'op': 'update', 'id': 1, 'product_id': 1, 'name': 'hammer',
+             'quantity': 3, 'price': 11.50},
+            {'op': 'remove', 'id': 2},
+        ]
+        resp = self.app.patch('/orders/1/items', data=json.dumps(operations),
+                              content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([item['name'] for item in data], ['hammer', 'saw'])
+        self.assertEqual(data[0]['quantity'], 3)
+        resp = self.app.get('/items/2')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_items_of_another_order(self):
+        """ Operations on Items of another Order change nothing """
+        operations = [
+            {'op': 'add', 'product_id': 4, 'name': 'saw', 'quantity': 1, 'price': 20.0},
+            {'op': 'remove', 'id': 3},
+        ]
+        item_count = self.get_item_count()
+        resp = self.app.patch('/orders/1/items', data=json.dumps(operations),
+                              content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_item_count(), item_count)
+
+    def test_patch_items_bad_operations(self):
+        """ Invalid operations are rejected """
+        for operations in ({'op': 'add'}, [{'op': 'rename', 'id': 1}], [{'op': 'add'}]):
+            resp = self.app.patch('/orders/1/items', data=json.dumps(operations),
+                                  content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch('/orders/99/items', data='[]',
+                              content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_items_bad_numbers(self):
+        """ Items with a quantity or price that is not a number are rejected """
+        item = {'product_id': 4, 'name': 'saw', 'quantity': 1, 'price': 20.0}
+        item_count = self.get_item_count()
+        for operations in ([dict(item, op='add', quantity='x')],
+                           [dict(item, op='add', price='cheap')],
+                           [dict(item, op='update', id=1, price='cheap')]):
+            resp = self.app.patch('/orders/1/items', data=json.dumps(operations),
+                                  content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_item_count(), item_count)
+        self.assertEqual(Item.get(1).quantity, 1)
+
+    def test_patch_items_same_item_twice(self):
+        """ An Item cannot be changed twice in one request """
+        item = {'product_id': 1, 'name': 'hammer', 'quantity': 3, 'price': 11.50}
+        for operations in ([{'op': 'remove', 'id': 1}, dict(item, op='update', id=1)],
+                           [dict(item, op='update', id=1), dict(item, op='update', id=1)],
+                           [{'op': 'remove', 'id': 1}, {'op': 'remove', 'id': 1}]):
+            resp = self.app.patch('/orders/1/items', data=json.dumps(operations),
+                                  content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.app.get('/items/1').status_code, status.HTTP_200_OK)
+
     def test_delete_item(self):
         """ Deleting an Item from an Order"""
         item = Item.find_by_name('toilet paper')[0]
@@ -307,6 +758,67 @@ class TestServer(unittest.TestCase):
                                content_type='application/json')
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_order_with_stale_version(self):
+        """ Concurrent updates of an Order conflict instead of overwriting """
+        version = json.loads(self.app.get('/orders/1').data)['version']
+        order = {'customer_id': 1, 'date': '2018-04-23T11:11', 'status': 'shipped',
+                 'version': version}
+        resp = self.app.put('/orders/1', data=json.dumps(order),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['version'], version + 1)
+        self.assertEqual(resp.headers['ETag'], '"{}"'.format(version + 1))
+        order['status'] = 'returned'
+        resp = self.app.put('/orders/1', data=json.dumps(order),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(json.loads(self.app.get('/orders/1').data)['status'], 'shipped')
+        order['version'] = 'two'
+        resp = self.app.put('/orders/1', data=json.dumps(order),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        del order['version']
+        resp = self.app.put('/orders/99', data=json.dumps(order),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cancel_order_with_stale_etag(self):
+        """ Cancel an Order with an If-Match that is out of date """
+        etag = self.app.get('/orders/1').headers['ETag']
+        resp = self.app.put('/orders/1', data=json.dumps(
+            {'customer_id': 1, 'date': '2018-04-23T11:11', 'status': 'shipped'}),
+                            content_type='application/json')
+        new_etag = resp.headers['ETag']
+        resp = self.app.put('/orders/1/cancel', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put('/orders/1/cancel', headers={'If-Match': 'W/' + new_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(resp.data)['status'], 'cancelled')
+        resp = self.app.put('/orders/99/cancel')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_item_with_stale_version(self):
+        """ Deleting an Item that changed since it was read conflicts """
+        new_item = {'product_id': 1, 'name': 'mallet', 'quantity': 1, 'price': 9.5}
+        self.app.put('/orders/1/items/1', data=json.dumps(new_item),
+                     content_type='application/json')
+        resp = self.app.delete('/orders/1/items/1', data=json.dumps({'version': 1}),
+                               content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.delete('/orders/1/items/1', headers={'If-Match': '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete('/orders/1/items/1', headers={'If-Match': '"2"'})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(json.loads(self.app.get('/orders/1/total').data)['item_count'], 1)
+
+    def test_update_item_of_another_order(self):
+        """ An Item is only updated through its own Order """
+        new_item = {'product_id': 1, 'name': 'mallet', 'quantity': 1, 'price': 9.5}
+        resp = self.app.put('/orders/2/items/1', data=json.dumps(new_item),
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(self.app.get('/items/1').data)['name'], 'hammer')
+
     def test_method_not_allowed(self):
         """ Call a Method thats not Allowed """
         resp = self.app.post('/orders/0')
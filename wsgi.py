@@ -0,0 +1,17 @@
+"""
+Order Service WSGI entry point
+Used by the production server started from the Procfile:
+  gunicorn -c gunicorn_config.py wsgi:app
+
+Like manage.py the DATABASE_URI environment variable, when set,
+overrides SQLALCHEMY_DATABASE_URI from the config.
+"""
+
+import os
+from app import app, server
+
+DATABASE_URI = os.getenv('DATABASE_URI', None)
+if DATABASE_URI:
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+
+server.initialize_logging()